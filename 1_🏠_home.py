@@ -1,10 +1,17 @@
+import os
+import logging
 import streamlit as st
 import pandas as pd
 from datetime import date
 from utils import get_channels_and_ufs, get_monthly_revenue, get_brand_data, get_rfm_summary, create_rfm_heatmap, get_colaboradores,get_client_status
+from aquecimento import PREWARM_SCHEDULER, start_prewarm_scheduler
 
 st.set_page_config(page_title="Dashboard de Vendas", layout="wide")
 
+# Logging configurado no ponto de entrada (não no import de utils). O tempo por fase das
+# consultas fica nos traces (rastreio.py), não em logs INFO.
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'WARNING'), format='%(asctime)s - %(levelname)s - %(message)s')
+
 @st.cache_data
 def load_initial_data():
     today = date.today()
@@ -41,6 +48,11 @@ def initialize_session_state():
 def main():
     initialize_session_state()
 
+    # Com PREWARM_SCHEDULER=1 o próprio processo do Streamlit pré-aquece o cache todo dia
+    # em PREWARM_AT (alternativa ao cron com `python aquecimento.py`)
+    if PREWARM_SCHEDULER:
+        start_prewarm_scheduler()
+
     st.title('Dashboard de Vendas - Home')
     st.write("Bem-vindo ao Dashboard de Vendas!")
     st.write("Use o menu lateral para navegar entre as diferentes análises.")
@@ -0,0 +1,230 @@
+import os
+import time
+import heapq
+import random
+import logging
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+
+
+# Controle de admissão das queries no Athena. A conta tem um limite de queries DML
+# simultâneas; acima dele o StartQueryExecution falha com throttling. O processo limita
+# as queries em andamento e enfileira as demais por prioridade: carregamentos
+# interativos das páginas passam na frente do pré-aquecimento e de jobs em lote.
+# Erros de throttling que ainda acontecem (outros processos na mesma conta) viram uma
+# espera curta com backoff e nova tentativa.
+ATHENA_MAX_CONCURRENT = int(os.environ.get('ATHENA_MAX_CONCURRENT', os.environ.get('ATHENA_POOL_SIZE', '8')))
+ATHENA_THROTTLE_RETRIES = int(os.environ.get('ATHENA_THROTTLE_RETRIES', '5'))
+ATHENA_THROTTLE_BACKOFF = float(os.environ.get('ATHENA_THROTTLE_BACKOFF', '1'))
+ATHENA_THROTTLE_MAX_BACKOFF = float(os.environ.get('ATHENA_THROTTLE_MAX_BACKOFF', '20'))
+
+# Menor valor = maior prioridade
+PRIORITY_INTERACTIVE = 0
+PRIORITY_PREWARM = 10
+PRIORITY_BATCH = 20
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: 'interativa',
+    PRIORITY_PREWARM: 'aquecimento',
+    PRIORITY_BATCH: 'lote',
+}
+
+# Mensagens do Athena/boto3 que indicam limite de concorrência ou de taxa
+THROTTLING_MARKERS = ('TooManyRequestsException', 'ThrottlingException', 'Rate exceeded', 'TOO_MANY_REQUESTS', 'SlowDown')
+
+# Janela de esperas recentes usada nas estatísticas
+WAIT_SAMPLES = 500
+
+_priority = contextvars.ContextVar('admissao_priority', default=PRIORITY_INTERACTIVE)
+_ticket = contextvars.ContextVar('admissao_ticket', default=None)
+_ticket_lock = threading.Lock()
+
+
+def current_priority():
+    return _priority.get()
+
+
+@contextmanager
+def query_priority(priority):
+    # Queries disparadas dentro do bloco (inclusive em threads que copiem o contexto)
+    # entram na fila com esta prioridade
+    token = _priority.set(priority)
+    try:
+        yield priority
+    finally:
+        _priority.reset(token)
+
+
+class PriorityTicket:
+    # Prioridade de uma execução compartilhada (single-flight): quem passa a esperar pelo
+    # resultado com prioridade maior promove a execução, inclusive se ela já estiver na fila.
+    # Sem isso, uma página que pega carona no aquecimento esperaria atrás das interativas.
+    __slots__ = ('priority', 'controller', 'waiter')
+
+    def __init__(self, priority):
+        self.priority = priority
+        self.controller = None
+        self.waiter = None
+
+    def promote(self, priority):
+        with _ticket_lock:
+            if priority >= self.priority:
+                return
+            self.priority = priority
+            controller, waiter = self.controller, self.waiter
+        if controller is not None and waiter is not None:
+            controller._requeue(waiter, priority)
+
+
+@contextmanager
+def priority_ticket(ticket):
+    # As queries do bloco usam a prioridade do ticket (e a acompanham se ela for promovida)
+    token = _ticket.set(ticket)
+    try:
+        yield ticket
+    finally:
+        _ticket.reset(token)
+
+
+def is_throttling_error(error):
+    text = f"{type(error).__name__}: {error}"
+    return any(marker in text for marker in THROTTLING_MARKERS)
+
+
+class _Waiter:
+    __slots__ = ('priority', 'event', 'admitted', 'abandoned')
+
+    def __init__(self, priority):
+        self.priority = priority
+        self.event = threading.Event()
+        self.admitted = False
+        self.abandoned = False
+
+
+class AdmissionController:
+    def __init__(self, max_concurrent=ATHENA_MAX_CONCURRENT):
+        self.max_concurrent = max_concurrent
+        self._lock = threading.Lock()
+        self._queue = []  # heap de (prioridade, ordem de chegada, _Waiter)
+        self._sequence = 0
+        self._in_flight = 0
+        self._waits = deque(maxlen=WAIT_SAMPLES)
+        self.counters = {'admitidas': 0, 'enfileiradas': 0, 'abandonadas': 0, 'throttling': 0}
+
+    def _admit_next(self):
+        # Com o lock: entrega as vagas livres aos primeiros da fila. Entradas antigas de
+        # esperas promovidas (já admitidas) e de esperas canceladas são descartadas.
+        while self._queue and self._in_flight < self.max_concurrent:
+            _, _, waiter = heapq.heappop(self._queue)
+            if waiter.abandoned or waiter.admitted:
+                continue
+            waiter.admitted = True
+            self._in_flight += 1
+            waiter.event.set()
+
+    def acquire(self, priority=None, register_cancel=None):
+        # register_cancel(callback) -> desfazer: permite que o cancelamento do escopo da
+        # execução (rerun) interrompa a espera na fila. Devolve o tempo de espera em ms.
+        priority = current_priority() if priority is None else priority
+        ticket = _ticket.get()
+        started = time.perf_counter()
+        with self._lock:
+            if ticket is not None:
+                with _ticket_lock:
+                    priority = min(priority, ticket.priority)
+            if self._in_flight < self.max_concurrent and not self._queue:
+                self._in_flight += 1
+                self.counters['admitidas'] += 1
+                self._waits.append((0.0, priority))
+                return 0.0
+            waiter = _Waiter(priority)
+            if ticket is not None:
+                with _ticket_lock:
+                    # Promoção que chegou depois da leitura acima: já entra com ela
+                    waiter.priority = min(priority, ticket.priority)
+                    ticket.controller, ticket.waiter = self, waiter
+            self._sequence += 1
+            heapq.heappush(self._queue, (waiter.priority, self._sequence, waiter))
+            self.counters['enfileiradas'] += 1
+            depth = len(self._queue)
+            # A fila pode ter só entradas descartáveis com vagas livres
+            self._admit_next()
+        logging.info(f"Query na fila do Athena (prioridade {PRIORITY_NAMES.get(priority, priority)}, {depth} aguardando)")
+
+        unregister = None
+        try:
+            if register_cancel:
+                unregister = register_cancel(waiter.event.set)
+            waiter.event.wait()
+        finally:
+            if unregister:
+                unregister()
+            with self._lock:
+                if not waiter.admitted:
+                    # Cancelada antes de ser admitida: sai da fila sem ocupar vaga
+                    waiter.abandoned = True
+                    self.counters['abandonadas'] += 1
+        if not waiter.admitted:
+            return None
+        waited = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self.counters['admitidas'] += 1
+            self._waits.append((waited, priority))
+        return waited
+
+    def _requeue(self, waiter, priority):
+        # Promoção: nova entrada com a prioridade maior; a antiga é descartada ao sair da fila
+        with self._lock:
+            if waiter.admitted or waiter.abandoned or priority >= waiter.priority:
+                return
+            waiter.priority = priority
+            self._sequence += 1
+            heapq.heappush(self._queue, (priority, self._sequence, waiter))
+
+    def release(self):
+        with self._lock:
+            self._in_flight -= 1
+            self._admit_next()
+
+    def throttled(self, attempt):
+        # Backoff exponencial com jitter; devolve quantos segundos esperar
+        with self._lock:
+            self.counters['throttling'] += 1
+        delay = min(ATHENA_THROTTLE_MAX_BACKOFF, ATHENA_THROTTLE_BACKOFF * 2 ** attempt)
+        return delay * random.uniform(0.5, 1.0)
+
+    def stats(self):
+        with self._lock:
+            queued = {}
+            for waiter in {id(waiter): waiter for _, _, waiter in self._queue}.values():
+                if not waiter.abandoned and not waiter.admitted:
+                    name = PRIORITY_NAMES.get(waiter.priority, str(waiter.priority))
+                    queued[name] = queued.get(name, 0) + 1
+            waits = sorted(wait for wait, _ in self._waits)
+            return dict(
+                self.counters,
+                limite=self.max_concurrent,
+                em_andamento=self._in_flight,
+                na_fila=sum(queued.values()),
+                fila_por_prioridade=queued,
+                espera_media_ms=sum(waits) / len(waits) if waits else 0.0,
+                espera_p95_ms=waits[int(0.95 * (len(waits) - 1))] if waits else 0.0,
+            )
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_admission_controller():
+    global _controller
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                _controller = AdmissionController()
+    return _controller
+
+
+def admission_stats():
+    return get_admission_controller().stats()
@@ -0,0 +1,165 @@
+import os
+import time
+import logging
+import argparse
+import threading
+from datetime import date, datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from admissao import PRIORITY_PREWARM, query_priority
+from backends import QUERY_BACKEND
+from filtros import FilterSet
+from materializacao import refresh_cmv_mensal
+from status_clientes import STATUS_OPEN_MONTH_TTL
+from rastreio import span
+from utils import get_brand_data, get_channels_and_ufs, get_client_status, get_colaboradores, get_monthly_revenue
+
+
+# Pré-aquecimento do cache: calcula, antes do expediente, a visão padrão do dashboard
+# (período de DEFAULT_START_DATE até hoje, sem filtros) para todos os vendedores e para a
+# visão geral. Os resultados ficam no cache de resultados em disco e nos snapshots de
+# status de clientes, compartilhados com o processo do Streamlit.
+# Pela linha de comando (`python aquecimento.py`, outro processo) só esses caches em disco
+# são aquecidos; st.cache_data/st.cache_resource vivem na memória do processo do
+# Streamlit e só são aquecidos pelo agendador interno (PREWARM_SCHEDULER=1).
+DEFAULT_START_DATE = date(2024, 1, 1)
+PREWARM_WORKERS = int(os.environ.get('PREWARM_WORKERS', '4'))
+# Horário diário (HH:MM, hora local do container) do agendador em background. Perto do
+# início do expediente: o snapshot do mês aberto vale STATUS_OPEN_MONTH_TTL segundos, e um
+# aquecimento feito muito antes já estaria vencido no primeiro acesso
+PREWARM_AT = os.environ.get('PREWARM_AT', '07:30')
+# Início do expediente (HH:MM), usado para avisar quando o aquecimento vence antes dele
+BUSINESS_START = os.environ.get('BUSINESS_START', '08:00')
+# Liga o agendador em background dentro do processo do Streamlit
+PREWARM_SCHEDULER = os.environ.get('PREWARM_SCHEDULER', '0') == '1'
+# Atualiza os meses abertos de cmv_mensal antes de aquecer o cache (só no Athena: o
+# espelho local já traz a tabela pronta)
+PREWARM_REFRESH_CMV = os.environ.get('PREWARM_REFRESH_CMV', '1' if QUERY_BACKEND == 'athena' else '0') == '1'
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def default_filters(today=None, cod_colaborador=''):
+    # Mesmos filtros que a página de performance monta no primeiro acesso
+    return FilterSet(cod_colaborador=cod_colaborador, start_date=DEFAULT_START_DATE, end_date=today or date.today())
+
+
+def prewarm_targets(today=None, limit=None):
+    # Visão geral + um FilterSet por vendedor com vendas no período
+    base = default_filters(today)
+    colaboradores = get_colaboradores(base.only('start_date', 'end_date', 'channels', 'ufs'))
+    codigos = []
+    if not colaboradores.empty:
+        codigos = sorted(colaboradores['cod_colaborador'].dropna().astype(str).unique())
+    targets = [base] + [base.replace(cod_colaborador=cod) for cod in codigos if cod.strip()]
+    return targets[:limit] if limit else targets
+
+
+def prewarm_view(filters):
+    # Mesmas chamadas (e projeções de filtros) da página de performance, para gerar o
+    # mesmo SQL e, portanto, as mesmas chaves de cache. Na fila do Athena, cede a vez às
+    # páginas abertas pelos usuários.
+    started = time.perf_counter()
+    with query_priority(PRIORITY_PREWARM), span('aquecimento', filtros=filters.key):
+        get_channels_and_ufs(filters.only('cod_colaborador', 'start_date', 'end_date'))
+        get_monthly_revenue(filters)
+        get_brand_data(filters.replace(brands=()))
+        get_client_status(filters.replace(brands=()))
+    return time.perf_counter() - started
+
+
+def refresh_materialized(today=None):
+    # Falha aqui não impede o aquecimento: as consultas calculam o CMV na hora para os
+    # meses que a tabela não cobre
+    try:
+        refresh_cmv_mensal(end=today)
+        return 'ok'
+    except Exception as e:
+        logging.error(f"Falha ao atualizar cmv_mensal antes do pré-aquecimento: {str(e)}", exc_info=True)
+        return 'erro'
+
+
+def run_prewarm(today=None, workers=PREWARM_WORKERS, limit=None, refresh_cmv=PREWARM_REFRESH_CMV):
+    started = time.perf_counter()
+    cmv_mensal = refresh_materialized(today) if refresh_cmv else 'desligado'
+    targets = prewarm_targets(today, limit)
+    logging.info(f"Pré-aquecimento: {len(targets)} visões com até {workers} em paralelo")
+    summary = {'visoes': len(targets), 'ok': 0, 'erros': 0, 'cmv_mensal': cmv_mensal}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prewarm') as executor:
+        futures = {executor.submit(prewarm_view, filters): filters for filters in targets}
+        for future in as_completed(futures):
+            filters = futures[future]
+            try:
+                elapsed = future.result()
+                summary['ok'] += 1
+                logging.info(f"Visão aquecida ({filters.cod_colaborador or 'todos'}) em {elapsed:.1f}s")
+            except Exception as e:
+                summary['erros'] += 1
+                logging.error(f"Falha ao aquecer a visão de {filters.cod_colaborador or 'todos'}: {str(e)}")
+    summary['segundos'] = round(time.perf_counter() - started, 1)
+    logging.info(f"Pré-aquecimento concluído: {summary}")
+    return summary
+
+
+def seconds_until(at, now=None):
+    now = now or datetime.now()
+    hour, minute = (int(part) for part in at.split(':'))
+    target = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if target <= now:
+        target += timedelta(days=1)
+    return (target - now).total_seconds()
+
+
+def check_prewarm_schedule(at, business_start=BUSINESS_START, open_month_ttl=STATUS_OPEN_MONTH_TTL):
+    # O snapshot do mês aberto gravado às `at` precisa continuar válido no início do expediente
+    minutes = [int(part[0]) * 60 + int(part[1]) for part in (at.split(':'), business_start.split(':'))]
+    gap = (minutes[1] - minutes[0]) % (24 * 60) * 60
+    if gap > open_month_ttl:
+        logging.warning(
+            f"Pré-aquecimento às {at} vence antes do expediente ({business_start}): "
+            f"STATUS_OPEN_MONTH_TTL={open_month_ttl}s, intervalo de {gap:.0f}s"
+        )
+        return False
+    return True
+
+
+def _scheduler_loop(at, workers):
+    check_prewarm_schedule(at)
+    while True:
+        wait = seconds_until(at)
+        logging.info(f"Próximo pré-aquecimento em {wait / 3600:.1f}h ({at})")
+        time.sleep(wait)
+        try:
+            run_prewarm(workers=workers)
+        except Exception as e:
+            logging.error(f"Pré-aquecimento falhou: {str(e)}", exc_info=True)
+
+
+def start_prewarm_scheduler(at=PREWARM_AT, workers=PREWARM_WORKERS):
+    # Uma única thread por processo, mesmo com várias sessões abrindo a home
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None or not _scheduler.is_alive():
+            _scheduler = threading.Thread(target=_scheduler_loop, args=(at, workers), name='prewarm-scheduler', daemon=True)
+            _scheduler.start()
+    return _scheduler
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Pré-aquece o cache com a visão padrão de todos os vendedores.")
+    parser.add_argument('--workers', type=int, default=PREWARM_WORKERS, help="Visões calculadas em paralelo.")
+    parser.add_argument('--limite', type=int, help="Aquece apenas as N primeiras visões (testes).")
+    parser.add_argument('--agendar', metavar='HH:MM', help="Fica em execução e repete todo dia no horário informado.")
+    args = parser.parse_args()
+
+    if args.agendar:
+        _scheduler_loop(args.agendar, args.workers)
+    else:
+        summary = run_prewarm(workers=args.workers, limit=args.limite)
+        raise SystemExit(1 if summary['erros'] else 0)
+
+
+if __name__ == "__main__":
+    main()
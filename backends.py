@@ -0,0 +1,445 @@
+import os
+import time
+import logging
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+
+from pyathena import connect
+from pyathena.async_cursor import AsyncCursor
+from pyathena.arrow.async_cursor import AsyncArrowCursor
+from pyathena.error import OperationalError
+from pyathena.pandas.util import as_pandas
+from dotenv import load_dotenv
+
+from admissao import ATHENA_THROTTLE_RETRIES, get_admission_controller, is_throttling_error
+from rastreio import span
+
+
+# Carregar variáveis de ambiente
+load_dotenv()
+
+# Configurações de conexão Athena
+ATHENA_S3_STAGING_DIR = os.environ.get('ATHENA_S3_STAGING_DIR', 's3://databeautykamico/Athena/')
+ATHENA_REGION = os.environ.get('ATHENA_REGION', 'us-east-1')
+
+# Pool de conexões Athena compartilhado por todas as sessões do processo
+ATHENA_POOL_SIZE = int(os.environ.get('ATHENA_POOL_SIZE', '8'))
+ATHENA_POOL_TIMEOUT = float(os.environ.get('ATHENA_POOL_TIMEOUT', '60'))
+# Conexões ociosas por mais tempo que isso passam por health check antes de serem reutilizadas
+ATHENA_POOL_MAX_IDLE = float(os.environ.get('ATHENA_POOL_MAX_IDLE', '300'))
+# Conexões mais velhas que isso são recriadas (renova sessão boto3 e credenciais)
+ATHENA_POOL_MAX_AGE = float(os.environ.get('ATHENA_POOL_MAX_AGE', '3600'))
+
+# Backend de consulta: 'athena' (padrão) ou 'local' (DuckDB sobre o espelho Parquet)
+QUERY_BACKEND = os.environ.get('QUERY_BACKEND', 'athena')
+
+# Espelho local do bucket, com a mesma organização de estrutura_bucket.txt
+# (<raiz>/<camada>/<database>/<tabela>/**/*.parquet)
+LOCAL_MIRROR_DIR = os.environ.get('LOCAL_MIRROR_DIR', 'datalake')
+LOCAL_MIRROR_LAYERS = ('gold', 'silver', 'bronze')
+# Tipos das chaves de partição no espelho, como declarados na partition projection do
+# Athena (particoes.PARTITION_PROJECTIONS): diretórios month=01 viram inteiros, não texto
+LOCAL_HIVE_TYPES = {'year': 'INTEGER', 'month': 'INTEGER'}
+ATHENA_DATABASE = 'databeautykami'
+
+# Intervalo (segundos) entre consultas ao estado de uma query submetida ao Athena
+ATHENA_POLL_INTERVAL = float(os.environ.get('ATHENA_POLL_INTERVAL', '1'))
+
+
+class QueryCancelled(BaseException):
+    # Deriva de BaseException (como asyncio.CancelledError) para atravessar os
+    # `except Exception` das funções de dashboard: uma query cancelada nunca deve virar
+    # um DataFrame vazio guardado em cache
+    pass
+
+
+class QueryScope:
+    # Conjunto de queries em andamento disparadas por uma mesma execução do script.
+    # cancel() interrompe todas (StopQueryExecution no Athena) e faz as próximas
+    # submissões no escopo falharem com QueryCancelled.
+    def __init__(self, name=None):
+        self.name = name
+        self._lock = threading.Lock()
+        self._running = {}
+        self._next_token = 0
+        self.cancelled = threading.Event()
+
+    def register(self, cancel):
+        with self._lock:
+            if not self.cancelled.is_set():
+                self._next_token += 1
+                self._running[self._next_token] = cancel
+                return self._next_token
+        cancel()
+        raise QueryCancelled(f"Escopo de queries {self.name or ''} cancelado")
+
+    def unregister(self, token):
+        with self._lock:
+            self._running.pop(token, None)
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled.set()
+            running, self._running = list(self._running.values()), {}
+        if running:
+            logging.info(f"Cancelando {len(running)} query(s) em andamento do escopo {self.name or ''}")
+        for cancel in running:
+            try:
+                cancel()
+            except Exception as e:
+                logging.warning(f"Falha ao cancelar query: {str(e)}")
+
+    def running(self):
+        with self._lock:
+            return len(self._running)
+
+
+_query_scope = contextvars.ContextVar('query_scope', default=None)
+
+
+def current_query_scope():
+    return _query_scope.get()
+
+
+@contextmanager
+def query_scope(scope):
+    # Queries executadas dentro do bloco (inclusive em threads que copiem o contexto)
+    # ficam registradas em `scope`
+    token = _query_scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _query_scope.reset(token)
+
+
+@contextmanager
+def _registered(cancel):
+    scope = current_query_scope()
+    token = scope.register(cancel) if scope is not None else None
+    try:
+        yield scope
+    finally:
+        if token is not None:
+            scope.unregister(token)
+
+
+class _PooledConnection:
+    __slots__ = ('conn', 'created_at', 'last_used')
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.created_at = self.last_used = time.monotonic()
+
+
+class AthenaConnectionPool:
+    def __init__(self, factory, max_size=ATHENA_POOL_SIZE, timeout=ATHENA_POOL_TIMEOUT,
+                 max_idle=ATHENA_POOL_MAX_IDLE, max_age=ATHENA_POOL_MAX_AGE):
+        self._factory = factory
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.max_age = max_age
+        # O semáforo limita as conexões em uso; a fila guarda as ociosas
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._idle = deque()
+        self._lock = threading.Lock()
+        self.created = 0
+
+    def _is_healthy(self, pooled):
+        now = time.monotonic()
+        if now - pooled.created_at > self.max_age:
+            return False
+        if now - pooled.last_used <= self.max_idle:
+            return True
+        try:
+            pooled.conn.client.list_work_groups(MaxResults=1)
+            return True
+        except Exception as e:
+            logging.warning(f"Conexão Athena ociosa falhou no health check, descartando: {str(e)}")
+            return False
+
+    def _checkout(self):
+        while True:
+            with self._lock:
+                pooled = self._idle.pop() if self._idle else None
+            if pooled is None:
+                logging.info("Criando nova conexão Athena para o pool")
+                pooled = _PooledConnection(self._factory())
+                with self._lock:
+                    self.created += 1
+                return pooled
+            if self._is_healthy(pooled):
+                return pooled
+            self._close(pooled)
+
+    def _release(self, pooled):
+        pooled.last_used = time.monotonic()
+        with self._lock:
+            self._idle.append(pooled)
+
+    def _close(self, pooled):
+        try:
+            pooled.conn.close()
+        except Exception:
+            pass
+
+    @contextmanager
+    def connection(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise TimeoutError(f"Nenhuma conexão Athena livre após {self.timeout:.0f}s (pool de {self.max_size})")
+        try:
+            pooled = self._checkout()
+            try:
+                yield pooled.conn
+            except QueryCancelled:
+                # Cancelamento não indica problema na conexão: ela volta ao pool
+                self._release(pooled)
+                raise
+            except Exception:
+                # Em caso de erro a conexão não volta ao pool
+                self._close(pooled)
+                raise
+            self._release(pooled)
+        finally:
+            self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            return {'max_size': self.max_size, 'idle': len(self._idle), 'created': self.created}
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for pooled in idle:
+            self._close(pooled)
+
+
+class AthenaBackend:
+    name = 'athena'
+
+    def __init__(self, s3_staging_dir=ATHENA_S3_STAGING_DIR, region_name=ATHENA_REGION, pool_size=ATHENA_POOL_SIZE):
+        self.s3_staging_dir = s3_staging_dir
+        self.region_name = region_name
+        self.pool = AthenaConnectionPool(self._connect, max_size=pool_size)
+        self.admission = get_admission_controller()
+
+    def _connect(self):
+        return connect(s3_staging_dir=self.s3_staging_dir, region_name=self.region_name)
+
+    def _collect_stats(self, cursor, stats):
+        # Estatísticas de execução que o Athena devolve para cada QueryExecutionId
+        if stats is None:
+            return
+        stats.update({
+            'query_id': cursor.query_id,
+            'data_scanned_bytes': cursor.data_scanned_in_bytes,
+            'engine_ms': cursor.engine_execution_time_in_millis,
+            'queue_ms': cursor.query_queue_time_in_millis,
+            'planning_ms': cursor.query_planning_time_in_millis,
+            'service_ms': cursor.service_processing_time_in_millis,
+            'total_ms': cursor.total_execution_time_in_millis,
+        })
+
+    def _submit(self, conn, cursor_class, query, stats):
+        # Submissão assíncrona: StartQueryExecution devolve o QueryExecutionId na hora e o
+        # estado é acompanhado por polling. Com o id registrado no escopo da execução, um
+        # rerun do Streamlit consegue cancelar (StopQueryExecution) a query que ficou obsoleta.
+        cursor = conn.cursor(cursor_class, poll_interval=ATHENA_POLL_INTERVAL, max_workers=2)
+        query_id, future = cursor.execute(query)
+        if stats is not None:
+            stats['query_id'] = query_id
+        return cursor, query_id, future
+
+    def _wait(self, cursor, query_id, future, stats):
+        with _registered(lambda: cursor.cancel(query_id).result()) as scope:
+            result_set = future.result()
+        self._collect_stats(result_set, stats)
+        if result_set.state == 'CANCELLED' or (scope is not None and scope.cancelled.is_set()):
+            raise QueryCancelled(f"Query {query_id} cancelada")
+        if result_set.state != 'SUCCEEDED':
+            raise OperationalError(result_set.state_change_reason)
+        return result_set
+
+    @contextmanager
+    def _admitted(self, stats):
+        # Vaga no controle de admissão do processo; a espera na fila respeita o cancelamento
+        # do escopo da execução, como a própria query
+        scope = current_query_scope()
+
+        def register_cancel(cancel):
+            token = scope.register(cancel)
+            return lambda: scope.unregister(token)
+
+        with span('admissao'):
+            waited = self.admission.acquire(register_cancel=register_cancel if scope is not None else None)
+        if waited is None:
+            raise QueryCancelled("Query cancelada enquanto aguardava na fila do Athena")
+        if stats is not None:
+            stats['admission_ms'] = waited
+        try:
+            yield
+        finally:
+            self.admission.release()
+
+    def _run(self, query, stats, cursor_class, fetch):
+        with self._admitted(stats):
+            attempt = 0
+            while True:
+                try:
+                    with self.pool.connection() as conn:
+                        with span('submissao', tentativa=attempt):
+                            cursor, query_id, future = self._submit(conn, cursor_class, query, stats)
+                        try:
+                            with span('espera', query_id=query_id):
+                                result_set = self._wait(cursor, query_id, future, stats)
+                            started = time.perf_counter()
+                            with span('leitura'):
+                                data = fetch(result_set)
+                            if stats is not None:
+                                stats['fetch_ms'] = (time.perf_counter() - started) * 1000
+                            return data
+                        finally:
+                            cursor.close()
+                except Exception as e:
+                    # Throttling da conta (outros processos/usuários): espera curta e nova tentativa
+                    if not is_throttling_error(e) or attempt >= ATHENA_THROTTLE_RETRIES:
+                        raise
+                    delay = self.admission.throttled(attempt)
+                    attempt += 1
+                    logging.warning(f"Athena limitou a query (tentativa {attempt}/{ATHENA_THROTTLE_RETRIES}); nova tentativa em {delay:.1f}s")
+                    scope = current_query_scope()
+                    if scope is not None and scope.cancelled.wait(delay):
+                        raise QueryCancelled("Query cancelada durante a espera por throttling")
+                    if scope is None:
+                        time.sleep(delay)
+
+    def execute(self, query, stats=None):
+        return self._run(query, stats, AsyncCursor, as_pandas)
+
+    def execute_arrow(self, query, stats=None):
+        # O cursor Arrow decodifica o CSV de resultado com pyarrow
+        return self._run(query, stats, AsyncArrowCursor, lambda result_set: result_set.as_arrow())
+
+
+# Executa o mesmo SQL do Athena em processo, via DuckDB, sobre um espelho Parquet local
+class LocalBackend:
+    name = 'local'
+
+    def __init__(self, mirror_dir=LOCAL_MIRROR_DIR, database=ATHENA_DATABASE):
+        try:
+            import duckdb
+            import sqlglot
+        except ImportError as e:
+            raise ImportError("O backend local requer os pacotes 'duckdb' e 'sqlglot'.") from e
+
+        self._sqlglot = sqlglot
+        self.mirror_dir = mirror_dir
+        self.database = database
+        self._lock = threading.Lock()
+        self._con = duckdb.connect(database=':memory:')
+        self._con.execute(f'CREATE SCHEMA IF NOT EXISTS "{database}"')
+        self.tables = self._register_tables()
+        logging.info(f"Backend local: {len(self.tables)} tabelas registradas a partir de {mirror_dir}")
+
+    def _register_tables(self):
+        # A primeira camada que contém a tabela vence (gold > silver > bronze)
+        tables = {}
+        for layer in LOCAL_MIRROR_LAYERS:
+            layer_dir = os.path.join(self.mirror_dir, layer, self.database)
+            if not os.path.isdir(layer_dir):
+                continue
+            for table in sorted(os.listdir(layer_dir)):
+                table_dir = os.path.join(layer_dir, table)
+                if table in tables or not os.path.isdir(table_dir):
+                    continue
+                tables[table] = table_dir
+
+        for table, table_dir in tables.items():
+            pattern = os.path.join(table_dir, '**', '*.parquet').replace("'", "''")
+            hive_types = {key: kind for key, kind in LOCAL_HIVE_TYPES.items() if key in self._partition_keys(table_dir)}
+            types_option = ''
+            if hive_types:
+                types_option = ", hive_types = {" + ', '.join(f"'{key}': {kind}" for key, kind in hive_types.items()) + "}"
+            self._con.execute(
+                f'CREATE OR REPLACE VIEW "{self.database}"."{table}" AS '
+                f"SELECT * FROM read_parquet('{pattern}', hive_partitioning = true, union_by_name = true{types_option})"
+            )
+        return tables
+
+    def _partition_keys(self, table_dir):
+        # Chaves dos diretórios chave=valor da tabela (o DuckDB rejeita hive_types de chaves ausentes)
+        keys = set()
+        for _, dirs, _ in os.walk(table_dir):
+            keys.update(name.split('=', 1)[0] for name in dirs if '=' in name)
+        return keys
+
+    def translate(self, query):
+        # O SQL dos dashboards é escrito no dialeto do Athena (Presto/Trino)
+        statements = self._sqlglot.transpile(query, read='presto', write='duckdb')
+        return ';\n'.join(statements)
+
+    def _cursor(self):
+        # Um cursor por chamada: conexões DuckDB não podem ser compartilhadas entre threads
+        with self._lock:
+            return self._con.cursor()
+
+    def _run(self, query, stats, fetch):
+        with span('traducao'):
+            sql = self.translate(query)
+        cursor = self._cursor()
+        try:
+            started = time.perf_counter()
+            # Mesmo contrato de cancelamento do Athena: o escopo interrompe a query em andamento
+            with _registered(cursor.interrupt) as scope:
+                try:
+                    with span('execucao'):
+                        result = cursor.execute(sql)
+                    executed = time.perf_counter()
+                    with span('leitura'):
+                        data = fetch(result)
+                except Exception:
+                    if scope is not None and scope.cancelled.is_set():
+                        raise QueryCancelled("Query local cancelada")
+                    raise
+            if stats is not None:
+                stats['engine_ms'] = stats['total_ms'] = (executed - started) * 1000
+                stats['fetch_ms'] = (time.perf_counter() - executed) * 1000
+            return data
+        finally:
+            cursor.close()
+
+    def execute(self, query, stats=None):
+        return self._run(query, stats, lambda result: result.df())
+
+    def execute_arrow(self, query, stats=None):
+        return self._run(query, stats, lambda result: result.arrow())
+
+
+BACKENDS = {
+    AthenaBackend.name: AthenaBackend,
+    LocalBackend.name: LocalBackend,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if QUERY_BACKEND not in BACKENDS:
+                    raise ValueError(f"QUERY_BACKEND inválido: {QUERY_BACKEND}. Opções: {', '.join(BACKENDS)}")
+                _backend = BACKENDS[QUERY_BACKEND]()
+    return _backend
+
+
+def set_backend(backend):
+    # Permite trocar o backend em tempo de execução (ex.: benchmarks, scripts de carga)
+    global _backend
+    with _backend_lock:
+        _backend = backend
+    return backend
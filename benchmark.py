@@ -0,0 +1,323 @@
+import os
+import gc
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import tempfile
+import threading
+import statistics
+import subprocess
+import tracemalloc
+from datetime import date, datetime
+
+# Benchmarks de cada função pública do utils.py contra o backend local (DuckDB) e o espelho
+# sintético de dados_sinteticos.py, em várias escalas. Os caches de resultados ficam
+# desligados para medir o caminho completo: montagem do SQL, execução, leitura e
+# transformações em pandas/numpy, além das figuras do plotly.
+_workdir = tempfile.mkdtemp(prefix='benchmark-')
+os.environ['QUERY_BACKEND'] = 'local'
+os.environ['CACHE_ENABLED'] = '0'
+os.environ['PREWARM_SCHEDULER'] = '0'
+os.environ.setdefault('METRICS_DB', os.path.join(_workdir, 'metricas.db'))
+os.environ.setdefault('STATUS_SNAPSHOT_DIR', os.path.join(_workdir, 'status_clientes'))
+
+import psutil  # noqa: E402
+
+import utils  # noqa: E402
+from backends import LocalBackend, set_backend  # noqa: E402
+from dados_sinteticos import SyntheticDatalake, parse_size  # noqa: E402
+from filtros import FilterSet  # noqa: E402
+from metricas import load_metrics  # noqa: E402
+from materializacao import month_range  # noqa: E402
+from rfm import build_rfm_base_query  # noqa: E402
+from status_clientes import build_status_query  # noqa: E402
+
+
+BENCHMARK_DATA_DIR = os.environ.get('BENCHMARK_DATA_DIR', os.path.join('.cache', 'benchmark'))
+DEFAULT_SCALES = '10k,100k,1M'
+# Período fixo dos dados sintéticos e dos filtros: resultados comparáveis entre execuções
+DATA_START = date(2023, 1, 1)
+DATA_END = date(2024, 12, 31)
+PERIOD = FilterSet(start_date=date(2024, 1, 1), end_date=DATA_END)
+# Dia passado aos caches diários (índice de dimensões): o último dia dos dados, e não o
+# dia da execução
+DIA = DATA_END
+# Vendedor com mais vendas nos dados sintéticos (primeiro da distribuição zipf)
+TOP_SELLER = '1000'
+RSS_SAMPLE_INTERVAL = 0.005
+
+
+class RSSPeak:
+    # Pico de RSS do processo durante o bloco, amostrado em uma thread: inclui a memória
+    # nativa do DuckDB e do Arrow, que o tracemalloc não enxerga
+    def __init__(self):
+        self._process = psutil.Process()
+        self._stop = threading.Event()
+        self.peak = 0
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self._process.memory_info().rss)
+            time.sleep(RSS_SAMPLE_INTERVAL)
+
+    def __enter__(self):
+        self.start = self._process.memory_info().rss
+        self.peak = self.start
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self._process.memory_info().rss)
+        self.delta = self.peak - self.start
+
+
+def _reset_caches():
+    # Cada repetição mede o caminho frio: sem st.cache_*, sem snapshots de status
+    utils.get_client_status.clear()
+    utils.get_rfm_engine.clear()
+    utils.get_dimension_index.clear()
+    utils.client_status_store.snapshot_dir = tempfile.mkdtemp(dir=_workdir, prefix='status-')
+
+
+def _rows(result):
+    if hasattr(result, '__len__') and not isinstance(result, tuple):
+        return len(result)
+    if isinstance(result, tuple):
+        return sum(len(part) for part in result)
+    return None
+
+
+def build_cases(itens):
+    # (nome, etapa, função, linhas de entrada, preparar). Funções de consulta processam
+    # todos os itens do espelho; transformações e figuras, o DataFrame que recebem.
+    seller = PERIOD.replace(cod_colaborador=TOP_SELLER)
+    cases = [
+        ('build_rfm_base_query', 'montagem', lambda: build_rfm_base_query(PERIOD), None, None),
+        ('build_status_query', 'montagem', lambda: build_status_query(list(month_range(PERIOD.start_date, PERIOD.end_date)), PERIOD), None, None),
+        ('get_channels_and_ufs', 'consulta', lambda: utils.get_channels_and_ufs(PERIOD), itens, None),
+        ('get_colaboradores', 'consulta', lambda: utils.get_colaboradores(PERIOD), itens, None),
+        ('get_monthly_revenue', 'consulta', lambda: utils.get_monthly_revenue(PERIOD), itens, None),
+        ('get_monthly_revenue[vendedor]', 'consulta', lambda: utils.get_monthly_revenue(seller), itens, None),
+        ('get_brand_data', 'consulta', lambda: utils.get_brand_data(PERIOD), itens, None),
+        ('get_client_status', 'consulta', lambda: utils.get_client_status(PERIOD), itens, _reset_caches),
+        ('get_rfm_summary', 'consulta', lambda: utils.get_rfm_summary(PERIOD), itens, _reset_caches),
+        ('get_dimension_index', 'consulta', lambda: utils.get_dimension_index(DIA), itens, _reset_caches),
+        ('run_concurrently', 'consulta', lambda: utils.run_concurrently({
+            'faturamento': (utils.get_monthly_revenue, (PERIOD,), {}),
+            'marcas': (utils.get_brand_data, (PERIOD,), {}),
+            'status': (utils.get_client_status, (PERIOD,), {}),
+            'dimensoes': (utils.get_channels_and_ufs, (PERIOD,), {}),
+        }), itens, _reset_caches),
+    ]
+
+    # Entradas das transformações em memória, calculadas uma vez fora da medição
+    _reset_caches()
+    summary = utils.get_rfm_summary(PERIOD)
+    segment = summary['Segmento'].iloc[0] if not summary.empty else ''
+    status = utils.get_client_status(PERIOD)
+
+    def warm():
+        # Motor RFM já carregado: mede só o trabalho em memória
+        return len(utils.get_rfm_engine(utils._rfm_filters(PERIOD)).clients)
+
+    engine_rows = warm()
+    cases += [
+        ('get_rfm_segment_clients', 'transformacao', lambda: utils.get_rfm_segment_clients(PERIOD, segment), engine_rows, warm),
+        ('get_rfm_segment_page', 'transformacao', lambda: utils.get_rfm_segment_page(PERIOD, segment), engine_rows, warm),
+        ('create_rfm_heatmap', 'figura', lambda: utils.create_rfm_heatmap(summary), len(summary), None),
+        ('create_client_status_chart', 'figura', lambda: utils.create_client_status_chart(status), len(status), None),
+    ]
+    return cases
+
+
+def _query_phases(since):
+    # Tempos por fase das queries disparadas durante a medição (gravados por query_athena)
+    df = load_metrics(since=since)
+    df = df[df['status'] == 'ok']
+    return {
+        'consultas': int(len(df)),
+        'engine_ms': float(df['engine_ms'].sum()),
+        'fetch_ms': float(df['fetch_ms'].sum()),
+        'convert_ms': float(df['convert_ms'].fillna(0).sum()),
+        'linhas_retornadas': int(df['rows'].sum()),
+    }
+
+
+def run_case(name, stage, fn, input_rows, prepare, repetitions):
+    # Primeira execução (aquecimento) mede memória; as seguintes, só o tempo, para que o
+    # tracemalloc não distorça os números
+    if prepare:
+        prepare()
+    gc.collect()
+    tracemalloc.start()
+    with RSSPeak() as rss:
+        result = fn()
+    python_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    timings = []
+    phases = []
+    for _ in range(repetitions):
+        if prepare:
+            prepare()
+        gc.collect()
+        since = time.time()
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+        if stage == 'consulta':
+            phases.append(_query_phases(since))
+
+    median_ms = statistics.median(timings)
+    entry = {
+        'caso': name,
+        'etapa': stage,
+        'repeticoes': repetitions,
+        'wall_ms_mediana': round(median_ms, 3),
+        'wall_ms_min': round(min(timings), 3),
+        'wall_ms_max': round(max(timings), 3),
+        'pico_memoria_python_bytes': python_peak,
+        'pico_rss_delta_bytes': rss.delta,
+        'linhas_entrada': input_rows,
+        'linhas_saida': _rows(result),
+        'linhas_por_s': round(input_rows / (median_ms / 1000)) if input_rows and median_ms > 0 else None,
+    }
+    if phases:
+        for key in phases[0]:
+            entry[key] = statistics.median(p[key] for p in phases)
+        # Montagem do SQL, tradução para o DuckDB, transformações e overhead de threads
+        entry['outros_ms'] = round(median_ms - entry['engine_ms'] - entry['fetch_ms'] - entry['convert_ms'], 3)
+    return entry
+
+
+def ensure_dataset(itens, data_dir, seed):
+    output_dir = os.path.join(data_dir, f'itens={itens}-semente={seed}')
+    marker = os.path.join(output_dir, '_SUCCESS')
+    if not os.path.exists(marker):
+        logging.warning(f"Gerando dados sintéticos: {itens:,} itens em {output_dir}")
+        SyntheticDatalake(output_dir, itens, DATA_START, DATA_END, seed).generate()
+        open(marker, 'w').close()
+    return output_dir
+
+
+def run_scale(itens, data_dir, seed, repetitions, only=None):
+    mirror = ensure_dataset(itens, data_dir, seed)
+    set_backend(LocalBackend(mirror))
+    results = []
+    for name, stage, fn, input_rows, prepare in build_cases(itens):
+        if only and not any(pattern in name for pattern in only):
+            continue
+        entry = run_case(name, stage, fn, input_rows, prepare, repetitions)
+        entry['escala_itens'] = itens
+        results.append(entry)
+        logging.warning(f"[{itens:,}] {name}: {entry['wall_ms_mediana']:.1f} ms")
+    return results
+
+
+def _git_commit():
+    repo = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=repo, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=repo, capture_output=True, text=True).stdout.strip()
+        return commit + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(scales, data_dir, seed, repetitions, output, only=None):
+    results = []
+    for itens in scales:
+        results += run_scale(itens, data_dir, seed, repetitions, only)
+    report = {
+        'commit': _git_commit(),
+        'executado_em': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'maquina': platform.platform(),
+        'cpus': os.cpu_count(),
+        'semente': seed,
+        'resultados': results,
+    }
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print_report(report)
+    print(f"\nResultados gravados em {output}")
+    return report
+
+
+def print_report(report):
+    print(f"\ncommit {report['commit']} - {report['executado_em']}")
+    print(f"{'escala':>10} {'caso':<32} {'mediana ms':>11} {'linhas/s':>12} {'pico py MB':>11} {'pico rss MB':>12}")
+    for r in report['resultados']:
+        rate = f"{r['linhas_por_s']:,}" if r['linhas_por_s'] else '-'
+        print(
+            f"{r['escala_itens']:>10,} {r['caso']:<32} {r['wall_ms_mediana']:>11.1f} {rate:>12} "
+            f"{r['pico_memoria_python_bytes'] / 1024 ** 2:>11.1f} {r['pico_rss_delta_bytes'] / 1024 ** 2:>12.1f}"
+        )
+
+
+def compare(base_path, new_path, threshold):
+    # Razão novo/base da mediana por (escala, caso); acima do limite é regressão
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    base_results = {(r['escala_itens'], r['caso']): r for r in base['resultados']}
+    regressions = 0
+    print(f"base {base['commit']} -> novo {new['commit']}")
+    print(f"{'escala':>10} {'caso':<32} {'base ms':>10} {'novo ms':>10} {'razão':>7} {'mem py':>7}")
+    for r in new['resultados']:
+        b = base_results.get((r['escala_itens'], r['caso']))
+        if b is None:
+            continue
+        ratio = r['wall_ms_mediana'] / b['wall_ms_mediana'] if b['wall_ms_mediana'] else float('inf')
+        memory = r['pico_memoria_python_bytes'] / b['pico_memoria_python_bytes'] if b['pico_memoria_python_bytes'] else float('inf')
+        flag = ''
+        if ratio > threshold:
+            flag = '  REGRESSÃO'
+            regressions += 1
+        elif ratio < 1 / threshold:
+            flag = '  melhora'
+        print(f"{r['escala_itens']:>10,} {r['caso']:<32} {b['wall_ms_mediana']:>10.1f} {r['wall_ms_mediana']:>10.1f} {ratio:>7.2f} {memory:>7.2f}{flag}")
+    return regressions
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Benchmarks das funções do utils.py sobre dados sintéticos.")
+    subparsers = parser.add_subparsers(dest='comando')
+
+    rodar = subparsers.add_parser('rodar', help="Executa os benchmarks e grava o JSON de resultados.")
+    rodar.add_argument('--escalas', default=DEFAULT_SCALES, help="Itens de pedido por escala (ex.: 10k,100k,1M).")
+    rodar.add_argument('--repeticoes', type=int, default=5)
+    rodar.add_argument('--semente', type=int, default=42)
+    rodar.add_argument('--dados', default=BENCHMARK_DATA_DIR, help="Onde guardar os espelhos sintéticos (reaproveitados).")
+    rodar.add_argument('--casos', help="Só os casos cujo nome contém algum destes termos (separados por vírgula).")
+    rodar.add_argument('--saida', help="Arquivo JSON. Padrão: <dados>/resultados/<commit>.json")
+
+    comparar = subparsers.add_parser('comparar', help="Compara dois JSONs de resultados.")
+    comparar.add_argument('base')
+    comparar.add_argument('novo')
+    comparar.add_argument('--limite', type=float, default=1.10, help="Razão novo/base considerada regressão.")
+
+    args = parser.parse_args()
+    if args.comando == 'comparar':
+        raise SystemExit(1 if compare(args.base, args.novo, args.limite) else 0)
+    if args.comando != 'rodar':
+        parser.print_help()
+        raise SystemExit(2)
+
+    scales = [parse_size(value) for value in args.escalas.split(',')]
+    output = args.saida or os.path.join(args.dados, 'resultados', f"{_git_commit() or 'sem-commit'}.json")
+    only = [value.strip() for value in args.casos.split(',')] if args.casos else None
+    run(scales, args.dados, args.semente, args.repeticoes, output, only)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
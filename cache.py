@@ -0,0 +1,230 @@
+import os
+import re
+import time
+import uuid
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+# Cache de resultados em duas camadas, abaixo de query_athena:
+# 1. memória: LRU limitado em bytes, por processo
+# 2. disco: Parquet comprimido (zstd) em CACHE_DIR, sobrevive a restarts do container
+CACHE_ENABLED = os.environ.get('CACHE_ENABLED', '1') == '1'
+CACHE_DIR = os.environ.get('CACHE_DIR', os.path.join('.cache', 'resultados'))
+CACHE_MEMORY_MAX_BYTES = int(os.environ.get('CACHE_MEMORY_MAX_BYTES', str(256 * 1024 ** 2)))
+CACHE_DISK_MAX_BYTES = int(os.environ.get('CACHE_DISK_MAX_BYTES', str(2 * 1024 ** 3)))
+
+# TTL (segundos) por domínio de dados; sobrescreva com CACHE_TTL_<DOMINIO>
+CACHE_TTLS = {
+    'default': 3600,
+    'vendas': 4 * 3600,
+    'status_clientes': 12 * 3600,
+    'rfm': 12 * 3600,
+    'dimensoes': 24 * 3600,
+}
+for _domain in CACHE_TTLS:
+    _env_ttl = os.environ.get(f'CACHE_TTL_{_domain.upper()}')
+    if _env_ttl:
+        CACHE_TTLS[_domain] = int(_env_ttl)
+
+_METADATA_EXPIRES = b'resultcache.expires_at'
+_METADATA_DOMAIN = b'resultcache.domain'
+
+
+# Literais ('...', com '' escapado), identificadores entre aspas e comentários de linha
+# ficam como estão; só os espaços fora deles são normalizados
+_SQL_TOKENS = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|--[^\n]*|\s+")
+
+
+def normalize_sql(query):
+    # Espaços, quebras de linha e ';' final não mudam o resultado da query; dentro de um
+    # literal mudam (ex.: cod_colaborador digitado com espaço duplo)
+    normalized = _SQL_TOKENS.sub(lambda m: ' ' if m.group().isspace() else m.group(), query)
+    return normalized.strip().rstrip(';').strip()
+
+
+def cache_key(query, *variant):
+    payload = '\x1f'.join([normalize_sql(query)] + [str(v) for v in variant])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def ttl_for(domain):
+    return CACHE_TTLS.get(domain, CACHE_TTLS['default'])
+
+
+class ResultCache:
+    def __init__(self, cache_dir=CACHE_DIR, memory_max_bytes=CACHE_MEMORY_MAX_BYTES, disk_max_bytes=CACHE_DISK_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.memory_max_bytes = memory_max_bytes
+        self.disk_max_bytes = disk_max_bytes
+        self._memory = OrderedDict()  # key -> (df, expires_at, nbytes)
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0}
+
+    # -- memória ---------------------------------------------------------
+
+    def _memory_get(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            df, expires_at, nbytes = entry
+            if expires_at <= time.time():
+                del self._memory[key]
+                self._memory_bytes -= nbytes
+                return None
+            self._memory.move_to_end(key)
+            return df
+
+    def _memory_put(self, key, df, expires_at):
+        nbytes = int(df.memory_usage(index=True, deep=True).sum())
+        if nbytes > self.memory_max_bytes:
+            return
+        with self._lock:
+            old = self._memory.pop(key, None)
+            if old is not None:
+                self._memory_bytes -= old[2]
+            self._memory[key] = (df, expires_at, nbytes)
+            self._memory_bytes += nbytes
+            while self._memory_bytes > self.memory_max_bytes and self._memory:
+                _, (_, _, evicted_bytes) = self._memory.popitem(last=False)
+                self._memory_bytes -= evicted_bytes
+                self.stats['evictions'] += 1
+
+    # -- disco -----------------------------------------------------------
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f'{key}.parquet')
+
+    def _disk_get(self, key):
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None, None
+        try:
+            table = pq.read_table(path)
+            metadata = table.schema.metadata or {}
+            expires_at = float(metadata.get(_METADATA_EXPIRES, b'0'))
+            if expires_at <= time.time():
+                os.remove(path)
+                return None, None
+            os.utime(path)  # marca como usado recentemente para a evicção por LRU
+            return table.to_pandas(), expires_at
+        except Exception as e:
+            logging.warning(f"Entrada de cache inválida em {path}, descartando: {str(e)}")
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None, None
+
+    def _disk_put(self, key, df, expires_at, domain):
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            metadata = dict(table.schema.metadata or {})
+            metadata[_METADATA_EXPIRES] = str(expires_at).encode()
+            metadata[_METADATA_DOMAIN] = domain.encode()
+            table = table.replace_schema_metadata(metadata)
+            # Escrita atômica: outros processos nunca leem um arquivo pela metade
+            tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+            pq.write_table(table, tmp_path, compression='zstd')
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logging.warning(f"Não foi possível gravar o resultado no cache em disco: {str(e)}")
+            return
+        self._evict_disk()
+
+    def _evict_disk(self):
+        files = []
+        total = 0
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                if not name.endswith('.parquet'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        if total <= self.disk_max_bytes:
+            return
+        for _, size, path in sorted(files):
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self.stats['evictions'] += 1
+            if total <= self.disk_max_bytes:
+                break
+
+    # -- API -------------------------------------------------------------
+
+    def get(self, key):
+        df = self._memory_get(key)
+        if df is not None:
+            self.stats['memory_hits'] += 1
+            return df.copy(deep=False)
+        df, expires_at = self._disk_get(key)
+        if df is not None:
+            self.stats['disk_hits'] += 1
+            self._memory_put(key, df, expires_at)
+            return df.copy(deep=False)
+        self.stats['misses'] += 1
+        return None
+
+    def put(self, key, df, domain='default'):
+        expires_at = time.time() + ttl_for(domain)
+        self._memory_put(key, df, expires_at)
+        self._disk_put(key, df, expires_at, domain)
+        return df.copy(deep=False)
+
+    def invalidate(self, key=None):
+        # Sem chave, limpa tudo
+        with self._lock:
+            if key is None:
+                self._memory.clear()
+                self._memory_bytes = 0
+            else:
+                entry = self._memory.pop(key, None)
+                if entry is not None:
+                    self._memory_bytes -= entry[2]
+        if key is not None:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+            return
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                if name.endswith('.parquet'):
+                    try:
+                        os.remove(os.path.join(root, name))
+                    except OSError:
+                        pass
+
+    def info(self):
+        with self._lock:
+            return dict(self.stats, memory_entries=len(self._memory), memory_bytes=self._memory_bytes)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResultCache()
+    return _cache
@@ -0,0 +1,335 @@
+import os
+import shutil
+import logging
+import argparse
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from backends import ATHENA_DATABASE, LocalBackend
+from materializacao import cmv_mensal_select, month_range, month_start
+
+
+# Gerador determinístico (semente fixa) de dados sintéticos com o mesmo esquema das
+# tabelas/views consultadas pelos dashboards. Grava Parquet no layout do espelho local
+# (<saida>/gold/databeautykami/<tabela>/), pronto para QUERY_BACKEND=local.
+# Itens de pedido ficam particionados por year=/month=, como o Item_Pedidos do bucket.
+SYNTHETIC_LAYER = 'gold'
+
+CFOP_WEIGHTS = {
+    'VENDA': 0.50,
+    'VENDA MERCADORIA DENTRO DO ESTADO': 0.14,
+    'VENDA MERCADORIA FORA ESTADO': 0.09,
+    'VENDA DE MERC.SUJEITA ST': 0.05,
+    'VENDA MERC. SUJEITA AO REGIME DE ST': 0.03,
+    'VENDA DO CONSIGNADO': 0.02,
+    'VENDA DE MERCADORIA P/ NÃO CONTRIBUINTE': 0.02,
+    'VENDA MERC.ADQ. BRASIL FORA ESTADO': 0.01,
+    'BONIFICADO': 0.06,
+    'DEVOLUCAO DE VENDA': 0.04,
+    'REMESSA EM CONSIGNACAO': 0.03,
+    'TRANSFERENCIA': 0.01,
+}
+CANAIS = {'DISTRIBUIÇÃO': 0.55, 'SALÃO': 0.2, 'VAREJO': 0.12, 'E-COMMERCE': 0.08, 'FRANQUIA': 0.05}
+UFS = {'SP': 0.45, 'RJ': 0.15, 'MG': 0.12, 'PR': 0.08, 'SC': 0.06, 'RS': 0.05, 'BA': 0.04, 'GO': 0.03, 'PE': 0.02}
+# Empresa que fatura cada UF (as demais UFs faturam pela matriz)
+EMPRESAS = {'SP': 1, 'RJ': 2, 'MG': 3}
+ORIGENS = {'egestor': 0.5, 'uno': 0.47, 'tiny': 0.03}
+
+# Proporções em relação ao número de itens de pedido
+ITENS_POR_PEDIDO = 4
+PEDIDOS_POR_CLIENTE = 12
+SALAO_FRACAO = 0.03
+
+
+def zipf_weights(n, s=1.1):
+    # Poucos vendedores/marcas/clientes concentram a maior parte das vendas
+    weights = 1.0 / np.arange(1, n + 1) ** s
+    return weights / weights.sum()
+
+
+def _choice(rng, options, size):
+    labels = np.array(list(options))
+    weights = np.array(list(options.values()), dtype=np.float64)
+    return labels[rng.choice(len(labels), size=size, p=weights / weights.sum())]
+
+
+def scale_for(itens):
+    # Dimensões crescem de forma sublinear com o volume
+    pedidos = max(itens // ITENS_POR_PEDIDO, 1)
+    return {
+        'itens': itens,
+        'pedidos': pedidos,
+        'clientes': max(pedidos // PEDIDOS_POR_CLIENTE, 50),
+        'vendedores': int(np.clip(np.sqrt(itens) / 20, 10, 400)),
+        'marcas': int(np.clip(np.sqrt(itens) / 15, 20, 150)),
+        'produtos': int(np.clip(np.sqrt(itens) * 2, 200, 50000)),
+    }
+
+
+def month_weights(months):
+    # Crescimento de ~2% ao mês e pico sazonal em novembro/dezembro
+    index = np.arange(len(months))
+    seasonal = np.array([1.35 if mes.month in (11, 12) else 0.85 if mes.month in (1, 2) else 1.0 for mes in months])
+    weights = (1.02 ** index) * seasonal
+    return weights / weights.sum()
+
+
+class SyntheticDatalake:
+    def __init__(self, output_dir, itens=100_000, start=date(2023, 1, 1), end=None, seed=42):
+        self.output_dir = output_dir
+        self.months = list(month_range(month_start(start), end or date.today()))
+        self.scale = scale_for(itens)
+        self.seed = seed
+        # Uma semente filha por mês: cada mês sai igual independentemente dos demais
+        dimension_seed, *self._month_seeds = np.random.SeedSequence(seed).spawn(len(self.months) + 1)
+        rng = np.random.default_rng(dimension_seed)
+        self._build_dimensions(rng)
+
+    def _table_dir(self, table):
+        return os.path.join(self.output_dir, SYNTHETIC_LAYER, ATHENA_DATABASE, table)
+
+    def _write(self, table, df, name='part-0.parquet', partition=None):
+        directory = self._table_dir(table)
+        if partition:
+            directory = os.path.join(directory, *(f'{key}={value}' for key, value in partition.items()))
+        os.makedirs(directory, exist_ok=True)
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False), os.path.join(directory, name), compression='zstd')
+
+    # -- dimensões -------------------------------------------------------
+
+    def _build_dimensions(self, rng):
+        scale = self.scale
+        self.marcas = pd.DataFrame({
+            'cod_marca': np.arange(1, scale['marcas'] + 1),
+            'desc_abrev': [f'MARCA{i:03d}' for i in range(1, scale['marcas'] + 1)],
+        })
+        self.marca_weights = zipf_weights(scale['marcas'])
+
+        n_produtos = scale['produtos']
+        self.produto_marca = rng.choice(scale['marcas'], size=n_produtos, p=self.marca_weights)
+        self.produto_preco = np.round(rng.lognormal(mean=3.6, sigma=0.6, size=n_produtos), 2)
+        self.produto_custo = np.round(self.produto_preco * rng.uniform(0.35, 0.65, size=n_produtos), 2)
+        # Popularidade dos produtos: zipf dentro do catálogo
+        self.produto_weights = zipf_weights(n_produtos, s=0.9)[rng.permutation(n_produtos)]
+
+        n_vendedores = scale['vendedores']
+        self.vendedores = pd.DataFrame({
+            'cod_colaborador': [f'{1000 + i}' for i in range(n_vendedores)],
+            'nome_colaborador': [f'VENDEDOR {i:03d}' for i in range(n_vendedores)],
+        })
+
+        n_clientes = scale['clientes']
+        self.cliente_cod = np.array([f'{10**13 + i:014d}' for i in range(n_clientes)])
+        self.cliente_uf = _choice(rng, UFS, n_clientes)
+        self.cliente_canal = _choice(rng, CANAIS, n_clientes)
+        self.cliente_vendedor = rng.choice(n_vendedores, size=n_clientes, p=zipf_weights(n_vendedores, s=0.8))
+        self.cliente_weights = zipf_weights(n_clientes, s=0.7)[rng.permutation(n_clientes)]
+
+        # Acumuladores para a view de perfil de cliente (RFM)
+        self.cliente_primeiro_mes = np.full(n_clientes, -1, dtype=np.int32)
+        self.cliente_ultimo_mes = np.full(n_clientes, -1, dtype=np.int32)
+        self.cliente_positivacoes = np.zeros(n_clientes, dtype=np.int32)
+        self.cliente_monetario = np.zeros(n_clientes, dtype=np.float64)
+
+    # -- fatos -----------------------------------------------------------
+
+    def _month(self, index, mes, n_itens):
+        rng = np.random.default_rng(self._month_seeds[index])
+        scale = self.scale
+        n_pedidos = max(n_itens // ITENS_POR_PEDIDO, 1)
+        prefixo = f'{mes:%Y%m}'
+
+        cliente = rng.choice(scale['clientes'], size=n_pedidos, p=self.cliente_weights)
+        dias = pd.Timestamp(mes).days_in_month
+        dt = pd.Timestamp(mes) + pd.to_timedelta(rng.integers(0, dias, size=n_pedidos), unit='D')
+        cod_pedido = np.char.add(prefixo, np.char.zfill(np.arange(n_pedidos).astype(str), 8))
+        cfop = _choice(rng, CFOP_WEIGHTS, n_pedidos)
+        operacoes_internas = np.where(rng.random(n_pedidos) < 0.97, 'N', 'S')
+        origem = _choice(rng, ORIGENS, n_pedidos)
+        # 90% dos pedidos saem pelo vendedor da carteira do cliente
+        vendedor = np.where(
+            rng.random(n_pedidos) < 0.9,
+            self.cliente_vendedor[cliente],
+            rng.integers(0, scale['vendedores'], size=n_pedidos),
+        )
+        uf = self.cliente_uf[cliente]
+
+        pedidos = pd.DataFrame({
+            'cod_pedido': cod_pedido,
+            'cpfcnpj': self.cliente_cod[cliente],
+            'dt_faturamento': dt,
+            'desc_abrev_cfop': cfop,
+            'operacoes_internas': operacoes_internas,
+            'origem': origem,
+            'canal_venda': self.cliente_canal[cliente],
+        })
+        empresa = pd.DataFrame({
+            'cod_pedido': cod_pedido,
+            'cod_empresa_faturamento': pd.Series(uf).map(EMPRESAS).fillna(1).astype(int).astype(str).to_numpy(),
+            'uf_empresa_faturamento': uf,
+            'cod_colaborador_atual': self.vendedores['cod_colaborador'].to_numpy()[vendedor],
+            'nome_colaborador_atual': self.vendedores['nome_colaborador'].to_numpy()[vendedor],
+        })
+
+        # Itens: número por pedido ~ geométrica, total ajustado ao volume do mês
+        itens_por_pedido = rng.geometric(1 / ITENS_POR_PEDIDO, size=n_pedidos)
+        faltantes = n_itens - itens_por_pedido.sum()
+        if faltantes > 0:
+            np.add.at(itens_por_pedido, rng.integers(0, n_pedidos, size=faltantes), 1)
+        pedido_idx = np.repeat(np.arange(n_pedidos), itens_por_pedido)[:n_itens]
+        n = len(pedido_idx)
+        produto = rng.choice(scale['produtos'], size=n, p=self.produto_weights)
+        qtd = rng.geometric(0.35, size=n).astype(np.int64)
+        preco_total = np.round(self.produto_preco[produto] * qtd, 2)
+        desconto = np.where(rng.random(n) < 0.4, rng.beta(2, 12, size=n), 0.0)
+        itens = pd.DataFrame({
+            'cod_pedido': cod_pedido[pedido_idx],
+            'sku': produto.astype(str),
+            'cod_produto': produto.astype(str),
+            'marca': self.marcas['desc_abrev'].to_numpy()[self.produto_marca[produto]],
+            'qtd': qtd,
+            'preco_total': preco_total,
+            'preco_desconto_rateado': np.round(preco_total * (1 - desconto), 2),
+        })
+
+        cmv = pd.DataFrame({
+            'cod_pedido': itens['cod_pedido'],
+            'cod_produto': itens['cod_produto'],
+            'cod_marca': self.marcas['cod_marca'].to_numpy()[self.produto_marca[produto]],
+            'cod_empresa': empresa['cod_empresa_faturamento'].to_numpy()[pedido_idx],
+            'dt_faturamento': dt[pedido_idx],
+            'qtd': qtd,
+            'custo_unitario': np.round(self.produto_custo[produto] * rng.uniform(0.95, 1.05, size=n), 2),
+        })
+
+        # Bonificação: fator de ajuste para parte das marcas, por empresa
+        bonificadas = rng.choice(scale['marcas'], size=max(scale['marcas'] // 5, 1), replace=False, p=self.marca_weights)
+        bonificacao = pd.DataFrame([
+            {
+                'cod_empresa': cod_empresa,
+                'cod_marca': int(self.marcas['cod_marca'].iloc[m]),
+                'marca': self.marcas['desc_abrev'].iloc[m],
+                'mes_ref': f'{mes:%Y-%m-%d}',
+                'fator': round(float(rng.uniform(1.05, 1.4)), 4),
+            }
+            for cod_empresa in sorted(set(EMPRESAS.values()))
+            for m in bonificadas
+        ])
+
+        n_salao = max(int(n * SALAO_FRACAO), 1)
+        produto_salao = rng.choice(scale['produtos'], size=n_salao, p=self.produto_weights)
+        salao = pd.DataFrame({
+            'cod_pedido': np.char.add(f'S{prefixo}', np.char.zfill((np.arange(n_salao) // 3).astype(str), 7)),
+            'codprod': produto_salao.astype(str),
+            'categoria': self.marcas['desc_abrev'].to_numpy()[self.produto_marca[produto_salao]],
+            'dtvenda': pd.Timestamp(mes) + pd.to_timedelta(rng.integers(0, dias, size=n_salao), unit='D'),
+            'quant': rng.geometric(0.5, size=n_salao).astype(np.int64),
+            'custo': self.produto_custo[produto_salao],
+        })
+
+        # Perfil do cliente: só pedidos de venda contam para positivação e monetário
+        venda = np.char.startswith(cfop.astype(str), 'VENDA') & (operacoes_internas == 'N')
+        valor_pedido = np.bincount(pedido_idx, weights=itens['preco_desconto_rateado'].to_numpy(), minlength=n_pedidos)
+        compradores = np.unique(cliente[venda])
+        self.cliente_positivacoes[compradores] += 1
+        self.cliente_primeiro_mes[compradores] = np.where(self.cliente_primeiro_mes[compradores] < 0, index, self.cliente_primeiro_mes[compradores])
+        self.cliente_ultimo_mes[compradores] = index
+        np.add.at(self.cliente_monetario, cliente[venda], valor_pedido[venda])
+
+        partition = {'year': f'{mes.year}', 'month': f'{mes.month:02d}'}
+        self._write('vw_distribuicao_pedidos', pedidos, name=f'{prefixo}.parquet')
+        self._write('vw_distribuicao_empresa_pedido', empresa, name=f'{prefixo}.parquet')
+        self._write('vw_distribuicao_item_pedidos', itens, partition=partition)
+        self._write('tbl_varejo_cmv', cmv, name=f'{prefixo}.parquet')
+        self._write('tbl_distribuicao_bonificacao', bonificacao, name=f'{prefixo}.parquet')
+        self._write('tbl_salao_pedidos_salao', salao, name=f'{prefixo}.parquet')
+        return n
+
+    def _write_profiles(self):
+        ativos = np.flatnonzero(self.cliente_positivacoes > 0)
+        ultimo = len(self.months) - 1
+        ultimo_mes = np.array([f'{m:%Y-%m}' for m in self.months])
+        positivacoes = self.cliente_positivacoes[ativos]
+        perfil = pd.DataFrame({
+            'Cod_Cliente': self.cliente_cod[ativos],
+            'Nome_Cliente': [f'CLIENTE {i:07d}' for i in ativos],
+            'uf_empresa': self.cliente_uf[ativos],
+            'Canal_Venda': self.cliente_canal[ativos],
+            'Recencia': (ultimo - self.cliente_ultimo_mes[ativos]).astype(np.int64),
+            'Positivacao': positivacoes.astype(np.int64),
+            'Monetario': np.round(self.cliente_monetario[ativos], 2),
+            'ticket_medio_posit': np.round(self.cliente_monetario[ativos] / positivacoes, 2),
+            'Maior_Mes': ultimo_mes[self.cliente_ultimo_mes[ativos]],
+            'Ciclo_Vida': (self.cliente_ultimo_mes[ativos] - self.cliente_primeiro_mes[ativos]).astype(np.int64),
+        })
+        self._write('vw_analise_perfil_cliente', perfil)
+        self._write('vw_distribuicao_cliente_vendedor', pd.DataFrame({
+            'cod_cliente': self.cliente_cod,
+            'cod_colaborador_atual': self.vendedores['cod_colaborador'].to_numpy()[self.cliente_vendedor],
+        }))
+        self._write('tbl_varejo_marca', self.marcas)
+
+    def _write_cmv_mensal(self):
+        # Materializa cmv_mensal com o mesmo SELECT do Athena, executado no DuckDB
+        backend = LocalBackend(self.output_dir)
+        for mes in self.months:
+            table = backend.execute_arrow(cmv_mensal_select(mes))
+            directory = self._table_dir('cmv_mensal')
+            os.makedirs(directory, exist_ok=True)
+            pq.write_table(table, os.path.join(directory, f'{mes:%Y%m}.parquet'), compression='zstd')
+
+    def generate(self, cmv_mensal=True):
+        weights = month_weights(self.months)
+        # Distribui os itens entre os meses preservando o total
+        per_month = np.floor(weights * self.scale['itens']).astype(np.int64)
+        per_month[-1] += self.scale['itens'] - per_month.sum()
+        total = 0
+        for index, (mes, n_itens) in enumerate(zip(self.months, per_month)):
+            total += self._month(index, mes, int(max(n_itens, 1)))
+            logging.info(f"Mês {mes:%Y-%m}: {n_itens:,} itens")
+        self._write_profiles()
+        if cmv_mensal:
+            self._write_cmv_mensal()
+        logging.info(f"Dados sintéticos gravados em {self.output_dir}: {total:,} itens, {len(self.months)} meses, {self.scale}")
+        return total
+
+
+def parse_size(value):
+    # Aceita 10k, 2.5M, 100M ou números inteiros
+    value = value.strip().lower().replace('_', '')
+    multiplier = {'k': 10**3, 'm': 10**6}.get(value[-1], 1)
+    return int(float(value[:-1] if multiplier > 1 else value) * multiplier)
+
+
+def parse_month(value):
+    year, month = value.split('-')[:2]
+    return date(int(year), int(month), 1)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Gera um espelho local sintético das tabelas dos dashboards.")
+    parser.add_argument('saida', help="Diretório raiz do espelho (use como LOCAL_MIRROR_DIR).")
+    parser.add_argument('--itens', type=parse_size, default=parse_size('100k'), help="Itens de pedido no total (ex.: 10k, 5M, 100M).")
+    parser.add_argument('--desde', type=parse_month, default=date(2023, 1, 1), help="Primeiro mês (AAAA-MM).")
+    parser.add_argument('--ate', type=parse_month, help="Último mês (AAAA-MM). Padrão: mês corrente.")
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--sem-cmv-mensal', action='store_true', help="Não materializa cmv_mensal.")
+    parser.add_argument('--sobrescrever', action='store_true', help="Apaga as tabelas sintéticas existentes em <saida>.")
+    args = parser.parse_args()
+
+    layer_dir = os.path.join(args.saida, SYNTHETIC_LAYER, ATHENA_DATABASE)
+    if os.path.isdir(layer_dir) and os.listdir(layer_dir):
+        if not args.sobrescrever:
+            parser.error(f"{layer_dir} já contém dados; use --sobrescrever para recriar")
+        shutil.rmtree(layer_dir)
+
+    SyntheticDatalake(args.saida, args.itens, args.desde, args.ate, args.semente).generate(cmv_mensal=not args.sem_cmv_mensal)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import os
+import logging
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from materializacao import month_start
+from particoes import date_range_filter
+
+
+# Índice de dimensões para as opções da barra lateral. Em vez de um SELECT DISTINCT sobre
+# pedidos JOIN empresa_pedido a cada mudança de período, uma única query agrega as
+# combinações (mês, colaborador, canal, UF) existentes; canais, UFs e colaboradores
+# disponíveis para um período são respondidos em memória a partir dela.
+# A granularidade é mensal: um período que começa no meio do mês inclui as opções do mês todo.
+DIMENSION_INDEX_ENABLED = os.environ.get('DIMENSION_INDEX', '1') == '1'
+DIMENSION_START_DATE = date.fromisoformat(os.environ.get('DIMENSION_START_DATE', '2023-01-01'))
+
+DIMENSION_COLUMNS = ['mes', 'cod_colaborador', 'nome_colaborador', 'canal_venda', 'uf_empresa_faturamento']
+
+
+def build_dimension_index_query(start_date, end_date):
+    return f"""
+    SELECT
+        DATE_TRUNC('month', pedidos.dt_faturamento) mes,
+        empresa_pedido.cod_colaborador_atual cod_colaborador,
+        empresa_pedido.nome_colaborador_atual nome_colaborador,
+        pedidos.canal_venda,
+        empresa_pedido.uf_empresa_faturamento
+    FROM
+        "databeautykami"."vw_distribuicao_pedidos" pedidos
+    LEFT JOIN "databeautykami"."vw_distribuicao_empresa_pedido" AS empresa_pedido
+        ON pedidos."cod_pedido" = empresa_pedido."cod_pedido"
+    WHERE
+        {date_range_filter('pedidos."dt_faturamento"', start_date, end_date)}
+    GROUP BY 1, 2, 3, 4, 5
+    """
+
+
+class DimensionIndex:
+    def __init__(self, df, start_date, end_date):
+        # start_date/end_date: período coberto; consultas fora dele não podem ser respondidas
+        self.start_date = month_start(start_date)
+        self.end_date = end_date
+        self.size = len(df)
+        self.codes = {}
+        self.labels = {}
+        for dim in DIMENSION_COLUMNS:
+            values = df[dim]
+            if dim == 'mes':
+                values = pd.to_datetime(values)
+            codes, labels = pd.factorize(values, sort=True, use_na_sentinel=False)
+            self.codes[dim] = codes.astype(np.min_scalar_type(max(len(labels) - 1, 0)))
+            self.labels[dim] = np.asarray(labels)
+
+    def covers(self, start_date, end_date):
+        return start_date is not None and end_date is not None and month_start(start_date) >= self.start_date
+
+    def _mask(self, start_date, end_date, **filters):
+        months = self.labels['mes']
+        selected = (months >= np.datetime64(pd.Timestamp(month_start(start_date)))) & (months <= np.datetime64(pd.Timestamp(end_date)))
+        mask = selected[self.codes['mes']]
+        for dim, values in filters.items():
+            if values:
+                mask &= np.isin(self.labels[dim], list(values))[self.codes[dim]]
+        return mask
+
+    def _distinct(self, dim, mask):
+        # Rótulos presentes entre as linhas selecionadas (já ordenados pelo factorize)
+        present = np.zeros(len(self.labels[dim]), dtype=bool)
+        present[self.codes[dim][mask]] = True
+        return self.labels[dim][present].tolist()
+
+    def channels_and_ufs(self, start_date, end_date, cod_colaborador=''):
+        mask = self._mask(start_date, end_date, cod_colaborador=[cod_colaborador] if cod_colaborador else None)
+        return self._distinct('canal_venda', mask), self._distinct('uf_empresa_faturamento', mask)
+
+    def colaboradores(self, start_date, end_date, channels=(), ufs=()):
+        mask = self._mask(start_date, end_date, canal_venda=channels, uf_empresa_faturamento=ufs)
+        # Pares (nome, código) distintos, ordenados pelo nome como no ORDER BY da query
+        pairs = np.unique(
+            self.codes['nome_colaborador'][mask].astype(np.int64) * len(self.labels['cod_colaborador'])
+            + self.codes['cod_colaborador'][mask]
+        )
+        nomes, codigos = np.divmod(pairs, len(self.labels['cod_colaborador']))
+        return pd.DataFrame({
+            'nome_colaborador': self.labels['nome_colaborador'][nomes],
+            'cod_colaborador': self.labels['cod_colaborador'][codigos],
+        })
+
+
+def load_dimension_index(query, start_date, end_date):
+    # query: função que executa SQL e devolve um DataFrame (utils.query_athena). Falhas
+    # propagam: o índice fica em cache por um dia e não pode nascer vazio por um erro
+    # transitório do Athena
+    df = query(build_dimension_index_query(start_date, end_date), fetch='arrow', domain='dimensoes', raise_errors=True)
+    if df.empty:
+        # Query bem-sucedida, mas sem linhas no período
+        logging.warning("Índice de dimensões vazio para o período solicitado")
+        df = df.reindex(columns=DIMENSION_COLUMNS)
+    index = DimensionIndex(df, start_date, end_date)
+    logging.info(f"Índice de dimensões carregado: {index.size} combinações")
+    return index
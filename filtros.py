@@ -0,0 +1,98 @@
+import hashlib
+from dataclasses import dataclass, fields, replace
+from datetime import date
+
+import pandas as pd
+
+
+def _as_date(value):
+    # Aceita date, datetime, Timestamp ou 'AAAA-MM-DD': o mesmo dia vira sempre o mesmo valor
+    if value is None or value == '':
+        return None
+    return pd.Timestamp(value).date()
+
+
+def _as_members(values):
+    # Ordem da seleção e repetições não mudam o filtro. Os valores ficam como vieram: as
+    # opções saem dos dados (com espaços, se houver) e são comparadas com a coluna crua
+    if not values:
+        return ()
+    if isinstance(values, str):
+        values = [values]
+    return tuple(sorted({str(v) for v in values if v is not None}))
+
+
+def sql_literal(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def sql_in(column, values):
+    # Cláusula AND ... IN (...) no formato usado pelas queries; vazio quando não há seleção
+    if not values:
+        return ""
+    return f"AND {column} IN ({', '.join(sql_literal(v) for v in values)})"
+
+
+def sql_equals(column, value):
+    if not value:
+        return ""
+    return f"AND {column} = {sql_literal(value)}"
+
+
+@dataclass(frozen=True)
+class FilterSet:
+    """Filtros do dashboard em forma canônica.
+
+    Imutável e hashável: listas viram tuplas ordenadas e sem repetição, datas viram
+    ``date``. A mesma seleção lógica gera sempre o mesmo objeto, o mesmo SQL e,
+    portanto, a mesma chave em todos os caches (st.cache_data, cache de resultados,
+    snapshots de status de clientes).
+    """
+
+    cod_colaborador: str = ''
+    start_date: date = None
+    end_date: date = None
+    channels: tuple = ()
+    ufs: tuple = ()
+    brands: tuple = ()
+    nomes_colaborador: tuple = ()
+
+    def __post_init__(self):
+        object.__setattr__(self, 'cod_colaborador', str(self.cod_colaborador or ''))
+        object.__setattr__(self, 'start_date', _as_date(self.start_date))
+        object.__setattr__(self, 'end_date', _as_date(self.end_date))
+        for name in ('channels', 'ufs', 'brands', 'nomes_colaborador'):
+            object.__setattr__(self, name, _as_members(getattr(self, name)))
+
+    @classmethod
+    def from_session(cls, state):
+        # Monta os filtros a partir do st.session_state das páginas
+        return cls(
+            cod_colaborador=state.get('cod_colaborador', ''),
+            start_date=state.get('start_date'),
+            end_date=state.get('end_date'),
+            channels=state.get('selected_channels'),
+            ufs=state.get('selected_ufs'),
+            brands=state.get('selected_brands'),
+            nomes_colaborador=state.get('selected_colaboradores'),
+        )
+
+    def only(self, *names):
+        # Mantém só os campos que a consulta usa; os demais voltam ao padrão para que
+        # mudanças irrelevantes não gerem novas chaves de cache
+        return FilterSet(**{name: getattr(self, name) for name in names})
+
+    def replace(self, **changes):
+        return replace(self, **changes)
+
+    def as_dict(self):
+        return {f.name: getattr(self, f.name) for f in fields(self)}
+
+    def key(self):
+        # Identificador estável e curto (diretórios de snapshot, logs)
+        parts = []
+        for name, value in self.as_dict().items():
+            if isinstance(value, tuple):
+                value = ','.join(value)
+            parts.append(f"{name}={'' if value is None else value}")
+        return hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()[:16]
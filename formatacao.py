@@ -0,0 +1,46 @@
+import os
+
+import streamlit as st
+
+from rastreio import span
+
+
+# Formatação de tabelas na renderização: os DataFrames mantêm dtypes numéricos (ordenação
+# numérica no st.dataframe, sem colunas object) e o texto "R$ 1,234.56" é gerado só na tela.
+# Tabelas pequenas usam Styler (separador de milhar); acima de STYLER_MAX_CELLS, o Styler
+# formataria célula a célula em Python, então o formato vai para st.column_config e é
+# aplicado no navegador.
+STYLER_MAX_CELLS = int(os.environ.get('STYLER_MAX_CELLS', '20000'))
+
+# tipo -> (formato do Styler, formato printf do NumberColumn)
+FORMATS = {
+    'moeda': ('R$ {:,.2f}', 'R$ %.2f'),
+    'inteiro': ('{:,.0f}', '%d'),
+    'decimal': ('{:.2f}', '%.2f'),
+    'percentual': ('{:.2f}%', '%.2f%%'),  # valores em 0-100
+}
+
+
+def number_column_config(formats, labels=None):
+    # formats: coluna -> tipo em FORMATS
+    labels = labels or {}
+    return {
+        column: st.column_config.NumberColumn(labels.get(column, column), format=FORMATS[kind][1])
+        for column, kind in formats.items()
+    }
+
+
+def show_table(df, formats, labels=None, column_config=None, **kwargs):
+    # column_config explícito (ex.: ProgressColumn) tem precedência sobre o formato padrão
+    column_config = dict(column_config or {})
+    formats = {column: kind for column, kind in formats.items() if column in df.columns and column not in column_config}
+    labels = labels or {}
+    if df.size <= STYLER_MAX_CELLS:
+        data = df.style.format({column: FORMATS[kind][0] for column, kind in formats.items()}, na_rep='')
+    else:
+        data = df
+        column_config = {**number_column_config(formats, labels), **column_config}
+    for column, label in labels.items():
+        column_config.setdefault(column, label)
+    with span('renderizar', componente='tabela', celulas=df.size):
+        return st.dataframe(data, column_config=column_config, **kwargs)
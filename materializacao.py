@@ -0,0 +1,279 @@
+import os
+import time
+import logging
+import argparse
+import threading
+from datetime import date
+
+import pandas as pd
+
+from admissao import PRIORITY_BATCH, query_priority
+from backends import ATHENA_DATABASE, get_backend
+
+
+# Tabela materializada com o custo médio mensal (CMV) por pedido, produto e marca.
+# É a mesma subquery que get_monthly_revenue e get_brand_data calculavam sobre todo o
+# histórico a cada chamada; aqui ela é gravada uma vez por mês, particionada por mes_ref.
+# O agendador do pré-aquecimento atualiza os meses abertos antes de aquecer o cache; as
+# consultas só usam a tabela para meses presentes e em dia (cmv_mensal_covers) e, fora
+# disso, calculam o mesmo SELECT na hora.
+CMV_MENSAL_TABLE = os.environ.get('CMV_MENSAL_TABLE', f'"{ATHENA_DATABASE}".cmv_mensal')
+CMV_MENSAL_LOCATION = os.environ.get('CMV_MENSAL_LOCATION', 's3://databeautykamico/gold/databeautykami/cmv_mensal/')
+
+# Meses ainda abertos recebem novos custos; por padrão o refresh recalcula o mês
+# corrente e o anterior
+CMV_MENSAL_MESES_ABERTOS = int(os.environ.get('CMV_MENSAL_MESES_ABERTOS', '2'))
+# Primeiro mês (AAAA-MM) carregado quando a tabela é criada. Vazio: o mês mais antigo
+# com custo nas tabelas de origem
+CMV_MENSAL_INICIO = os.environ.get('CMV_MENSAL_INICIO', '')
+# Idade máxima (segundos) da carga de um mês aberto para que as consultas usem a tabela
+CMV_MENSAL_MAX_AGE = int(os.environ.get('CMV_MENSAL_MAX_AGE', str(26 * 3600)))
+# Por quanto tempo (segundos) o processo reaproveita a lista de meses carregados
+CMV_MENSAL_STATUS_TTL = int(os.environ.get('CMV_MENSAL_STATUS_TTL', '600'))
+
+_status = None  # (consultado_em, {mes_ref: atualizado_em em epoch})
+_status_lock = threading.Lock()
+
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def add_months(value, months):
+    month_index = value.year * 12 + value.month - 1 + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def month_range(start, end):
+    current = month_start(start)
+    while current <= end:
+        yield current
+        current = add_months(current, 1)
+
+
+def cmv_mensal_select(start=None, end=None):
+    # Meses de start a end (padrão: só start); sem start, todo o histórico (usado apenas
+    # para criar a tabela). Intervalo sobre a coluna crua (sem DATE_TRUNC) para permitir
+    # poda de partições
+    varejo_filter = ""
+    salao_filter = ""
+    if start:
+        inicio = month_start(start)
+        fim = add_months(month_start(end or start), 1)
+        varejo_filter = f"WHERE dt_faturamento >= DATE '{inicio:%Y-%m-%d}' AND dt_faturamento < DATE '{fim:%Y-%m-%d}'"
+        salao_filter = f"AND dtvenda >= DATE '{inicio:%Y-%m-%d}' AND dtvenda < DATE '{fim:%Y-%m-%d}'"
+    return f"""
+    SELECT
+        cod_pedido,
+        cod_produto,
+        marca,
+        SUM(custo_medio) AS custo_medio,
+        mes_ref,
+        CAST(CURRENT_TIMESTAMP AS TIMESTAMP(6)) AS atualizado_em
+    FROM (
+        SELECT
+            cod_pedido,
+            cod_produto,
+            upper(marca.desc_abrev) marca,
+            DATE_TRUNC('month', dt_faturamento) mes_ref,
+            CASE WHEN fator IS NULL Then ROUND(SUM(qtd * custo_unitario) / NULLIF(SUM(qtd), 0), 2)
+            Else ROUND(SUM(qtd * (custo_unitario/fator)) / NULLIF(SUM(qtd), 0), 2)  END custo_medio
+        FROM "databeautykami".tbl_varejo_cmv left join "databeautykami".tbl_distribuicao_bonificacao
+            ON tbl_varejo_cmv.cod_marca = tbl_distribuicao_bonificacao.cod_marca
+            and tbl_varejo_cmv.cod_empresa = cast(tbl_distribuicao_bonificacao.cod_empresa as varchar)
+            and DATE_TRUNC('month', dt_faturamento) = date(tbl_distribuicao_bonificacao.mes_ref)
+        LEFT JOIN "databeautykami".tbl_varejo_marca marca ON marca.cod_marca = tbl_varejo_cmv.cod_marca
+        {varejo_filter}
+        GROUP BY 1, 2, 3, 4, fator
+        UNION ALL
+        SELECT
+            cod_pedido,
+            codprod,
+            upper(categoria) marca,
+            DATE_TRUNC('month', dtvenda) mes_ref,
+            CASE WHEN fator IS NULL Then ROUND(SUM(quant * custo) / NULLIF(SUM(quant), 0), 2)
+            Else ROUND(SUM(quant * (custo/fator)) / NULLIF(SUM(quant), 0), 2)  END custo_medio
+        FROM "databeautykami".tbl_salao_pedidos_salao left join "databeautykami".tbl_distribuicao_bonificacao
+            ON DATE_TRUNC('month', dtvenda) = date(tbl_distribuicao_bonificacao.mes_ref)
+            AND ( trim(upper(tbl_salao_pedidos_salao.categoria)) = trim(upper(tbl_distribuicao_bonificacao.marca))
+                  OR substring(replace(upper(tbl_salao_pedidos_salao.categoria),'-',''),1,4) = upper(tbl_distribuicao_bonificacao.marca)
+                  )
+        where fator is not null
+            {salao_filter}
+        GROUP BY 1, 2, 3, 4, fator
+    ) cmv_aux
+    GROUP BY cod_pedido, cod_produto, marca, mes_ref
+    """
+
+
+def cmv_mensal_name():
+    # (database, tabela) de CMV_MENSAL_TABLE; sem database, o do Athena
+    parts = [part.strip('"') for part in CMV_MENSAL_TABLE.split('.')]
+    return (parts[-2] if len(parts) > 1 else ATHENA_DATABASE), parts[-1]
+
+
+def cmv_mensal_exists(backend):
+    database, table = cmv_mensal_name()
+    df = backend.execute(f"SHOW TABLES IN {database} '{table}'")
+    return not df.empty
+
+
+def cmv_history_start(backend):
+    # Mês mais antigo com custo nas origens; as páginas fazem COALESCE(custo_medio, 0), então
+    # um mês sem linhas na tabela apareceria com custo e markup zerados
+    if CMV_MENSAL_INICIO:
+        return parse_month(CMV_MENSAL_INICIO)
+    df = backend.execute(f"""
+    SELECT MIN(inicio) inicio FROM (
+        SELECT MIN(dt_faturamento) inicio FROM "{ATHENA_DATABASE}".tbl_varejo_cmv
+        UNION ALL
+        SELECT MIN(dtvenda) inicio FROM "{ATHENA_DATABASE}".tbl_salao_pedidos_salao
+    ) origens
+    """)
+    inicio = df['inicio'].iloc[0] if not df.empty else None
+    return month_start(inicio) if inicio is not None and not pd.isna(inicio) else None
+
+
+def create_cmv_mensal(backend):
+    # Tabela Iceberg para permitir DELETE + INSERT por partição (refresh de um mês)
+    logging.info(f"Criando tabela {CMV_MENSAL_TABLE}")
+    backend.execute(f"""
+    CREATE TABLE {CMV_MENSAL_TABLE}
+    WITH (
+        table_type = 'ICEBERG',
+        is_external = false,
+        location = '{CMV_MENSAL_LOCATION}',
+        format = 'PARQUET',
+        partitioning = ARRAY['mes_ref']
+    ) AS {cmv_mensal_select()}
+    WITH NO DATA
+    """)
+
+
+def cmv_mensal_merge(mes_ref):
+    # Um único MERGE por mês (um commit no Iceberg): quem lê a tabela vê o mês antigo ou o
+    # novo, nunca o mês vazio entre um DELETE e um INSERT. Linhas que sumiram das origens
+    # entram na fonte marcadas para remoção.
+    mes = f"DATE '{mes_ref:%Y-%m-%d}'"
+    chave = ' AND '.join(f"{{a}}.{column} IS NOT DISTINCT FROM {{b}}.{column}" for column in ('cod_pedido', 'cod_produto', 'marca'))
+    return f"""
+    MERGE INTO {CMV_MENSAL_TABLE} t
+    USING (
+        WITH novo AS ({cmv_mensal_select(mes_ref)})
+        SELECT cod_pedido, cod_produto, marca, custo_medio, mes_ref, atualizado_em, false AS remover
+        FROM novo
+        UNION ALL
+        SELECT atual.cod_pedido, atual.cod_produto, atual.marca, atual.custo_medio, atual.mes_ref, atual.atualizado_em, true AS remover
+        FROM {CMV_MENSAL_TABLE} atual
+        WHERE atual.mes_ref = {mes}
+            AND NOT EXISTS (SELECT 1 FROM novo WHERE {chave.format(a='novo', b='atual')})
+    ) s
+    ON t.mes_ref = {mes} AND t.mes_ref = s.mes_ref AND {chave.format(a='t', b='s')}
+    WHEN MATCHED AND s.remover THEN DELETE
+    WHEN MATCHED THEN UPDATE SET custo_medio = s.custo_medio, atualizado_em = s.atualizado_em
+    WHEN NOT MATCHED THEN INSERT (cod_pedido, cod_produto, marca, custo_medio, mes_ref, atualizado_em)
+        VALUES (s.cod_pedido, s.cod_produto, s.marca, s.custo_medio, s.mes_ref, s.atualizado_em)
+    """
+
+
+def refresh_cmv_mensal_month(backend, mes_ref):
+    mes_ref = month_start(mes_ref)
+    logging.info(f"Atualizando {CMV_MENSAL_TABLE} para {mes_ref:%Y-%m}")
+    backend.execute(cmv_mensal_merge(mes_ref))
+
+
+def refresh_cmv_mensal(start=None, end=None, backend=None):
+    # Sem intervalo, recalcula apenas os meses ainda abertos
+    backend = backend or get_backend()
+    end = month_start(end or date.today())
+    start = month_start(start or add_months(end, 1 - CMV_MENSAL_MESES_ABERTOS))
+
+    # Job em lote: na fila do Athena, depois das páginas e do pré-aquecimento
+    with query_priority(PRIORITY_BATCH):
+        if not cmv_mensal_exists(backend):
+            create_cmv_mensal(backend)
+            # Tabela nova (vazia): carrega todo o histórico, não só os meses pedidos
+            inicio = cmv_history_start(backend)
+            if inicio is not None and inicio < start:
+                logging.info(f"Carga inicial de {CMV_MENSAL_TABLE} desde {inicio:%Y-%m}")
+                start = inicio
+        meses = list(month_range(start, end))
+        try:
+            for mes_ref in meses:
+                refresh_cmv_mensal_month(backend, mes_ref)
+        finally:
+            invalidate_cmv_mensal_status()
+    logging.info(f"{CMV_MENSAL_TABLE} atualizada: {len(meses)} mês(es) de {start:%Y-%m} a {end:%Y-%m}")
+    return meses
+
+
+def cmv_mensal_status(query):
+    # {mes_ref: última carga (epoch)} dos meses presentes na tabela, reaproveitado por
+    # CMV_MENSAL_STATUS_TTL segundos. Uma falha (tabela inexistente, Athena fora) vale como
+    # tabela vazia pelo mesmo tempo: as consultas calculam o CMV na hora, que é sempre correto
+    global _status
+    with _status_lock:
+        if _status is not None and time.time() - _status[0] < CMV_MENSAL_STATUS_TTL:
+            return _status[1]
+    try:
+        df = query(
+            f"SELECT mes_ref, MAX(atualizado_em) AS atualizado_em FROM {CMV_MENSAL_TABLE} GROUP BY mes_ref",
+            domain='vendas', use_cache=False, raise_errors=True,
+        )
+        # atualizado_em é gravado em UTC, sem fuso
+        atualizado = pd.to_datetime(df['atualizado_em']).dt.tz_localize('UTC')
+        status = {
+            month_start(mes.date()): ts.timestamp()
+            for mes, ts in zip(pd.to_datetime(df['mes_ref']), atualizado)
+            if not pd.isna(mes) and not pd.isna(ts)
+        }
+    except Exception as e:
+        logging.warning(f"Não foi possível consultar os meses carregados em {CMV_MENSAL_TABLE}: {str(e)}")
+        status = {}
+    with _status_lock:
+        _status = (time.time(), status)
+    return status
+
+
+def invalidate_cmv_mensal_status():
+    global _status
+    with _status_lock:
+        _status = None
+
+
+def cmv_mensal_covers(query, start_date, end_date, today=None):
+    # A tabela responde pelo período se todos os meses dele estão carregados e os meses
+    # ainda abertos foram carregados há menos de CMV_MENSAL_MAX_AGE segundos
+    status = cmv_mensal_status(query)
+    if not status:
+        return False
+    today = today or date.today()
+    abertos_desde = add_months(month_start(today), 1 - CMV_MENSAL_MESES_ABERTOS)
+    for mes in month_range(start_date, min(end_date, today)):
+        atualizado = status.get(mes)
+        if atualizado is None:
+            return False
+        if mes >= abertos_desde and time.time() - atualizado > CMV_MENSAL_MAX_AGE:
+            return False
+    return True
+
+
+def parse_month(value):
+    year, month = value.split('-')[:2]
+    return date(int(year), int(month), 1)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Materializa tabelas agregadas usadas pelos dashboards.")
+    parser.add_argument('tabela', choices=['cmv_mensal'])
+    parser.add_argument('--desde', type=parse_month, help="Primeiro mês (AAAA-MM). Padrão: meses ainda abertos.")
+    parser.add_argument('--ate', type=parse_month, help="Último mês (AAAA-MM). Padrão: mês corrente.")
+    args = parser.parse_args()
+
+    if args.tabela == 'cmv_mensal':
+        refresh_cmv_mensal(args.desde, args.ate)
+
+
+if __name__ == "__main__":
+    main()
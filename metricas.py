@@ -0,0 +1,190 @@
+import os
+import json
+import time
+import inspect
+import logging
+import sqlite3
+import threading
+import contextvars
+from datetime import date, datetime
+from functools import wraps
+
+import pandas as pd
+
+from rastreio import span
+
+
+# Métricas por execução de query (tempo de fila/planejamento/execução do Athena, bytes
+# escaneados, tempo de leitura/conversão) gravadas em um SQLite local para a página de admin
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+METRICS_DB = os.environ.get('METRICS_DB', os.path.join('.cache', 'metricas.db'))
+# Preço do Athena por TB escaneado (USD), usado para estimar custo na página de admin
+ATHENA_PRICE_PER_TB = float(os.environ.get('ATHENA_PRICE_PER_TB', '5'))
+
+METRIC_COLUMNS = [
+    'ts', 'funcao', 'filtros', 'backend', 'fetch', 'domain', 'query_hash', 'query_id', 'status',
+    'data_scanned_bytes', 'queue_ms', 'planning_ms', 'engine_ms', 'service_ms', 'total_ms',
+    'fetch_ms', 'convert_ms', 'wall_ms', 'rows', 'error', 'admission_ms',
+]
+NUMERIC_COLUMNS = [
+    'ts', 'data_scanned_bytes', 'queue_ms', 'planning_ms', 'engine_ms', 'service_ms', 'total_ms',
+    'fetch_ms', 'convert_ms', 'wall_ms', 'rows', 'admission_ms',
+]
+
+_current_call = contextvars.ContextVar('metricas_current_call', default=None)
+_lock = threading.Lock()
+_initialized = set()
+
+
+def _normalize(value):
+    if hasattr(value, 'as_dict'):  # FilterSet
+        return {k: _normalize(v) for k, v in value.as_dict().items()}
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sorted(_normalize(v) for v in value)
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+
+def normalize_filters(arguments):
+    # Listas ordenadas, datas em ISO: filtros equivalentes geram o mesmo texto
+    return json.dumps({k: _normalize(v) for k, v in sorted(arguments.items())}, ensure_ascii=False, sort_keys=True)
+
+
+def instrumented(func):
+    # Registra o nome da função de dashboard e os filtros recebidos para as queries que
+    # ela disparar (lidos por record_query através de um ContextVar)
+    signature = inspect.signature(func)
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            bound = signature.bind_partial(*args, **kwargs)
+            filters = normalize_filters(bound.arguments)
+        except TypeError:
+            filters = None
+        token = _current_call.set((func.__name__, filters))
+        try:
+            with span(func.__name__, filtros=filters):
+                return func(*args, **kwargs)
+        finally:
+            _current_call.reset(token)
+
+    return wrapper
+
+
+def current_call():
+    return _current_call.get() or (None, None)
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, timeout=5)
+    if path not in _initialized:
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS query_metrics (
+            ts REAL, funcao TEXT, filtros TEXT, backend TEXT, fetch TEXT, domain TEXT,
+            query_hash TEXT, query_id TEXT, status TEXT,
+            data_scanned_bytes INTEGER, queue_ms REAL, planning_ms REAL, engine_ms REAL,
+            service_ms REAL, total_ms REAL, fetch_ms REAL, convert_ms REAL, wall_ms REAL,
+            rows INTEGER, error TEXT, admission_ms REAL
+        )""")
+        # Bancos criados antes de uma coluna existir ganham a coluna (nula nas linhas antigas)
+        existing = {row[1] for row in conn.execute('PRAGMA table_info(query_metrics)')}
+        for column, kind in [('admission_ms', 'REAL')]:
+            if column not in existing:
+                conn.execute(f'ALTER TABLE query_metrics ADD COLUMN {column} {kind}')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_query_metrics_ts ON query_metrics (ts)')
+        _initialized.add(path)
+    return conn
+
+
+def record_query(metrics, path=None):
+    if not METRICS_ENABLED:
+        return
+    path = path or METRICS_DB
+    funcao, filtros = current_call()
+    row = dict(metrics)
+    row.setdefault('ts', time.time())
+    row.setdefault('funcao', funcao)
+    row.setdefault('filtros', filtros)
+    values = [row.get(column) for column in METRIC_COLUMNS]
+    try:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with _lock:
+            conn = _connect(path)
+            try:
+                with conn:
+                    conn.execute(
+                        f"INSERT INTO query_metrics ({', '.join(METRIC_COLUMNS)}) VALUES ({', '.join('?' * len(METRIC_COLUMNS))})",
+                        values,
+                    )
+            finally:
+                conn.close()
+    except Exception as e:
+        # Métrica nunca deve derrubar a consulta
+        logging.warning(f"Não foi possível gravar métricas da query: {str(e)}")
+
+
+def load_metrics(since=None, path=None):
+    path = path or METRICS_DB
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=METRIC_COLUMNS)
+    with _lock:
+        conn = _connect(path)
+        try:
+            df = pd.read_sql_query(
+                'SELECT * FROM query_metrics WHERE ts >= ? ORDER BY ts',
+                conn,
+                params=(since or 0,),
+            )
+        finally:
+            conn.close()
+    # Colunas só com nulos (ex.: fila no backend local) voltam como object
+    for column in NUMERIC_COLUMNS:
+        df[column] = pd.to_numeric(df[column], errors='coerce')
+    return df
+
+
+def summarize_metrics(df):
+    # p50/p95 de latência e bytes escaneados por função de dashboard
+    if df.empty:
+        return pd.DataFrame()
+    df = df.assign(funcao=df['funcao'].fillna('(sem função)'))
+    executed = df[df['status'] == 'ok']
+    grouped = df.groupby('funcao')
+    summary = pd.DataFrame({
+        'chamadas': grouped.size(),
+        'cache_hit_%': grouped['status'].apply(lambda s: (s == 'cache').mean() * 100),
+        # Chamadas atendidas por uma execução idêntica já em andamento (single-flight)
+        'compartilhadas_%': grouped['status'].apply(lambda s: (s == 'shared').mean() * 100),
+        'erros': grouped['status'].apply(lambda s: (s == 'error').sum()),
+    })
+    if not executed.empty:
+        by_function = executed.groupby('funcao')
+        summary = summary.join(pd.DataFrame({
+            'latencia_p50_ms': by_function['wall_ms'].quantile(0.5),
+            'latencia_p95_ms': by_function['wall_ms'].quantile(0.95),
+            'fila_p95_ms': by_function['queue_ms'].quantile(0.95),
+            # Espera pela vaga no controle de admissão do processo, antes de submeter ao Athena
+            'admissao_p95_ms': by_function['admission_ms'].quantile(0.95),
+            'bytes_escaneados': by_function['data_scanned_bytes'].sum(),
+            'bytes_p95': by_function['data_scanned_bytes'].quantile(0.95),
+        }))
+        summary['custo_estimado_usd'] = summary['bytes_escaneados'].fillna(0) / 1024 ** 4 * ATHENA_PRICE_PER_TB
+    return summary.reset_index().sort_values('chamadas', ascending=False)
+
+
+def top_filters_by_scan(df, limit=20):
+    executed = df[(df['status'] == 'ok') & df['data_scanned_bytes'].notna()]
+    if executed.empty:
+        return pd.DataFrame()
+    grouped = executed.groupby(['funcao', 'filtros'], dropna=False).agg(
+        execucoes=('ts', 'size'),
+        bytes_escaneados=('data_scanned_bytes', 'sum'),
+        latencia_p95_ms=('wall_ms', lambda s: s.quantile(0.95)),
+    ).reset_index()
+    grouped['custo_estimado_usd'] = grouped['bytes_escaneados'] / 1024 ** 4 * ATHENA_PRICE_PER_TB
+    return grouped.sort_values('bytes_escaneados', ascending=False).head(limit)
@@ -3,31 +3,61 @@ import pandas as pd
 from datetime import date
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
-import time
 from utils import (
     get_monthly_revenue, 
     get_brand_data, 
     get_channels_and_ufs, 
     get_colaboradores, 
     get_client_status,
-    create_client_status_chart
+    create_client_status_chart,
+    run_concurrently,
+    FilterSet
 )
+from formatacao import show_table
+from rastreio import span
+from perfilador import page_run
 
+# O st.cache_data usa o argumento como chave: quem chama passa só os filtros que cada
+# consulta usa (FilterSet.only/replace), e mudar uma seleção que não afeta a consulta
+# não gera uma nova entrada de cache
 @st.cache_data
-def get_monthly_revenue_cached(cod_colaborador, start_date, end_date, selected_channels, selected_ufs, selected_brands, selected_nome_colaborador):
-    return get_monthly_revenue(cod_colaborador, start_date, end_date, selected_channels, selected_ufs, selected_brands,selected_nome_colaborador)
+def get_monthly_revenue_cached(filters):
+    return get_monthly_revenue(filters)
 
 @st.cache_data
-def get_brand_data_cached(cod_colaborador, start_date, end_date, selected_channels, selected_ufs, selected_nome_colaborador):
-    return get_brand_data(cod_colaborador, start_date, end_date, selected_channels, selected_ufs, selected_nome_colaborador)
+def get_brand_data_cached(filters):
+    # filters sem marcas
+    return get_brand_data(filters)
 
 @st.cache_data
-def get_channels_and_ufs_cached(cod_colaborador, start_date, end_date):
-    return get_channels_and_ufs(cod_colaborador, start_date, end_date)
+def get_channels_and_ufs_cached(filters):
+    # filters: cod_colaborador, start_date, end_date
+    return get_channels_and_ufs(filters)
 
 @st.cache_data
-def get_colaboradores_cached(start_date, end_date, selected_channels, selected_ufs):
-    return get_colaboradores(start_date, end_date, selected_channels, selected_ufs)
+def get_colaboradores_cached(filters):
+    # filters: start_date, end_date, channels, ufs
+    return get_colaboradores(filters)
+
+LOAD_LABELS = {
+    'df': "receita mensal",
+    'brand_data': "dados de marca",
+    'client_status_data': "status do cliente",
+}
+
+def load_dashboard_data(on_done=None):
+    # As três consultas são independentes: disparadas juntas, o tempo total fica
+    # próximo ao da mais lenta em vez da soma das três
+    filters = FilterSet.from_session(st.session_state)
+    tasks = {
+        'df': (get_monthly_revenue_cached, (filters,), {}),
+        'brand_data': (get_brand_data_cached, (filters.replace(brands=()),), {}),
+        # Status de clientes não filtra por marca
+        'client_status_data': (get_client_status, (filters.replace(brands=()),), {}),
+    }
+    results = run_concurrently(tasks, on_done=on_done)
+    for key, value in results.items():
+        st.session_state[key] = value
 
 def create_dashboard(df, brand_data, client_status_data, cod_colaborador, start_date, end_date, selected_channels, selected_ufs, selected_brands, selected_colaboradores, show_additional_info):
     if cod_colaborador:
@@ -62,7 +92,7 @@ def create_dashboard(df, brand_data, client_status_data, cod_colaborador, start_
 
     # Obtendo o mês mais recente
     latest_month = df['mes_ref'].max()
-    latest_data = df[df['mes_ref'] == latest_month].groupby('mes_ref').sum().iloc[0]
+    latest_data = df[df['mes_ref'] == latest_month].groupby('mes_ref').sum(numeric_only=True).iloc[0]
 
     # Cálculo dos percentuais
     desconto_percentual = (latest_data['desconto'] / latest_data['faturamento_bruto']) * 100 if latest_data['faturamento_bruto'] != 0 else 0
@@ -79,9 +109,9 @@ def create_dashboard(df, brand_data, client_status_data, cod_colaborador, start_
         st.metric("Bonificação", f"R$ {latest_data['valor_bonificacao']:,.2f}")
         st.markdown(f"<p style='font-size: medium; color: green;'>({bonificacao_percentual:.2f}% do faturamento líquido)</p>", unsafe_allow_html=True)
     with col4:
-        st.metric("Clientes Únicos", f"{latest_data['positivacao']:,}")
+        st.metric("Clientes Únicos", f"{int(latest_data['positivacao']):,}")
     with col5:
-        st.metric("Pedidos", f"{latest_data['qtd_pedido']:,}")
+        st.metric("Pedidos", f"{int(latest_data['qtd_pedido']):,}")
      
     col1, col2, col3, col4, col5 = st.columns(5)
     with col1:        
@@ -98,7 +128,7 @@ def create_dashboard(df, brand_data, client_status_data, cod_colaborador, start_
             y=monthly_data['faturamento_liquido'], 
             name="Faturamento",
             marker_color='lightblue',
-            text=monthly_data['faturamento_liquido'].apply(lambda x: f"R$ {x:,.0f}"),
+            texttemplate="R$ %{y:,.0f}",
             textposition='outside',
             hovertemplate="Mês: %{x|%B %Y}<br>Faturamento: R$ %{y:,.2f}<extra></extra>"
         ),
@@ -113,7 +143,7 @@ def create_dashboard(df, brand_data, client_status_data, cod_colaborador, start_
             mode='lines+markers+text',
             line=dict(color='red', width=2),
             marker=dict(size=8),
-            text=monthly_data['positivacao'].apply(lambda x: f"{x:,.0f}"),
+            texttemplate="%{y:,.0f}",
             textposition='top center',
             hovertemplate="Mês: %{x|%B %Y}<br>Clientes Únicos: %{y:,.0f}<extra></extra>"
         ),
@@ -152,9 +182,9 @@ def create_dashboard(df, brand_data, client_status_data, cod_colaborador, start_
         # Calculando o total de faturamento para o share
         total_faturamento = brand_data['faturamento'].sum()
         
-        # Calculando o share e formatando o markup
-        brand_data['share'] = brand_data['faturamento'] / total_faturamento
-        brand_data['markup'] = brand_data['markup_percentual'].apply(lambda x: f"{(x/100 + 1):.2f}")
+        # Share (0-100) e markup continuam numéricos; o formato é aplicado na renderização
+        brand_data['share'] = brand_data['faturamento'] / total_faturamento * 100
+        brand_data['markup'] = brand_data['markup_percentual'] / 100 + 1
         
         # Ordenando por faturamento
         brand_data = brand_data.sort_values('faturamento', ascending=False)
@@ -163,19 +193,24 @@ def create_dashboard(df, brand_data, client_status_data, cod_colaborador, start_
         desired_columns = ['marca', 'faturamento', 'share', 'clientes_unicos', 'qtd_pedido', 'qtd_sku', 'Ticket_Medio_Positivacao', 'markup']
         
         # Criando um novo DataFrame com as colunas desejadas
-        display_data = brand_data[desired_columns].copy().set_index('marca')
+        display_data = brand_data[desired_columns].set_index('marca')
         
-        # Formatando as colunas numéricas
-        display_data['faturamento'] = display_data['faturamento'].apply(lambda x: f"R$ {x:,.2f}")
-        display_data['Ticket_Medio_Positivacao'] = display_data['Ticket_Medio_Positivacao'].apply(lambda x: f"R$ {x:,.2f}")
-        display_data['share'] = display_data['share'].apply(lambda x: f"{x:.2%}")
-        
-        st.dataframe(display_data,
-                     column_config={
-                         "share": st.column_config.ProgressColumn(
-                             "share"
-                         )
-                     })
+        show_table(
+            display_data,
+            formats={
+                'faturamento': 'moeda',
+                'clientes_unicos': 'inteiro',
+                'qtd_pedido': 'inteiro',
+                'qtd_sku': 'inteiro',
+                'Ticket_Medio_Positivacao': 'moeda',
+                'markup': 'decimal',
+            },
+            column_config={
+                "share": st.column_config.ProgressColumn(
+                    "share", format="%.2f%%", min_value=0, max_value=100
+                )
+            },
+        )
     else:
         st.warning("Não há dados por marca disponíveis para o período e/ou filtros selecionados.")
 
@@ -227,7 +262,7 @@ def main():
             st.session_state['data_needs_update'] = True
 
         # Atualizar canais e UFs
-        channels, ufs = get_channels_and_ufs_cached(st.session_state['cod_colaborador'], st.session_state['start_date'], st.session_state['end_date'])
+        channels, ufs = get_channels_and_ufs_cached(FilterSet.from_session(st.session_state).only('cod_colaborador', 'start_date', 'end_date'))
         
         # Canais de Venda
         new_selected_channels = st.sidebar.multiselect("Selecione os canais de venda", options=channels, default=st.session_state['selected_channels'])
@@ -243,7 +278,7 @@ def main():
 
         # Colaboradores
         if not st.session_state['cod_colaborador']:
-            colaboradores_df = get_colaboradores_cached(st.session_state['start_date'], st.session_state['end_date'], st.session_state['selected_channels'], st.session_state['selected_ufs'])
+            colaboradores_df = get_colaboradores_cached(FilterSet.from_session(st.session_state).only('start_date', 'end_date', 'channels', 'ufs'))
             available_colaboradores = colaboradores_df['nome_colaborador'].tolist()
             new_selected_colaboradores = st.sidebar.multiselect("Selecione os colaboradores (deixe vazio para todos)", options=available_colaboradores, default=st.session_state['selected_colaboradores'])
             if new_selected_colaboradores != st.session_state['selected_colaboradores']:
@@ -257,43 +292,11 @@ def main():
             progress_text = "Operação em andamento. Aguarde..."
             my_bar = st.progress(0, text=progress_text)
 
-            try:
-                # Carregando dados de receita mensal
-                my_bar.progress(10, text="Carregando dados de receita mensal...")
-                st.session_state['df'] = get_monthly_revenue_cached(
-                    st.session_state['cod_colaborador'],
-                    st.session_state['start_date'],
-                    st.session_state['end_date'],
-                    st.session_state['selected_channels'],
-                    st.session_state['selected_ufs'],
-                    st.session_state['selected_brands'],
-                    st.session_state['selected_colaboradores']
-                )
-
-                # Carregando dados de marca
-                my_bar.progress(40, text="Carregando dados de marca...")
-                st.session_state['brand_data'] = get_brand_data_cached(
-                    st.session_state['cod_colaborador'],
-                    st.session_state['start_date'],
-                    st.session_state['end_date'],
-                    st.session_state['selected_channels'],
-                    st.session_state['selected_ufs'],
-                    st.session_state['selected_colaboradores']
-                )
-
-                # Carregando dados de status do cliente
-                my_bar.progress(70, text="Carregando dados de status do cliente...")
-                st.session_state['client_status_data'] = get_client_status(
-                    start_date=st.session_state['start_date'].strftime('%Y-%m-%d'),
-                    end_date=st.session_state['end_date'].strftime('%Y-%m-%d'),
-                    cod_colaborador=st.session_state['cod_colaborador'],
-                    selected_channels=st.session_state['selected_channels'],
-                    selected_ufs=st.session_state['selected_ufs'],
-                    selected_colaboradores=st.session_state['selected_colaboradores']
-                )
+            def update_progress(name, done, total):
+                my_bar.progress(int(done / total * 100), text=f"Dados de {LOAD_LABELS[name]} carregados ({done}/{total})...")
 
-                my_bar.progress(100, text="Carregamento concluído!")
-                time.sleep(1)  # Pausa breve para que o usuário veja a conclusão
+            try:
+                load_dashboard_data(on_done=update_progress)
                 my_bar.empty()  # Remove a barra de progresso
 
             except Exception as e:
@@ -320,32 +323,7 @@ def main():
         if st.session_state['data_needs_update']:
             with st.spinner('Atualizando dados...'):
                 try:
-                    st.session_state['df'] = get_monthly_revenue_cached(
-                        st.session_state['cod_colaborador'],
-                        st.session_state['start_date'],
-                        st.session_state['end_date'],
-                        st.session_state['selected_channels'],
-                        st.session_state['selected_ufs'],
-                        st.session_state['selected_brands'],
-                        st.session_state['selected_colaboradores']
-                    )
-                    st.session_state['brand_data'] = get_brand_data_cached(
-                        st.session_state['cod_colaborador'],
-                        st.session_state['start_date'],
-                        st.session_state['end_date'],
-                        st.session_state['selected_channels'],
-                        st.session_state['selected_ufs'],
-                        st.session_state['selected_colaboradores']
-                    )
-                    # Atualizar dados de status do cliente
-                    st.session_state['client_status_data'] = get_client_status(
-                        start_date=st.session_state['start_date'].strftime('%Y-%m-%d'),
-                        end_date=st.session_state['end_date'].strftime('%Y-%m-%d'),
-                        cod_colaborador=st.session_state['cod_colaborador'],
-                        selected_channels=st.session_state['selected_channels'],
-                        selected_ufs=st.session_state['selected_ufs'],
-                        selected_colaboradores=st.session_state['selected_colaboradores']
-                )
+                    load_dashboard_data()
 
                 except Exception as e:
                     st.error(f"Erro ao carregar dados: {str(e)}")
@@ -358,19 +336,20 @@ def main():
         brand_data = st.session_state['brand_data']
         client_status_data = st.session_state['client_status_data']
 
-        create_dashboard(
-            df, 
-            brand_data, 
-            client_status_data,
-            st.session_state['cod_colaborador'], 
-            st.session_state['start_date'], 
-            st.session_state['end_date'], 
-            st.session_state['selected_channels'], 
-            st.session_state['selected_ufs'], 
-            st.session_state['selected_brands'], 
-            st.session_state['selected_colaboradores'], 
-            show_additional_info
-        )
+        with span('renderizar'):
+            create_dashboard(
+                df, 
+                brand_data, 
+                client_status_data,
+                st.session_state['cod_colaborador'], 
+                st.session_state['start_date'], 
+                st.session_state['end_date'], 
+                st.session_state['selected_channels'], 
+                st.session_state['selected_ufs'], 
+                st.session_state['selected_brands'], 
+                st.session_state['selected_colaboradores'], 
+                show_additional_info
+            )
 
     except Exception as e:
         st.error(f"Ocorreu um erro ao carregar o dashboard: {str(e)}")
@@ -379,4 +358,7 @@ def main():
         st.write("Por favor, verifique se todos os dados necessários foram carregados corretamente na página inicial.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # Um trace por execução do script (sujeito a TRACE_SAMPLE_RATE); com ?perfil=1 ou
+    # PROFILER=1, a execução também é perfilada (ver perfilador.py)
+    with page_run('performance_vendedor'):
+        main()
\ No newline at end of file
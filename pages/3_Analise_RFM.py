@@ -1,15 +1,28 @@
 import streamlit as st
 import pandas as pd
 from datetime import date
-from utils import get_rfm_summary, get_rfm_segment_clients, create_rfm_heatmap
+from utils import get_rfm_summary, get_rfm_segment_page, create_rfm_heatmap, FilterSet
+from formatacao import show_table
+from rastreio import span
+from perfilador import page_run
+
+# A análise RFM não depende do período: quem chama passa rfm_filters(...), sem as datas,
+# para que elas fiquem fora da chave do st.cache_data
+def rfm_filters(filters):
+    return filters.only('cod_colaborador', 'channels', 'ufs')
 
 @st.cache_data
-def get_rfm_summary_cached(cod_colaborador, start_date, end_date, selected_channels, selected_ufs):
-    return get_rfm_summary(cod_colaborador, start_date, end_date, selected_channels, selected_ufs)
+def get_rfm_summary_cached(filters):
+    return get_rfm_summary(filters)
 
 @st.cache_data
-def get_rfm_segment_clients_cached(cod_colaborador, start_date, end_date, segmento, selected_channels, selected_ufs):
-    return get_rfm_segment_clients(cod_colaborador, start_date, end_date, segmento, selected_channels, selected_ufs)
+def get_rfm_segment_page_cached(filters, segmento, after=None):
+    return get_rfm_segment_page(filters, segmento, after)
+
+def next_cursor(page):
+    # Chave (Monetario, Cod_Cliente) do último cliente da página
+    last = page.iloc[-1]
+    return (None if pd.isna(last['Monetario']) else float(last['Monetario']), str(last['Cod_Cliente']))
 
 def main():
     st.title('Dashboard de Vendas - Análise RFM')
@@ -33,28 +46,35 @@ def main():
     st.session_state['end_date'] = end_date
     st.session_state['selected_channels'] = selected_channels
     st.session_state['selected_ufs'] = selected_ufs
+    filters = rfm_filters(FilterSet.from_session(st.session_state))
 
     with st.spinner('Carregando dados RFM...'):
-        rfm_summary = get_rfm_summary_cached(cod_colaborador, start_date, end_date, selected_channels, selected_ufs)
+        try:
+            rfm_summary = get_rfm_summary_cached(filters)
+        except Exception as e:
+            # Erro não entra no cache: o próximo rerun tenta de novo
+            st.error(f"Erro ao carregar dados RFM: {str(e)}")
+            return
     
     if not rfm_summary.empty:
         # Exibindo estatísticas dos segmentos
         st.subheader("Estatísticas dos Segmentos RFM")
-        st.dataframe(rfm_summary.style.format({
-            'Numero_Clientes': '{:,.0f}',
-            'Valor_Total': 'R$ {:,.2f}',
-            'Valor_Medio': 'R$ {:,.2f}',
-            'R_Score_Medio': '{:.2f}',
-            'F_Score_Medio': '{:.2f}',
-            'M_Score_Medio': '{:.2f}'
-        }))
+        show_table(rfm_summary, formats={
+            'Numero_Clientes': 'inteiro',
+            'Valor_Total': 'moeda',
+            'Valor_Medio': 'moeda',
+            'R_Score_Medio': 'decimal',
+            'F_Score_Medio': 'decimal',
+            'M_Score_Medio': 'decimal'
+        })
 
         # Criar mapa de calor
-        fig_rfm = create_rfm_heatmap(rfm_summary)
-        if fig_rfm is not None:
-            st.plotly_chart(fig_rfm, use_container_width=True)
-        else:
-            st.error("Não foi possível criar o mapa de calor RFM.")
+        with span('renderizar', componente='mapa_de_calor'):
+            fig_rfm = create_rfm_heatmap(rfm_summary)
+            if fig_rfm is not None:
+                st.plotly_chart(fig_rfm, use_container_width=True)
+            else:
+                st.error("Não foi possível criar o mapa de calor RFM.")
 
         # Lista de segmentos RFM
         segmentos_rfm = ['Todos'] + rfm_summary['Segmento'].unique().tolist()
@@ -66,24 +86,40 @@ def main():
         st.subheader("Análise de Clientes por Segmento RFM")
         
         if segmento_selecionado != 'Todos':
-            with st.spinner(f'Carregando clientes do segmento {segmento_selecionado}...'):
-                clientes_segmento = get_rfm_segment_clients_cached(cod_colaborador, start_date, end_date, segmento_selecionado, selected_channels, selected_ufs)
+            # O total vem do resumo; a lista começa pelos maiores clientes e cresce sob demanda
+            total_clientes = int(rfm_summary.loc[rfm_summary['Segmento'] == segmento_selecionado, 'Numero_Clientes'].sum())
+            chave = (filters.key(), segmento_selecionado)
+            paginas = st.session_state.get('rfm_paginas')
+            if paginas is None or paginas['chave'] != chave:
+                with st.spinner(f'Carregando clientes do segmento {segmento_selecionado}...'):
+                    paginas = {'chave': chave, 'paginas': [get_rfm_segment_page_cached(filters, segmento_selecionado)]}
+                st.session_state['rfm_paginas'] = paginas
+
+            clientes_segmento = pd.concat(paginas['paginas'], ignore_index=True)
+            if not clientes_segmento.empty:
+                st.write(f"Clientes do segmento: {segmento_selecionado}")
+                
+                # Exibindo a tabela de clientes (valores numéricos, formatados na renderização)
+                show_table(
+                    clientes_segmento[['Cod_Cliente', 'Nome_Cliente', 'Recencia', 'Frequencia', 'Monetario', 'ticket_medio_posit', 'Mes_Ultima_Compra']],
+                    formats={'Monetario': 'moeda', 'ticket_medio_posit': 'moeda'},
+                    labels={'ticket_medio_posit': 'ticket_medio'},
+                )
                 
-                if not clientes_segmento.empty:
-                    st.write(f"Clientes do segmento: {segmento_selecionado}")
-                    
-                    # Formatando as colunas numéricas
-                    clientes_segmento['Monetario'] = clientes_segmento['Monetario'].apply(lambda x: f"R$ {x:,.2f}")
-                    clientes_segmento['ticket_medio'] = clientes_segmento['ticket_medio_posit'].apply(lambda x: f"R$ {x:,.2f}")
-                    
-                    # Exibindo a tabela de clientes
-                    st.dataframe(clientes_segmento[['Cod_Cliente', 'Nome_Cliente', 'Recencia', 'Frequencia', 'Monetario', 'ticket_medio','Mes_Ultima_Compra']])
-                    
-                    st.write(f"Total de clientes no segmento: {len(clientes_segmento)}")
-                else:
-                    st.warning(f"Não há clientes no segmento {segmento_selecionado} para o período e/ou filtros selecionados.")
+                st.write(f"Exibindo {len(clientes_segmento):,} de {total_clientes:,} clientes no segmento")
+                if len(clientes_segmento) < total_clientes and st.button("Carregar mais clientes"):
+                    with st.spinner('Carregando mais clientes...'):
+                        proxima = get_rfm_segment_page_cached(filters, segmento_selecionado, next_cursor(paginas['paginas'][-1]))
+                    if not proxima.empty:
+                        paginas['paginas'].append(proxima)
+                        st.rerun()
+            else:
+                st.warning(f"Não há clientes no segmento {segmento_selecionado} para o período e/ou filtros selecionados.")
         else:
             st.info
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # Um trace por execução do script (sujeito a TRACE_SAMPLE_RATE); com ?perfil=1 ou
+    # PROFILER=1, a execução também é perfilada (ver perfilador.py)
+    with page_run('analise_rfm'):
+        main()
\ No newline at end of file
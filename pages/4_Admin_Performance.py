@@ -0,0 +1,98 @@
+import time
+import streamlit as st
+import pandas as pd
+import plotly.graph_objects as go
+from metricas import load_metrics, summarize_metrics, top_filters_by_scan, ATHENA_PRICE_PER_TB
+from admissao import admission_stats
+
+PERIODOS = {
+    "Última hora": 3600,
+    "Últimas 24 horas": 24 * 3600,
+    "Últimos 7 dias": 7 * 24 * 3600,
+    "Últimos 30 dias": 30 * 24 * 3600,
+}
+
+def show_admission():
+    # Estado atual do controle de admissão deste processo (não é histórico)
+    stats = admission_stats()
+    st.subheader("Fila do Athena (agora)")
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Em execução", f"{stats['em_andamento']} / {stats['limite']}")
+    with col2:
+        por_prioridade = ', '.join(f"{nome}: {qtd}" for nome, qtd in stats['fila_por_prioridade'].items())
+        st.metric("Na fila", stats['na_fila'], help=por_prioridade or None)
+    with col3:
+        st.metric("Espera média / p95", f"{stats['espera_media_ms']:,.0f} / {stats['espera_p95_ms']:,.0f} ms")
+    with col4:
+        st.metric("Throttling", f"{stats['throttling']:,}")
+
+def main():
+    st.set_page_config(page_title="Admin - Performance", layout="wide")
+    st.title('Admin - Performance das Consultas')
+
+    st.sidebar.title('Configurações')
+    periodo = st.sidebar.selectbox("Período", list(PERIODOS), index=1)
+    if st.sidebar.button("Atualizar"):
+        st.rerun()
+
+    show_admission()
+
+    metrics = load_metrics(since=time.time() - PERIODOS[periodo])
+    if metrics.empty:
+        st.info("Nenhuma consulta registrada no período.")
+        return
+
+    executed = metrics[metrics['status'] == 'ok']
+    total_bytes = executed['data_scanned_bytes'].fillna(0).sum()
+
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Consultas", f"{len(metrics):,}")
+    with col2:
+        st.metric("Cache hit", f"{(metrics['status'] == 'cache').mean():.1%}")
+    with col3:
+        st.metric("Dados escaneados", f"{total_bytes / 1024 ** 3:,.2f} GB")
+    with col4:
+        st.metric("Custo estimado", f"US$ {total_bytes / 1024 ** 4 * ATHENA_PRICE_PER_TB:,.2f}")
+
+    st.subheader("Por função de dashboard")
+    st.dataframe(
+        summarize_metrics(metrics),
+        hide_index=True,
+        column_config={
+            'cache_hit_%': st.column_config.NumberColumn("cache hit", format="%.1f%%"),
+            'compartilhadas_%': st.column_config.NumberColumn("compartilhadas", format="%.1f%%"),
+            'latencia_p50_ms': st.column_config.NumberColumn("latência p50 (ms)", format="%.0f"),
+            'latencia_p95_ms': st.column_config.NumberColumn("latência p95 (ms)", format="%.0f"),
+            'fila_p95_ms': st.column_config.NumberColumn("fila p95 (ms)", format="%.0f"),
+            'admissao_p95_ms': st.column_config.NumberColumn("admissão p95 (ms)", format="%.0f"),
+            'bytes_escaneados': st.column_config.NumberColumn("bytes escaneados", format="%d"),
+            'bytes_p95': st.column_config.NumberColumn("bytes p95", format="%d"),
+            'custo_estimado_usd': st.column_config.NumberColumn("custo (US$)", format="%.4f"),
+        },
+    )
+
+    if not executed.empty:
+        # Decomposição do tempo das consultas executadas: fila, planejamento, execução e leitura
+        phases = executed.groupby(executed['funcao'].fillna('(sem função)'))[['queue_ms', 'planning_ms', 'engine_ms', 'fetch_ms', 'convert_ms']].median()
+        fig = go.Figure()
+        for phase, label in [('queue_ms', 'Fila'), ('planning_ms', 'Planejamento'), ('engine_ms', 'Execução'), ('fetch_ms', 'Leitura'), ('convert_ms', 'Conversão')]:
+            fig.add_trace(go.Bar(y=phases.index, x=phases[phase].fillna(0), name=label, orientation='h'))
+        fig.update_layout(
+            title="Mediana do tempo por fase (ms)",
+            barmode='stack',
+            legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
+        )
+        st.plotly_chart(fig, use_container_width=True)
+
+    st.subheader("Filtros que mais escaneiam dados")
+    st.dataframe(top_filters_by_scan(metrics), hide_index=True)
+
+    with st.expander("Consultas recentes"):
+        recent = metrics.sort_values('ts', ascending=False).head(500).copy()
+        recent['ts'] = pd.to_datetime(recent['ts'], unit='s')
+        st.dataframe(recent, hide_index=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+import os
+import logging
+import argparse
+import threading
+from datetime import date, timedelta
+
+from backends import ATHENA_DATABASE, get_backend
+from materializacao import add_months, month_range, month_start
+
+
+# Predicados de data que o Athena consegue usar para poda de partições.
+# `date(coluna) BETWEEN ...` aplica uma função sobre a coluna e obriga a leitura de todas
+# as partições; as consultas passam a usar intervalos semiabertos sobre a coluna crua e,
+# nas tabelas particionadas por ano/mês, predicados explícitos sobre as chaves de partição.
+PARTITION_PRUNING = os.environ.get('PARTITION_PRUNING', '1') == '1'
+# A partição dos itens segue a data do pedido, que é anterior ou igual à data de
+# faturamento usada no filtro dos pedidos. O filtro de partição lê do mês de início do
+# período menos PARTITION_MARGIN_MONTHS meses até o mês final: a margem cobre o atraso
+# máximo entre emissão e faturamento observado nos dados (medido com
+# `python particoes.py --medir-atraso`). PARTITION_MARGIN_MONTHS=none desliga o limite
+# inferior (só corta meses depois do fim do período, sem depender do atraso).
+_margin = os.environ.get('PARTITION_MARGIN_MONTHS', '2').strip().lower()
+PARTITION_MARGIN_MONTHS = None if _margin in ('', 'none') else int(_margin)
+
+# Partition projection das tabelas físicas: o Athena calcula as partições a partir do
+# intervalo declarado, sem MSCK REPAIR nem ALTER TABLE ADD PARTITION a cada mês novo
+PARTITION_PROJECTIONS = {
+    'item_pedidos': {
+        'table': os.environ.get('ITEM_PEDIDOS_TABLE', 'tbl_tiny_item_pedidos'),
+        'location': os.environ.get('ITEM_PEDIDOS_LOCATION', 's3://databeautykamico/bronze/Tiny/parket/Item_Pedidos/'),
+        'template': '${year}/${month}/',
+        'columns': {
+            'year': {'type': 'integer', 'range': '2020,2099'},
+            'month': {'type': 'integer', 'range': '1,12', 'digits': '2'},
+        },
+    },
+}
+
+# Chaves de partição (ano, mês) expostas por cada tabela/view consultada pelos dashboards,
+# com o tipo declarado na partition projection da tabela física
+PARTITION_KEYS = {
+    'vw_distribuicao_item_pedidos': {
+        'columns': (
+            os.environ.get('ITEM_PEDIDOS_YEAR_COLUMN', 'year'),
+            os.environ.get('ITEM_PEDIDOS_MONTH_COLUMN', 'month'),
+        ),
+        'type': os.environ.get('ITEM_PEDIDOS_PARTITION_TYPE', PARTITION_PROJECTIONS['item_pedidos']['columns']['year']['type']),
+    },
+}
+
+_detected_keys = {}
+_detected_lock = threading.Lock()
+
+
+def date_range_filter(column, start_date, end_date):
+    # Intervalo semiaberto [início, fim + 1 dia): vale para colunas date e timestamp
+    # e não envolve a coluna em nenhuma função
+    return f"{column} >= DATE '{start_date:%Y-%m-%d}' AND {column} < DATE '{end_date + timedelta(days=1):%Y-%m-%d}'"
+
+
+def partition_months(start_date, end_date, margin_months=PARTITION_MARGIN_MONTHS):
+    return list(month_range(add_months(month_start(start_date), -(margin_months or 0)), end_date))
+
+
+def _partition_literals(key_type):
+    # Literais no tipo da chave: comparar integer com '2024' falha ou não poda
+    if key_type in ('integer', 'int', 'bigint'):
+        return str, str
+    if key_type == 'string':
+        return (lambda year: f"'{year}'"), (lambda month: f"'{month:02d}'")
+    raise ValueError(f"Tipo de chave de partição não suportado: {key_type}")
+
+
+def partition_predicate(alias, keys, start_date, end_date, margin_months=PARTITION_MARGIN_MONTHS, key_type='integer'):
+    year_column, month_column = keys
+    year_literal, month_literal = _partition_literals(key_type)
+    year, month = f"{alias}.{year_column}", f"{alias}.{month_column}"
+    if margin_months is None:
+        # Só o limite superior: (ano < 2024 OR (ano = 2024 AND mês <= 6))
+        return (
+            f"({year} < {year_literal(end_date.year)} OR "
+            f"({year} = {year_literal(end_date.year)} AND {month} <= {month_literal(end_date.month)}))"
+        )
+    # ((ano = 2024 AND mês IN (11, 12)) OR (ano = 2025 AND mês IN (1)))
+    by_year = {}
+    for mes in partition_months(start_date, end_date, margin_months):
+        by_year.setdefault(mes.year, []).append(month_literal(mes.month))
+    groups = [
+        f"({year} = {year_literal(ano)} AND {month} IN ({', '.join(months)}))"
+        for ano, months in by_year.items()
+    ]
+    return f"({' OR '.join(groups)})"
+
+
+def available_partition_keys(query, table):
+    # Só emite o predicado se a view realmente expõe as chaves de partição; a checagem
+    # (SELECT ... LIMIT 0) é feita uma vez por processo e tabela
+    if table not in _detected_keys:
+        with _detected_lock:
+            if table not in _detected_keys:
+                keys = PARTITION_KEYS[table]['columns'] if table in PARTITION_KEYS else None
+                found = None
+                if keys:
+                    try:
+                        df = query(f'SELECT * FROM "{ATHENA_DATABASE}"."{table}" LIMIT 0', domain='dimensoes', raise_errors=True)
+                    except Exception as e:
+                        # Falha na checagem não é guardada: sem poda nesta consulta, nova checagem na próxima
+                        logging.warning(f"Não foi possível verificar as chaves de partição de {table}: {str(e)}")
+                        return None
+                    if all(key in df.columns for key in keys):
+                        found = keys
+                    else:
+                        logging.info(f"{table} não expõe as chaves de partição {keys}; sem poda por partição")
+                _detected_keys[table] = found
+    return _detected_keys[table]
+
+
+def partition_filter(query, table, alias, start_date, end_date):
+    # Cláusula "AND (...)" para juntar a um ON/WHERE; vazia quando a poda está desligada,
+    # sem período ou quando a tabela não tem as chaves de partição
+    if not PARTITION_PRUNING or start_date is None or end_date is None:
+        return ""
+    keys = available_partition_keys(query, table)
+    if not keys:
+        return ""
+    return f"AND {partition_predicate(alias, keys, start_date, end_date, key_type=PARTITION_KEYS[table]['type'])}"
+
+
+def invoicing_lag_query(since):
+    # Maior diferença, em meses, entre o mês de faturamento do pedido e a partição (mês do
+    # pedido) dos seus itens, nos pedidos faturados desde `since`
+    year_column, month_column = PARTITION_KEYS['vw_distribuicao_item_pedidos']['columns']
+    return f"""
+    SELECT
+        MAX((year(pedidos.dt_faturamento) * 12 + month(pedidos.dt_faturamento))
+            - (CAST(item_pedidos.{year_column} AS integer) * 12 + CAST(item_pedidos.{month_column} AS integer))) AS atraso_meses
+    FROM
+        "{ATHENA_DATABASE}"."vw_distribuicao_pedidos" pedidos
+    JOIN "{ATHENA_DATABASE}"."vw_distribuicao_item_pedidos" AS item_pedidos
+        ON pedidos."cod_pedido" = item_pedidos."cod_pedido"
+    WHERE
+        pedidos.dt_faturamento >= DATE '{since:%Y-%m-%d}'
+    """
+
+
+def partition_projection_ddl(name):
+    spec = PARTITION_PROJECTIONS[name]
+    properties = {'projection.enabled': 'true'}
+    for column, options in spec['columns'].items():
+        for option, value in options.items():
+            properties[f'projection.{column}.{option}'] = value
+    properties['storage.location.template'] = spec['location'].rstrip('/') + '/' + spec['template']
+    assignments = ',\n        '.join(f"'{key}' = '{value}'" for key, value in properties.items())
+    return f"""
+    ALTER TABLE "{ATHENA_DATABASE}".{spec['table']} SET TBLPROPERTIES (
+        {assignments}
+    )
+    """
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Configura partition projection nas tabelas particionadas por ano/mês.")
+    parser.add_argument('tabela', nargs='?', default='todas', choices=sorted(PARTITION_PROJECTIONS) + ['todas'])
+    parser.add_argument('--aplicar', action='store_true', help="Executa o DDL no Athena. Padrão: apenas imprime.")
+    parser.add_argument('--medir-atraso', type=int, metavar='MESES',
+                        help="Mede o atraso máximo de faturamento nos últimos MESES meses (base para PARTITION_MARGIN_MONTHS).")
+    args = parser.parse_args()
+
+    if args.medir_atraso:
+        since = add_months(month_start(date.today()), -args.medir_atraso)
+        df = get_backend().execute(invoicing_lag_query(since))
+        atraso = df['atraso_meses'].iloc[0] if not df.empty else None
+        print(f"Atraso máximo desde {since:%Y-%m}: {atraso} mês(es); PARTITION_MARGIN_MONTHS atual: {PARTITION_MARGIN_MONTHS}")
+        return
+
+    names = sorted(PARTITION_PROJECTIONS) if args.tabela == 'todas' else [args.tabela]
+    for name in names:
+        ddl = partition_projection_ddl(name)
+        if args.aplicar:
+            logging.info(f"Aplicando partition projection em {PARTITION_PROJECTIONS[name]['table']}")
+            get_backend().execute(ddl)
+        else:
+            print(ddl)
+
+
+if __name__ == "__main__":
+    main()
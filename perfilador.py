@@ -0,0 +1,179 @@
+import os
+import sys
+import json
+import time
+import threading
+from datetime import datetime
+from contextlib import contextmanager
+
+import pandas as pd
+import streamlit as st
+
+from rastreio import span, span_path, thread_span
+
+
+# Perfilador por execução do script, opcional: com PROFILER=1 (todas as execuções) ou
+# ?perfil=1 na URL (só as da sessão), uma thread amostra a pilha Python de todas as
+# threads que trabalham para o trace da página (a do script e as de run_concurrently)
+# a cada PROFILER_INTERVAL segundos. Os spans ativos (pagina > renderizar > query > ...)
+# entram na base da pilha como seções da página. O resultado é baixado pela barra
+# lateral no formato do speedscope (https://www.speedscope.app), sem acesso ao container.
+PROFILER_ENABLED = os.environ.get('PROFILER', '0') == '1'
+PROFILER_QUERY_PARAM = 'perfil'
+PROFILER_INTERVAL = float(os.environ.get('PROFILER_INTERVAL', '0.005'))
+# Funções do próprio projeto (utils, páginas, ...) no resumo da barra lateral
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SPEEDSCOPE_SCHEMA = 'https://www.speedscope.app/file-format-schema.json'
+
+
+class SamplingProfiler:
+    def __init__(self, trace, interval=PROFILER_INTERVAL):
+        self.trace = trace
+        self.interval = interval
+        self.frames = []
+        self._frame_index = {}
+        self.samples = {}  # nome da thread -> ([pilhas], [pesos em ms])
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='perfilador', daemon=True)
+        self.started = self.ended = None
+
+    def _frame(self, key):
+        index = self._frame_index.get(key)
+        if index is None:
+            name, file, line = key
+            index = self._frame_index[key] = len(self.frames)
+            self.frames.append({'name': name, 'file': file, 'line': line} if file else {'name': name})
+        return index
+
+    def _stack(self, frame, current_span):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(self._frame((code.co_name, code.co_filename, code.co_firstlineno)))
+            frame = frame.f_back
+        sections = [self._frame((f'[{name}]', None, None)) for name in span_path(current_span)]
+        return sections + stack[::-1]
+
+    def _sample(self, weight_ms):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            current_span = thread_span(ident)
+            if current_span is None or current_span.trace is not self.trace:
+                continue
+            stacks, weights = self.samples.setdefault(names.get(ident, str(ident)), ([], []))
+            stacks.append(self._stack(frame, current_span))
+            weights.append(weight_ms)
+
+    def _run(self):
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            self._sample((now - last) * 1000)
+            last = now
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.ended = time.perf_counter()
+
+    def duration_ms(self):
+        return ((self.ended or time.perf_counter()) - self.started) * 1000
+
+    def speedscope(self, name):
+        profiles = []
+        for thread, (stacks, weights) in sorted(self.samples.items()):
+            profiles.append({
+                'type': 'sampled',
+                'name': thread,
+                'unit': 'milliseconds',
+                'startValue': 0,
+                'endValue': sum(weights),
+                'samples': stacks,
+                'weights': weights,
+            })
+        return {
+            '$schema': SPEEDSCOPE_SCHEMA,
+            'name': name,
+            'exporter': 'perfilador.py',
+            'shared': {'frames': self.frames},
+            'profiles': profiles,
+        }
+
+    def summary(self, limit=20):
+        # Tempo inclusivo e próprio (ms) por função do projeto e por seção da página
+        inclusive, own = {}, {}
+        for stacks, weights in self.samples.values():
+            for stack, weight in zip(stacks, weights):
+                for index in set(stack):
+                    inclusive[index] = inclusive.get(index, 0) + weight
+                own[stack[-1]] = own.get(stack[-1], 0) + weight
+        rows = []
+        for index, total in inclusive.items():
+            frame = self.frames[index]
+            file = frame.get('file')
+            if file is not None and not file.startswith(PROJECT_DIR):
+                continue
+            rows.append({
+                'funcao': frame['name'],
+                'arquivo': os.path.relpath(file, PROJECT_DIR) if file else '',
+                'total_ms': total,
+                'proprio_ms': own.get(index, 0),
+            })
+        if not rows:
+            return pd.DataFrame(columns=['funcao', 'arquivo', 'total_ms', 'proprio_ms'])
+        return pd.DataFrame(rows).sort_values('total_ms', ascending=False).head(limit)
+
+
+def profiling_requested():
+    if PROFILER_ENABLED:
+        return True
+    try:
+        return st.query_params.get(PROFILER_QUERY_PARAM) == '1'
+    except Exception:
+        return False
+
+
+def show_profile(profiler, page):
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    with st.sidebar.expander("Perfil desta execução", expanded=False):
+        samples = sum(len(stacks) for stacks, _ in profiler.samples.values())
+        # Tempos somados entre as threads: o total pode passar da duração da execução
+        st.caption(f"{profiler.duration_ms():,.0f} ms, {samples:,} amostras a cada {PROFILER_INTERVAL * 1000:.0f} ms (tempos somados entre threads)")
+        st.dataframe(
+            profiler.summary(),
+            hide_index=True,
+            column_config={
+                'total_ms': st.column_config.NumberColumn("total (ms)", format="%.0f"),
+                'proprio_ms': st.column_config.NumberColumn("próprio (ms)", format="%.0f"),
+            },
+        )
+        st.download_button(
+            "Baixar perfil (speedscope)",
+            data=json.dumps(profiler.speedscope(f'{page} {stamp}')),
+            file_name=f'perfil_{page}_{stamp}.speedscope.json',
+            mime='application/json',
+        )
+
+
+@contextmanager
+def page_run(page):
+    # Um trace por execução do script; com o perfilador ligado, o trace é sempre amostrado
+    # e a execução inteira é perfilada
+    profiling = profiling_requested()
+    with span('pagina', sampled=True if profiling else None, pagina=page) as current:
+        if not profiling or current is None:
+            yield
+            return
+        profiler = SamplingProfiler(current.trace).start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+    # Só quando o script terminou normalmente (um rerun interrompe antes)
+    show_profile(profiler, page)
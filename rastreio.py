@@ -0,0 +1,161 @@
+import os
+import json
+import time
+import random
+import logging
+import threading
+import contextvars
+from itertools import count
+from contextlib import contextmanager
+
+
+# Rastreamento por fases (montar SQL, fila, submissão, espera, leitura, conversão,
+# renderização) em spans com duração. A decisão de amostragem é tomada na raiz do trace
+# e herdada pelos spans filhos (inclusive em threads que copiem o contexto): fora da
+# amostra, cada span custa uma leitura de ContextVar. Atributos podem ser funções, só
+# avaliadas na exportação. Cada trace amostrado vira linhas JSONL em TRACE_FILE.
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '0.05'))
+TRACE_FILE = os.environ.get('TRACE_FILE', os.path.join('.cache', 'traces.jsonl'))
+# Acima desse tamanho o arquivo é renomeado para <TRACE_FILE>.1 (uma geração guardada)
+TRACE_MAX_BYTES = int(os.environ.get('TRACE_MAX_BYTES', str(50 * 1024 ** 2)))
+
+_current = contextvars.ContextVar('rastreio_span', default=None)
+_NOT_SAMPLED = object()
+_ids = count(1)
+_write_lock = threading.Lock()
+# Span ativo de cada thread nos traces amostrados (lido pelo perfilador, de outra thread)
+_thread_spans = {}
+
+
+class _Trace:
+    __slots__ = ('id', 'spans')
+
+    def __init__(self):
+        self.id = f'{random.getrandbits(64):016x}'
+        self.spans = []
+
+
+class Span:
+    __slots__ = ('trace', 'id', 'parent', 'name', 'attrs', 'ts', 'started', 'ended', 'last_child_end', 'thread')
+
+    def __init__(self, trace, parent, name, attrs, started=None):
+        self.trace = trace
+        self.id = next(_ids)
+        self.parent = parent
+        self.name = name
+        self.attrs = attrs
+        self.started = time.perf_counter() if started is None else started
+        self.ts = time.time() - (time.perf_counter() - self.started)
+        self.ended = None
+        self.last_child_end = None
+        self.thread = threading.current_thread().name
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def finish(self, ended=None):
+        self.ended = time.perf_counter() if ended is None else ended
+        if self.parent is not None:
+            self.parent.last_child_end = self.ended
+        self.trace.spans.append(self)
+
+    def as_dict(self):
+        record = {
+            'trace_id': self.trace.id,
+            'span_id': self.id,
+            'parent_id': self.parent.id if self.parent is not None else None,
+            'nome': self.name,
+            'ts': round(self.ts, 6),
+            'duracao_ms': round((self.ended - self.started) * 1000, 3),
+            'thread': self.thread,
+        }
+        for key, value in self.attrs.items():
+            record[key] = value() if callable(value) else value
+        return record
+
+
+def current_span():
+    span = _current.get()
+    return None if span is _NOT_SAMPLED else span
+
+
+def thread_span(ident):
+    return _thread_spans.get(ident)
+
+
+def span_path(current):
+    # Nomes dos spans da raiz até current
+    names = []
+    while current is not None:
+        names.append(current.name)
+        current = current.parent
+    return names[::-1]
+
+
+@contextmanager
+def span(name, sampled=None, **attrs):
+    # Sem span ativo, abre um novo trace (sujeito à amostragem, ou forçado com sampled=True).
+    # Devolve None fora da amostra.
+    parent = _current.get()
+    if parent is None and sampled is None:
+        sampled = random.random() < TRACE_SAMPLE_RATE
+    if parent is _NOT_SAMPLED or (parent is None and not sampled):
+        token = _current.set(_NOT_SAMPLED)
+        try:
+            yield None
+        finally:
+            _current.reset(token)
+        return
+
+    current = Span(parent.trace if parent is not None else _Trace(), parent, name, attrs)
+    token = _current.set(current)
+    ident = threading.get_ident()
+    previous = _thread_spans.get(ident)
+    _thread_spans[ident] = current
+    try:
+        yield current
+    except BaseException as e:
+        current.attrs['erro'] = type(e).__name__
+        raise
+    finally:
+        _current.reset(token)
+        if previous is None:
+            _thread_spans.pop(ident, None)
+        else:
+            _thread_spans[ident] = previous
+        current.finish()
+        if parent is None:
+            _export(current.trace)
+
+
+def step(name, **attrs):
+    # Fase já concluída sem bloco próprio: do fim do último span filho (ou do início do
+    # span atual) até agora. Ex.: o tempo de montar o SQL antes de chamar query_athena.
+    parent = current_span()
+    if parent is None:
+        return
+    started = parent.last_child_end or parent.started
+    Span(parent.trace, parent, name, attrs, started=started).finish()
+
+
+def _export(trace, path=None):
+    path = path or TRACE_FILE
+    try:
+        lines = ''.join(json.dumps(s.as_dict(), ensure_ascii=False, default=str) + '\n' for s in trace.spans)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with _write_lock:
+            if os.path.exists(path) and os.path.getsize(path) > TRACE_MAX_BYTES:
+                os.replace(path, path + '.1')
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(lines)
+    except Exception as e:
+        # Rastreamento nunca deve derrubar a página
+        logging.warning("Não foi possível gravar o trace: %s", e)
+
+
+def load_traces(path=None):
+    path = path or TRACE_FILE
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
@@ -0,0 +1,182 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+from filtros import sql_equals, sql_in
+
+
+# Regras de pontuação RFM. Os limites seguem os CASE das queries originais:
+# - Recência (meses): 0-1 -> 5, 2 -> 4, 3 -> 3, 4-6 -> 2, demais -> 1
+# - Frequência (positivações): >= 10 -> 5, 7-9 -> 4, 3-6 -> 3, 2 -> 2, demais -> 1
+# - Monetário: quintis (NTILE(5) sobre Monetario decrescente)
+# Cada segmento é a primeira regra que casa, na ordem da lista; o resto vira 'Outros'.
+DEFAULT_RFM_CONFIG = {
+    'recency_edges': (0, 2, 3, 4, 7),
+    'recency_scores': (1, 5, 4, 3, 2, 1),
+    'frequency_edges': (2, 3, 7, 10),
+    'frequency_scores': (1, 2, 3, 4, 5),
+    'monetary_tiles': 5,
+    'segments': (
+        ('Campeões', {'r_min': 5, 'f_min': 5}),
+        ('Clientes fiéis', {'r_min': 4, 'f_min': 4}),
+        ('Novos clientes', {'r_min': 5, 'f_max': 2}),
+        ('Em risco', {'r_max': 2, 'f_max': 3}),
+        ('Perdidos', {'r_max': 1, 'f_max': 1}),
+        ('Atenção', {'r_min': 3, 'r_max': 3, 'f_max': 1}),
+    ),
+    'default_segment': 'Outros',
+}
+
+SUMMARY_COLUMNS = ['Segmento', 'Canal_Venda', 'Regiao', 'Numero_Clientes', 'Valor_Total', 'Valor_Medio', 'R_Score_Medio', 'F_Score_Medio', 'M_Score_Medio']
+# Tamanho da primeira página (e das seguintes) da lista de clientes por segmento
+RFM_PAGE_SIZE = 100
+CLIENT_COLUMNS = ['Cod_Cliente', 'Nome_Cliente', 'uf_empresa', 'Canal_Venda', 'Recencia', 'Frequencia', 'Monetario', 'ticket_medio_posit', 'R_Score', 'F_Score', 'M_Score', 'Mes_Ultima_Compra', 'Life_Time', 'Segmento']
+
+
+def build_rfm_base_query(filters):
+    # A base RFM não depende do período: só colaborador, canais e UFs filtram
+    colaborador_filter = sql_equals('b.cod_colaborador_atual', filters.cod_colaborador)
+    channel_filter = sql_in('a.Canal_Venda', filters.channels)
+    uf_filter = sql_in('a.uf_empresa', filters.ufs)
+
+    return f"""
+    SELECT
+        a.Cod_Cliente,
+        a.Nome_Cliente,
+        a.uf_empresa,
+        a.Canal_Venda,
+        a.Recencia,
+        a.Positivacao AS Frequencia,
+        a.Monetario,
+        a.ticket_medio_posit,
+        b.cod_colaborador_atual,
+        a.Maior_Mes as Mes_Ultima_Compra,
+        a.Ciclo_Vida as Life_Time
+    FROM
+        databeautykami.vw_analise_perfil_cliente a
+    LEFT JOIN
+        databeautykami.vw_distribuicao_cliente_vendedor b ON a.Cod_Cliente = b.cod_cliente
+    WHERE 1 = 1
+    {colaborador_filter}
+    {channel_filter}
+    {uf_filter}
+    """
+
+
+def score_bins(values, edges, scores):
+    # np.digitize devolve o índice do intervalo; nulos caem na menor pontuação (ELSE do CASE)
+    values = np.asarray(values, dtype=np.float64)
+    result = np.asarray(scores, dtype=np.int8)[np.digitize(values, edges)]
+    result[np.isnan(values)] = min(scores)
+    return result
+
+
+def ntile(values, tiles):
+    # Equivalente vetorizado de NTILE(tiles) OVER (ORDER BY values DESC): os primeiros
+    # n % tiles grupos recebem uma linha a mais, nulos vão para o fim
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    result = np.empty(n, dtype=np.int8)
+    if n == 0:
+        return result
+    order = np.argsort(np.where(np.isnan(values), np.inf, -values), kind='stable')
+    size, remainder = divmod(n, tiles)
+    position = np.arange(n)
+    big = remainder * (size + 1)
+    tile = np.where(
+        position < big,
+        position // (size + 1),
+        remainder + (position - big) // max(size, 1),
+    )
+    result[order] = tile + 1
+    return result
+
+
+def segment_scores(r_score, f_score, config):
+    conditions = []
+    names = []
+    for name, rule in config['segments']:
+        condition = np.ones(len(r_score), dtype=bool)
+        if 'r_min' in rule:
+            condition &= r_score >= rule['r_min']
+        if 'r_max' in rule:
+            condition &= r_score <= rule['r_max']
+        if 'f_min' in rule:
+            condition &= f_score >= rule['f_min']
+        if 'f_max' in rule:
+            condition &= f_score <= rule['f_max']
+        conditions.append(condition)
+        names.append(name)
+    return np.select(conditions, names, default=config['default_segment'])
+
+
+class RFMEngine:
+    def __init__(self, base, config=None):
+        self.config = config or DEFAULT_RFM_CONFIG
+        clients = base.copy()
+        clients['R_Score'] = score_bins(clients['Recencia'], self.config['recency_edges'], self.config['recency_scores'])
+        clients['F_Score'] = score_bins(clients['Frequencia'], self.config['frequency_edges'], self.config['frequency_scores'])
+        clients['M_Score'] = ntile(clients['Monetario'], self.config['monetary_tiles'])
+        clients['Segmento'] = pd.Categorical(segment_scores(clients['R_Score'].to_numpy(), clients['F_Score'].to_numpy(), self.config))
+        # Ordem final da lista de clientes, igual ao ORDER BY da query original
+        self.clients = clients.sort_values(['Monetario', 'Canal_Venda'], ascending=[False, True], kind='stable').reset_index(drop=True)
+        self._summary = None
+        self._segment_orders = {}
+
+    def summary(self):
+        if self._summary is None:
+            grouped = self.clients.groupby(['Segmento', 'Canal_Venda', 'uf_empresa'], dropna=False, sort=False, observed=True).agg(
+                Numero_Clientes=('Cod_Cliente', 'size'),
+                Valor_Total=('Monetario', 'sum'),
+                Valor_Medio=('Monetario', 'mean'),
+                R_Score_Medio=('R_Score', 'mean'),
+                F_Score_Medio=('F_Score', 'mean'),
+                M_Score_Medio=('M_Score', 'mean'),
+            ).reset_index().rename(columns={'uf_empresa': 'Regiao'})
+            self._summary = grouped.sort_values(['Valor_Total', 'Canal_Venda'], ascending=[False, True]).reset_index(drop=True)[SUMMARY_COLUMNS]
+        return self._summary.copy()
+
+    def segment_clients(self, segment):
+        clients = self.clients[self.clients['Segmento'] == segment]
+        return clients[CLIENT_COLUMNS].reset_index(drop=True)
+
+    def _segment_order(self, segment):
+        # Posições dos clientes do segmento em ordem (Monetario DESC, Cod_Cliente ASC), com
+        # as chaves já prontas para busca binária; calculado uma vez por segmento
+        if segment not in self._segment_orders:
+            clients = self.clients[self.clients['Segmento'] == segment]
+            monetario = clients['Monetario'].to_numpy(dtype=np.float64, na_value=np.nan)
+            keys = pd.DataFrame({
+                # Monetário negado para ordenar de forma crescente; nulos no fim
+                'chave': np.where(np.isnan(monetario), np.inf, -monetario),
+                'cod': clients['Cod_Cliente'].astype(str).to_numpy(),
+                'posicao': clients.index.to_numpy(),
+            }).sort_values(['chave', 'cod'], kind='stable')
+            self._segment_orders[segment] = (keys['chave'].to_numpy(), keys['cod'].to_numpy(), keys['posicao'].to_numpy())
+        return self._segment_orders[segment]
+
+    def segment_page(self, segment, after=None, limit=RFM_PAGE_SIZE):
+        # Paginação por chave (keyset): after = (Monetario, Cod_Cliente) do último cliente da
+        # página anterior; None devolve o topo. Não depende de offset nem de reordenar tudo.
+        chave, cod, posicao = self._segment_order(segment)
+        start = 0
+        if after is not None:
+            monetario, cod_cliente = after
+            after_key = np.inf if monetario is None or np.isnan(monetario) else -float(monetario)
+            left = np.searchsorted(chave, after_key, side='left')
+            right = np.searchsorted(chave, after_key, side='right')
+            start = left + np.searchsorted(cod[left:right], str(cod_cliente), side='right')
+        rows = posicao[start:start + limit]
+        return self.clients.loc[rows, CLIENT_COLUMNS].reset_index(drop=True)
+
+
+def load_rfm_engine(query, filters, config=None):
+    # query: função que executa SQL e devolve um DataFrame (utils.query_athena). Falhas
+    # propagam: o motor fica em cache por filtros e não pode nascer vazio por um erro do Athena
+    base = query(build_rfm_base_query(filters), fetch='arrow', domain='rfm', raise_errors=True)
+    if base.empty:
+        # Query bem-sucedida, mas sem clientes para os filtros
+        logging.warning("Base de clientes RFM vazia para os filtros selecionados")
+        base = pd.DataFrame(columns=[c for c in CLIENT_COLUMNS if not c.endswith('_Score') and c != 'Segmento'] + ['cod_colaborador_atual'])
+    return RFMEngine(base, config)
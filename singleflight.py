@@ -0,0 +1,91 @@
+import os
+import logging
+import threading
+from concurrent.futures import Future
+
+from admissao import PriorityTicket, current_priority, priority_ticket
+from backends import QueryCancelled, current_query_scope
+
+
+# Deduplicação de queries idênticas em andamento no processo (single-flight): a primeira
+# chamada executa e as que chegam enquanto ela roda esperam o mesmo Future e recebem o
+# mesmo resultado. Com várias sessões abrindo o dashboard com os mesmos filtros, cada
+# combinação distinta de filtros vira uma única query no Athena. A execução roda com a
+# maior prioridade entre quem espera por ela (ver admissao.PriorityTicket).
+SINGLE_FLIGHT_ENABLED = os.environ.get('SINGLE_FLIGHT', '1') == '1'
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}  # chave -> (Future, PriorityTicket) da execução em andamento
+        self.stats = {'executadas': 0, 'compartilhadas': 0}
+
+    def _wait(self, future):
+        # Espera como seguidor sem perder o contrato de cancelamento: se o escopo de quem
+        # espera for cancelado (rerun), a espera termina com QueryCancelled
+        done = threading.Event()
+        future.add_done_callback(lambda _: done.set())
+        scope = current_query_scope()
+        token = scope.register(done.set) if scope is not None else None
+        try:
+            done.wait()
+        finally:
+            if token is not None:
+                scope.unregister(token)
+        if not future.done():
+            raise QueryCancelled("Espera por query compartilhada cancelada")
+        return future.result()
+
+    def do(self, key, fn):
+        # Devolve (resultado, compartilhado). Exceções do líder chegam a todos os seguidores,
+        # exceto o cancelamento: se o escopo do líder foi cancelado, quem ainda quer o
+        # resultado tenta de novo (e um deles passa a ser o líder).
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = (Future(), PriorityTicket(current_priority()))
+                    self.stats['executadas'] += 1
+                else:
+                    self.stats['compartilhadas'] += 1
+            future, ticket = call
+            if not leader:
+                ticket.promote(current_priority())
+                try:
+                    return self._wait(future), True
+                except QueryCancelled:
+                    if not future.done() or not isinstance(future.exception(), QueryCancelled):
+                        raise
+                    logging.info("Query compartilhada cancelada pelo líder; executando novamente")
+                    continue
+            try:
+                with priority_ticket(ticket):
+                    result = fn()
+            except BaseException as e:
+                future.set_exception(e)
+                raise
+            else:
+                future.set_result(result)
+                return result, False
+            finally:
+                with self._lock:
+                    self._calls.pop(key, None)
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+
+_single_flight = SingleFlight()
+
+
+def single_flight(key, fn):
+    if not SINGLE_FLIGHT_ENABLED:
+        return fn(), False
+    return _single_flight.do(key, fn)
+
+
+def single_flight_stats():
+    return dict(_single_flight.stats, em_andamento=_single_flight.in_flight())
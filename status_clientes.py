@@ -0,0 +1,275 @@
+import os
+import time
+import uuid
+import shutil
+import hashlib
+import logging
+from datetime import date
+
+import pandas as pd
+
+from filtros import sql_equals, sql_in
+from materializacao import add_months, month_range, month_start
+
+
+# Snapshots mensais de status por cliente (novas aberturas, churn, recuperação,
+# reativação, positivação e base). Cada mês fechado é calculado uma única vez e
+# persistido em Parquet; só o mês corrente (aberto) é recalculado a cada refresh.
+# Um snapshot calculado com o mês ainda aberto é gravado como '.aberto' e recalculado
+# depois que o mês fecha; só o calculado após o fechamento vira '.fechado'.
+STATUS_SNAPSHOT_DIR = os.environ.get('STATUS_SNAPSHOT_DIR', os.path.join('.cache', 'status_clientes'))
+# Idade máxima (segundos) do snapshot do mês aberto antes de ser recalculado
+STATUS_OPEN_MONTH_TTL = int(os.environ.get('STATUS_OPEN_MONTH_TTL', '3600'))
+# Limite do diretório de snapshots: acima dele, os conjuntos de filtros usados há mais
+# tempo são removidos inteiros
+STATUS_SNAPSHOT_MAX_BYTES = int(os.environ.get('STATUS_SNAPSHOT_MAX_BYTES', str(1024 ** 3)))
+
+STATUS_FLAGS = {
+    'nova_abertura': 'novas_aberturas',
+    'churn': 'churn',
+    'recuperado': 'Recuperado',
+    'reativado': 'Reativado',
+    'positivado': 'Positivado',
+    'base': 'Base',
+}
+
+
+def filters_key(filters):
+    # Mesmo conjunto lógico de filtros -> mesmo diretório; as datas ficam de fora porque
+    # cada mês é um arquivo próprio
+    parts = [
+        filters.cod_colaborador,
+        ','.join(filters.channels),
+        ','.join(filters.ufs),
+        # Como na query original, o nome só filtra quando não há código de colaborador
+        '' if filters.cod_colaborador else ','.join(filters.nomes_colaborador),
+    ]
+    return hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()[:16]
+
+
+def build_status_query(meses, filters):
+    # Status de todos os meses pedidos em uma única query (uma leitura dos pedidos); cada
+    # mês enxerga só o histórico até o seu fim
+    if filters.cod_colaborador:
+        colaborador_filter = sql_equals('empresa_pedido.cod_colaborador_atual', filters.cod_colaborador)
+    else:
+        colaborador_filter = sql_in('empresa_pedido.nome_colaborador_atual', filters.nomes_colaborador)
+    channel_filter = sql_in('pedidos.canal_venda', filters.channels)
+    uf_filter = sql_in('empresa_pedido.uf_empresa_faturamento', filters.ufs)
+
+    meses = sorted(meses)
+    meses_values = ', '.join(f"(DATE '{mes:%Y-%m-%d}')" for mes in meses)
+    fim = add_months(meses[-1], 1)
+
+    # Só o histórico até o fim do mês entra no cálculo: o resultado de um mês fechado
+    # não muda mais, o que permite persistir o snapshot
+    return f"""
+    WITH Meses (mes) AS (
+        VALUES {meses_values}
+    ),
+    Pedidos AS (
+        SELECT
+            pedidos.cpfcnpj AS cod_cliente,
+            pedidos.dt_faturamento
+        FROM
+            databeautykami.vw_distribuicao_pedidos pedidos
+        LEFT JOIN
+            databeautykami.vw_distribuicao_empresa_pedido empresa_pedido ON empresa_pedido.cod_pedido = pedidos.cod_pedido
+        WHERE pedidos.desc_abrev_cfop IN (
+                'VENDA', 'VENDA DE MERC.SUJEITA ST', 'VENDA DE MERCADORIA P/ NÃO CONTRIBUINTE',
+                'VENDA DO CONSIGNADO', 'VENDA MERC. REC. TERCEIROS DESTINADA A ZONA FRANCA DE MANAUS',
+                'VENDA MERC.ADQ. BRASIL FORA ESTADO', 'VENDA MERCADORIA DENTRO DO ESTADO',
+                'VENDA MERCADORIA FORA ESTADO', 'Venda de mercadoria sujeita ao regime de substituição tributária',
+                'VENDA MERC. SUJEITA AO REGIME DE ST'
+            )
+            AND pedidos.operacoes_internas = 'N'
+            AND pedidos.origem IN ('egestor','uno')
+            AND pedidos.dt_faturamento < DATE '{fim:%Y-%m-%d}'
+            {channel_filter}
+            {uf_filter}
+            {colaborador_filter}
+    ),
+    Compras AS (
+        SELECT
+            cod_cliente,
+            dt_faturamento,
+            LAG(dt_faturamento) OVER (PARTITION BY cod_cliente ORDER BY dt_faturamento) AS penultima_data_compra
+        FROM
+            Pedidos
+    ),
+    Datas AS (
+        SELECT DISTINCT
+            cod_cliente,
+            dt_faturamento
+        FROM
+            Pedidos
+    ),
+    Clientes AS (
+        SELECT
+            m.mes,
+            d.cod_cliente,
+            MIN(d.dt_faturamento) AS primeira_compra,
+            MAX(CASE WHEN d.dt_faturamento < m.mes THEN d.dt_faturamento END) AS ultima_compra_antes,
+            BOOL_OR(d.dt_faturamento >= m.mes) AS comprou_no_mes,
+            BOOL_OR(d.dt_faturamento > DATE_ADD('day', -180, m.mes)
+                    AND d.dt_faturamento <= m.mes) AS base
+        FROM
+            Meses m
+        JOIN
+            Datas d ON d.dt_faturamento < DATE_ADD('month', 1, m.mes)
+        GROUP BY
+            m.mes, d.cod_cliente
+    ),
+    Retornos AS (
+        SELECT
+            m.mes,
+            c.cod_cliente,
+            BOOL_OR(c.dt_faturamento > DATE_ADD('day', 180, c.penultima_data_compra)) AS recuperado,
+            BOOL_OR(c.dt_faturamento > DATE_ADD('day', 90, c.penultima_data_compra)
+                    AND c.dt_faturamento <= DATE_ADD('day', 180, c.penultima_data_compra)) AS reativado
+        FROM
+            Meses m
+        JOIN
+            Compras c ON c.dt_faturamento >= m.mes AND c.dt_faturamento < DATE_ADD('month', 1, m.mes)
+        WHERE
+            c.penultima_data_compra IS NOT NULL
+        GROUP BY
+            m.mes, c.cod_cliente
+    ),
+    Status AS (
+        SELECT
+            c.mes,
+            c.cod_cliente,
+            DATE_TRUNC('month', c.primeira_compra) = c.mes AS nova_abertura,
+            -- churn no primeiro mês em que a última compra passa de 180 dias
+            COALESCE(c.ultima_compra_antes < DATE_ADD('day', -180, c.mes)
+                     AND c.ultima_compra_antes >= DATE_ADD('day', -180, DATE_ADD('month', -1, c.mes)), false) AS churn,
+            COALESCE(r.recuperado, false) AS recuperado,
+            COALESCE(r.reativado, false) AS reativado,
+            c.comprou_no_mes,
+            c.base
+        FROM
+            Clientes c
+        LEFT JOIN
+            Retornos r ON r.cod_cliente = c.cod_cliente AND r.mes = c.mes
+    )
+    SELECT *
+    FROM Status
+    WHERE nova_abertura OR churn OR recuperado OR reativado OR comprou_no_mes OR base
+    """
+
+
+class ClientStatusStore:
+    def __init__(self, query, snapshot_dir=STATUS_SNAPSHOT_DIR, open_month_ttl=STATUS_OPEN_MONTH_TTL, max_bytes=STATUS_SNAPSHOT_MAX_BYTES):
+        # query: função que executa SQL e devolve um DataFrame, levantando exceção em caso de erro
+        self.query = query
+        self.snapshot_dir = snapshot_dir
+        self.open_month_ttl = open_month_ttl
+        self.max_bytes = max_bytes
+
+    def _path(self, key, mes, closed):
+        return os.path.join(self.snapshot_dir, key, f'mes={mes:%Y-%m}.{"fechado" if closed else "aberto"}.parquet')
+
+    def _is_fresh(self, key, mes, today):
+        if mes < month_start(today):
+            # Mês fechado: só vale o snapshot calculado depois do fechamento
+            return os.path.exists(self._path(key, mes, closed=True))
+        path = self._path(key, mes, closed=False)
+        return os.path.exists(path) and time.time() - os.path.getmtime(path) < self.open_month_ttl
+
+    def _write(self, path, snapshot):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Nome temporário único: aquecimento, outras sessões e outros processos podem
+        # calcular o mesmo mês ao mesmo tempo; cada um publica um arquivo completo
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        try:
+            snapshot.to_parquet(tmp_path, index=False, compression='zstd')
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _compute_months(self, key, meses, filters, today):
+        logging.info(f"Calculando snapshots de status de clientes de {len(meses)} mês(es): {meses[0]:%Y-%m} a {meses[-1]:%Y-%m}")
+        df = self.query(build_status_query(meses, filters))
+        df_meses = pd.to_datetime(df['mes']).dt.date
+        for mes in meses:
+            rows = df[(df_meses == mes).to_numpy()]
+            snapshot = pd.DataFrame({
+                'cod_cliente': rows['cod_cliente'].astype(str),
+                'nova_abertura': rows['nova_abertura'].astype(bool),
+                'churn': rows['churn'].astype(bool),
+                'recuperado': rows['recuperado'].astype(bool),
+                'reativado': rows['reativado'].astype(bool),
+                'base': rows['base'].astype(bool),
+            }).reset_index(drop=True)
+            # Positivado: comprou no mês sem ser abertura, churn, recuperação ou reativação
+            snapshot['positivado'] = rows['comprou_no_mes'].astype(bool).to_numpy() & ~(
+                snapshot['nova_abertura'] | snapshot['churn'] | snapshot['recuperado'] | snapshot['reativado']
+            ).to_numpy()
+
+            closed = mes < month_start(today)
+            self._write(self._path(key, mes, closed), snapshot)
+            if closed:
+                # O snapshot parcial de quando o mês estava aberto não é mais usado
+                try:
+                    os.remove(self._path(key, mes, closed=False))
+                except OSError:
+                    pass
+
+    def _evict(self, keep):
+        # LRU por conjunto de filtros: a data de modificação do diretório é atualizada a
+        # cada leitura (load) e a cada snapshot gravado
+        entries = []
+        total = 0
+        try:
+            keys = os.listdir(self.snapshot_dir)
+        except OSError:
+            return
+        for key in keys:
+            directory = os.path.join(self.snapshot_dir, key)
+            try:
+                size = sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+                entries.append((os.path.getmtime(directory), size, key, directory))
+            except OSError:
+                continue
+            total += size
+        if total <= self.max_bytes:
+            return
+        for _, size, key, directory in sorted(entries):
+            if key == keep:
+                continue
+            shutil.rmtree(directory, ignore_errors=True)
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def refresh(self, filters, today=None):
+        today = today or date.today()
+        key = filters_key(filters)
+        end_date = min(filters.end_date, today)
+        months = list(month_range(filters.start_date, end_date))
+        stale = [mes for mes in months if not self._is_fresh(key, mes, today)]
+        if stale:
+            logging.info(f"Snapshots de status de clientes a calcular: {len(stale)} de {len(months)} meses")
+            self._compute_months(key, stale, filters, today)
+            self._evict(keep=key)
+        return key, months
+
+    def load(self, filters, today=None):
+        # filters: FilterSet com o período e os filtros da consulta
+        today = today or date.today()
+        key, months = self.refresh(filters, today)
+        try:
+            os.utime(os.path.join(self.snapshot_dir, key))  # usado recentemente (evicção por LRU)
+        except OSError:
+            pass
+        rows = []
+        for mes in months:
+            snapshot = pd.read_parquet(self._path(key, mes, closed=mes < month_start(today)))
+            for flag, status in STATUS_FLAGS.items():
+                qtd = int(snapshot[flag].sum())
+                if qtd > 0:
+                    rows.append({'mes': mes, 'status': status, 'qtd': qtd})
+        df = pd.DataFrame(rows, columns=['mes', 'status', 'qtd'])
+        return df.sort_values(['mes', 'status']).reset_index(drop=True)
@@ -0,0 +1,88 @@
+import os
+
+import pandas as pd
+
+
+# Tipos compactos para os resultados das consultas, aplicados logo após a leitura.
+# Os DataFrames ficam no st.session_state de cada sessão e nos caches do processo:
+# dimensões de baixa cardinalidade viram category (códigos inteiros + rótulos únicos),
+# textos de alta cardinalidade viram string[pyarrow] (um buffer contíguo, sem um objeto
+# Python por célula) e contagens inteiras são reduzidas ao menor inteiro que as comporta.
+COMPACT_DTYPES = os.environ.get('COMPACT_DTYPES', '1') == '1'
+
+CATEGORY = 'category'
+STRING = 'string'
+COUNT = 'contagem'
+
+# Nome da coluna (como sai das queries) -> tipo compacto
+COLUMN_TYPES = {
+    # Dimensões
+    'canal_venda': CATEGORY,
+    'Canal_Venda': CATEGORY,
+    'uf_empresa_faturamento': CATEGORY,
+    'uf_empresa': CATEGORY,
+    'Regiao': CATEGORY,
+    'marca': CATEGORY,
+    'Segmento': CATEGORY,
+    'nome_colaborador_atual': CATEGORY,
+    'nome_colaborador': CATEGORY,
+    'vendedor': CATEGORY,
+    'cod_colaborador_atual': CATEGORY,
+    'cod_colaborador': CATEGORY,
+    # Textos por cliente/pedido
+    'Cod_Cliente': STRING,
+    'Nome_Cliente': STRING,
+    'cod_cliente': STRING,
+    'cpfcnpj': STRING,
+    'cod_pedido': STRING,
+    'Mes_Ultima_Compra': STRING,
+    # Contagens
+    'positivacao': COUNT,
+    'qtd_pedido': COUNT,
+    'qtd_sku': COUNT,
+    'qtd_marcas': COUNT,
+    'clientes_unicos': COUNT,
+    'Numero_Clientes': COUNT,
+    'Recencia': COUNT,
+    'Frequencia': COUNT,
+    'Positivacao': COUNT,
+    'Life_Time': COUNT,
+    'qtd': COUNT,
+}
+
+_STRING_DTYPE = pd.StringDtype('pyarrow')
+
+
+def _compact_column(values, kind):
+    if kind == CATEGORY:
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            return values
+        return values.astype('category')
+    if kind == STRING:
+        if values.dtype == _STRING_DTYPE:
+            return values
+        # Nulos continuam nulos (astype(str) os transformaria em 'None'/'nan')
+        return values.astype(_STRING_DTYPE)
+    if kind == COUNT:
+        # Só colunas já inteiras: contagens com nulos (LEFT JOIN) continuam float
+        if pd.api.types.is_integer_dtype(values.dtype) and not isinstance(values.dtype, pd.ArrowDtype):
+            return pd.to_numeric(values, downcast='integer')
+        return values
+    raise ValueError(f"Tipo compacto desconhecido: {kind}")
+
+
+def compact_dtypes(df, column_types=None):
+    # Converte as colunas conhecidas de df (as demais ficam como estão); idempotente
+    if not COMPACT_DTYPES or df is None or df.empty:
+        return df
+    column_types = COLUMN_TYPES if column_types is None else column_types
+    changes = {}
+    for column, kind in column_types.items():
+        if column in df.columns:
+            converted = _compact_column(df[column], kind)
+            if converted.dtype != df[column].dtype:
+                changes[column] = converted
+    if not changes:
+        return df
+    return df.assign(**changes)
+
@@ -1,53 +1,217 @@
 import os
+import time
 import logging
-from pyathena import connect
+import threading
+import weakref
+import contextvars
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 import pandas as pd
 import streamlit as st
 from dotenv import load_dotenv
-from pyathena.pandas.util import as_pandas
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 from datetime import date, timedelta
 from streamlit_plotly_events import plotly_events
+from streamlit.runtime.scriptrunner import RerunException, StopException, add_script_run_ctx, get_script_run_ctx
 import numpy as np
-
-
-__all__ = ['get_monthly_revenue', 'get_brand_data', 'get_channels_and_ufs', 'get_colaboradores', 'get_client_status', 'create_client_status_chart']
-
-# Configurar logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+from backends import ATHENA_S3_STAGING_DIR, ATHENA_REGION, QUERY_BACKEND, QueryCancelled, QueryScope, get_backend, query_scope
+from materializacao import CMV_MENSAL_TABLE, cmv_mensal_covers, cmv_mensal_select, month_start
+from filtros import FilterSet, sql_equals, sql_in
+from particoes import date_range_filter, partition_filter
+from dimensoes import DIMENSION_INDEX_ENABLED, DIMENSION_START_DATE, load_dimension_index
+from cache import CACHE_ENABLED, CACHE_TTLS, cache_key, get_result_cache
+from rfm import RFM_PAGE_SIZE, load_rfm_engine
+from metricas import instrumented, record_query
+from status_clientes import STATUS_OPEN_MONTH_TTL, ClientStatusStore
+from tipos import compact_dtypes
+from singleflight import single_flight
+from rastreio import current_span, span, step
+
+
+__all__ = ['get_monthly_revenue', 'get_brand_data', 'get_channels_and_ufs', 'get_colaboradores', 'get_client_status', 'create_client_status_chart', 'run_concurrently', 'get_dimension_index', 'FilterSet']
 
 # Carregar variáveis de ambiente
 load_dotenv()
 
-# Configurações de conexão Athena
-ATHENA_S3_STAGING_DIR = os.environ.get('ATHENA_S3_STAGING_DIR', 's3://databeautykamico/Athena/')
-ATHENA_REGION = os.environ.get('ATHENA_REGION', 'us-east-1')
-
+logging.info(f"Usando QUERY_BACKEND: {QUERY_BACKEND}")
 logging.info(f"Usando ATHENA_S3_STAGING_DIR: {ATHENA_S3_STAGING_DIR}")
 logging.info(f"Usando ATHENA_REGION: {ATHENA_REGION}")
 
-def query_athena(query):
-    try:
-        logging.info("Iniciando conexão com Athena")
-        conn = connect(s3_staging_dir=ATHENA_S3_STAGING_DIR, region_name=ATHENA_REGION)
-        cursor = conn.cursor()
-        logging.info("Executando query")
-        cursor.execute(query)
-        logging.info("Convertendo resultado para DataFrame")
-        df = as_pandas(cursor)
-        logging.info(f"Query executada com sucesso. Retornando DataFrame com {len(df)} linhas.")
+# Modos de leitura do resultado:
+# - 'pandas': cursor padrão + as_pandas (linha a linha)
+# - 'arrow': ArrowCursor, resultado decodificado de forma vetorizada pelo pyarrow
+FETCH_MODES = ('pandas', 'arrow')
+
+def _execute_query(query, fetch, arrow_dtypes, stats):
+    if fetch != 'pandas':
+        table = get_backend().execute_arrow(query, stats=stats)
+        started = time.perf_counter()
+        with span('conversao', linhas=table.num_rows):
+            # arrow_dtypes=True mantém as colunas em memória Arrow (pd.ArrowDtype) sem converter para object
+            df = table.to_pandas(types_mapper=pd.ArrowDtype if arrow_dtypes else None)
+        stats['convert_ms'] = (time.perf_counter() - started) * 1000
         return df
+    return get_backend().execute(query, stats=stats)
+
+def query_athena(query, fetch='pandas', arrow_dtypes=False, domain='default', use_cache=True, raise_errors=False):
+    # domain define o TTL da entrada no cache de resultados (ver cache.CACHE_TTLS);
+    # raise_errors=True propaga a exceção em vez de exibir st.error e devolver um DataFrame vazio
+    if fetch not in FETCH_MODES:
+        raise ValueError(f"Modo de leitura inválido: {fetch}. Opções: {', '.join(FETCH_MODES)}")
+    # Tempo desde o início da função de dashboard (ou da query anterior) até aqui
+    step('montar_sql')
+    with span('query', domain=domain, fetch=fetch) as current:
+        df, status = _query_athena(query, fetch, arrow_dtypes, domain, use_cache, raise_errors)
+        if current is not None:
+            current.set(status=status, linhas=len(df))
+        return df
+
+def _query_athena(query, fetch, arrow_dtypes, domain, use_cache, raise_errors):
+    started = time.perf_counter()
+    backend = get_backend()
+    key = cache_key(query, backend.name, fetch, arrow_dtypes)
+    stats = {'backend': backend.name, 'fetch': fetch, 'domain': domain, 'query_hash': key[:16]}
+    current = current_span()
+    if current is not None:
+        current.set(backend=backend.name, query_hash=stats['query_hash'])
+    use_cache = use_cache and CACHE_ENABLED
+    if use_cache:
+        df = get_result_cache().get(key)
+        if df is not None:
+            record_query(dict(stats, status='cache', rows=len(df), wall_ms=(time.perf_counter() - started) * 1000))
+            return df, 'cache'
+
+    def execute():
+        # Tipos compactos antes de entrar no cache e no session_state das páginas
+        df = _execute_query(query, fetch, arrow_dtypes, stats)
+        with span('tipos'):
+            df = compact_dtypes(df)
+        record_query(dict(stats, status='ok', rows=len(df), wall_ms=(time.perf_counter() - started) * 1000))
+        if use_cache:
+            # Gravado antes de liberar a chave no single-flight: quem chegar depois acha no cache
+            df = get_result_cache().put(key, df, domain)
+        return df
+
+    try:
+        # Chamadas simultâneas com o mesmo SQL (outras sessões) esperam a mesma execução
+        df, shared = single_flight(key, execute)
+    except QueryCancelled:
+        # Resultado de uma execução já substituída: nada é exibido nem guardado em cache
+        logging.debug("Query cancelada: os filtros mudaram antes do fim da execução")
+        record_query(dict(stats, status='cancelled', wall_ms=(time.perf_counter() - started) * 1000))
+        raise
     except Exception as e:
         logging.error(f"Erro ao executar query no Athena: {str(e)}")
+        record_query(dict(stats, status='error', error=str(e)[:500], wall_ms=(time.perf_counter() - started) * 1000))
+        if raise_errors:
+            raise
         st.error(f"Erro ao executar query no Athena: {str(e)}")
-        return pd.DataFrame()
+        return pd.DataFrame(), 'error'
+    if shared:
+        # O resultado é do líder: cada chamador recebe sua própria cópia rasa
+        record_query(dict(stats, status='shared', rows=len(df), wall_ms=(time.perf_counter() - started) * 1000))
+        return df.copy(deep=False), 'shared'
+    return df, 'ok'
     
-def get_monthly_revenue(cod_colaborador, start_date, end_date, selected_channels, selected_ufs, selected_brands, selected_nome_colaborador):
+# Intervalo (segundos) em que run_concurrently verifica se o usuário pediu um rerun
+RERUN_CHECK_INTERVAL = float(os.environ.get('RERUN_CHECK_INTERVAL', '0.25'))
+
+# Escopo de queries da execução mais recente de cada sessão do Streamlit. Referências
+# fracas: o escopo só vive enquanto a execução que o criou ainda o usa
+_session_scopes = weakref.WeakValueDictionary()
+_session_scopes_lock = threading.Lock()
+
+def session_query_scope():
+    # Abre o escopo da execução atual e cancela o da execução anterior da mesma sessão:
+    # queries de um rerun substituído não continuam rodando (e sendo cobradas) no Athena
+    ctx = get_script_run_ctx(suppress_warning=True)
+    scope = QueryScope(ctx.session_id if ctx else None)
+    if ctx is None:
+        return scope
+    with _session_scopes_lock:
+        previous = _session_scopes.get(ctx.session_id)
+        _session_scopes[ctx.session_id] = scope
+    if previous is not None:
+        previous.cancel()
+    return scope
+
+def _check_rerun(ctx):
+    # Ponto de interrupção enquanto o script espera as queries: sem isso, um rerun pedido
+    # pelo usuário só seria atendido depois que todas terminassem. Mesmo protocolo do
+    # ScriptRunner, válido apenas na thread do script.
+    requests = getattr(ctx, 'script_requests', None) if ctx else None
+    if requests is None or threading.current_thread().name != 'ScriptRunner.scriptThread':
+        return
+    request = requests.on_scriptrunner_yield()
+    if request is None:
+        return
+    if request.type.name == 'RERUN':
+        raise RerunException(request.rerun_data)
+    raise StopException()
+
+def run_concurrently(tasks, on_done=None, max_workers=None):
+    # tasks: {nome: (funcao, args, kwargs)}. Todas são submetidas de uma vez e os
+    # resultados são coletados à medida que terminam; on_done(nome, concluidas, total)
+    # é chamado na thread do script, então pode atualizar elementos do Streamlit.
+    # Se a execução for interrompida (rerun/stop), as queries ainda em andamento são canceladas.
+    ctx = get_script_run_ctx(suppress_warning=True)
+    scope = session_query_scope()
+
+    def run(fn, args, kwargs):
+        # Propaga o contexto da sessão para que st.cache_data e st.error funcionem na thread
+        if ctx is not None:
+            add_script_run_ctx(threading.current_thread(), ctx)
+        with query_scope(scope):
+            return fn(*args, **kwargs)
+
+    results = {}
+    executor = ThreadPoolExecutor(max_workers=max_workers or len(tasks), thread_name_prefix='dashboard-load')
+    try:
+        futures = {
+            executor.submit(contextvars.copy_context().run, run, fn, args, kwargs): name
+            for name, (fn, args, kwargs) in tasks.items()
+        }
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=RERUN_CHECK_INTERVAL, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = futures[future]
+                results[name] = future.result()
+                if on_done:
+                    on_done(name, len(results), len(tasks))
+            _check_rerun(ctx)
+    except BaseException:
+        scope.cancel()
+        raise
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    return results
+
+def _cmv_source(start_date, end_date):
+    # CMV dos meses do período: a tabela materializada quando ela tem todos os meses (e os
+    # abertos estão em dia); senão, o mesmo SELECT calculado na hora, para que um mês ainda
+    # não carregado não apareça com custo zero e markup inflado
+    if cmv_mensal_covers(query_athena, start_date, end_date):
+        return f"""(
+            SELECT * FROM {CMV_MENSAL_TABLE}
+            WHERE mes_ref BETWEEN DATE '{month_start(start_date):%Y-%m-%d}' AND DATE '{end_date:%Y-%m-%d}'
+        )"""
+    logging.warning(f"{CMV_MENSAL_TABLE} não cobre {start_date:%Y-%m} a {end_date:%Y-%m}; calculando o CMV na consulta")
+    return f"({cmv_mensal_select(start_date, end_date)})"
+
+@instrumented
+def get_monthly_revenue(filters):
+    cod_colaborador = filters.cod_colaborador
+    start_date, end_date = filters.start_date, filters.end_date
+
+    # Filtros de marcas, canais de venda, UFs e nomes de colaborador
+    brand_filter = sql_in('item_pedidos.marca', filters.brands)
+    channel_filter = sql_in('pedidos.canal_venda', filters.channels)
+    uf_filter = sql_in('empresa_pedido.uf_empresa_faturamento', filters.ufs)
+    nome_filter = sql_in('empresa_pedido.nome_colaborador_atual', filters.nomes_colaborador)
+    item_partition_filter = partition_filter(query_athena, 'vw_distribuicao_item_pedidos', 'item_pedidos', start_date, end_date)
+
     # Inicialização de variáveis
-    brand_filter = ""
-    channel_filter = ""
-    uf_filter = ""
     colaborador_filter = ""
     group_by_cols = "1, fator"
     group_by_cols_acum = "1"
@@ -55,24 +219,9 @@ def get_monthly_revenue(cod_colaborador, start_date, end_date, selected_channels
     select_cols_main = ""
     select_cols_subquery_alias = ""
 
-    # Filtro de marcas
-    if selected_brands:
-        brands_str = "', '".join(selected_brands)
-        brand_filter = f"AND item_pedidos.marca IN ('{brands_str}')"
-    
-    # Filtro de canais de venda
-    if selected_channels:
-        channels_str = "', '".join(selected_channels)
-        channel_filter = f"AND pedidos.canal_venda IN ('{channels_str}')"
-    
-    # Filtro de UFs
-    if selected_ufs:
-        ufs_str = "', '".join(selected_ufs)
-        uf_filter = f"AND empresa_pedido.uf_empresa_faturamento IN ('{ufs_str}')"
-    
     # Filtro e colunas adicionais para colaborador específico
     if cod_colaborador:
-        colaborador_filter = f"AND empresa_pedido.cod_colaborador_atual = '{cod_colaborador}'"
+        colaborador_filter = sql_equals('empresa_pedido.cod_colaborador_atual', cod_colaborador)
         group_by_cols = "1, 2, 3, fator"
         group_by_cols_acum = "1, 2, 3"
         
@@ -88,12 +237,7 @@ def get_monthly_revenue(cod_colaborador, start_date, end_date, selected_channels
         f.vendedor,
         f.cod_colaborador,
         """
-    nome_filter = ""
-    if selected_nome_colaborador:
-        nome_str = "', '".join(selected_nome_colaborador)
-        nome_filter = f"AND empresa_pedido.nome_colaborador_atual IN ('{nome_str}')"
 
-    
     query = f"""
     WITH bonificacao AS (
         SELECT 
@@ -167,42 +311,17 @@ def get_monthly_revenue(cod_colaborador, start_date, end_date, selected_channels
         "databeautykami"."vw_distribuicao_pedidos" pedidos
     LEFT JOIN "databeautykami"."vw_distribuicao_item_pedidos" AS item_pedidos 
         ON pedidos."cod_pedido" = item_pedidos."cod_pedido"
+        {item_partition_filter}
     LEFT JOIN "databeautykami"."vw_distribuicao_empresa_pedido" AS empresa_pedido 
         ON pedidos."cod_pedido" = empresa_pedido."cod_pedido"
     LEFT JOIN (
-SELECT
+        SELECT
             cod_pedido,
             cod_produto,
             mes_ref,
             SUM(custo_medio) as custo_medio
-    FROM (
-            SELECT 
-                cod_pedido,
-                cod_produto,
-                DATE_TRUNC('month', dt_faturamento) mes_ref,
-                CASE WHEN fator IS NULL Then ROUND(SUM(qtd * custo_unitario) / NULLIF(SUM(qtd), 0), 2)
-                Else ROUND(SUM(qtd * (custo_unitario/fator)) / NULLIF(SUM(qtd), 0), 2)  END custo_medio
-            FROM "databeautykami".tbl_varejo_cmv left join "databeautykami".tbl_distribuicao_bonificacao
-            ON tbl_varejo_cmv.cod_marca = tbl_distribuicao_bonificacao.cod_marca
-            and tbl_varejo_cmv.cod_empresa = cast(tbl_distribuicao_bonificacao.cod_empresa as varchar)
-            and DATE_TRUNC('month', dt_faturamento) = date(tbl_distribuicao_bonificacao.mes_ref)
-            GROUP BY 1, 2, 3, fator 
-            UNION ALL 
-            SELECT
-                cod_pedido,
-                codprod,
-                DATE_TRUNC('month', dtvenda) mes_ref,
-                CASE WHEN fator IS NULL Then ROUND(SUM(quant * custo) / NULLIF(SUM(quant), 0), 2)
-                Else ROUND(SUM(quant * (custo/fator)) / NULLIF(SUM(quant), 0), 2)  END custo_medio
-            FROM "databeautykami".tbl_salao_pedidos_salao left join "databeautykami".tbl_distribuicao_bonificacao
-            ON DATE_TRUNC('month', dtvenda) = date(tbl_distribuicao_bonificacao.mes_ref)
-            AND ( trim(upper(tbl_salao_pedidos_salao.categoria)) = trim(upper(tbl_distribuicao_bonificacao.marca))
-                  OR substring(replace(upper(tbl_salao_pedidos_salao.categoria),'-',''),1,4) = upper(tbl_distribuicao_bonificacao.marca)
-                  )
-            where fator is not null
-            GROUP BY 1, 2, 3 , fator   
-            ) cmv_aux
-            group by 1,2,3
+        FROM {_cmv_source(start_date, end_date)} cmv_fonte
+        GROUP BY 1, 2, 3
     ) cmv ON pedidos.cod_pedido = cmv.cod_pedido 
         AND item_pedidos.sku = cmv.cod_produto 
         AND DATE_TRUNC('month', pedidos.dt_faturamento) = cmv.mes_ref
@@ -214,7 +333,7 @@ SELECT
             'Venda de mercadoria sujeita ao regime de substituição tributária',
             'VENDA MERCADORIA FORA ESTADO', 'VENDA MERC. SUJEITA AO REGIME DE ST'
         )
-        AND date(pedidos."dt_faturamento") BETWEEN date('{start_date}') AND date('{end_date}')
+        AND {date_range_filter('pedidos."dt_faturamento"', start_date, end_date)}
         AND pedidos.operacoes_internas = 'N'
         AND (pedidos."origem" IN ('egestor','uno'))        
         {colaborador_filter}
@@ -227,31 +346,20 @@ SELECT
     LEFT JOIN bonificacao b ON f.mes_ref = b.mes_ref {' AND f.cod_colaborador = b.cod_colaborador' if cod_colaborador else ''}
     ORDER BY f.mes_ref{', f.vendedor' if cod_colaborador else ''}
     """
-    
-    logging.info(f"Query executada: {query}")
-    
-    df = query_athena(query)
+
+    df = query_athena(query, fetch='arrow', domain='vendas')
     return df
 
-def get_brand_data(cod_colaborador, start_date, end_date, selected_channels, selected_ufs, selected_nome_colaborador):
+@instrumented
+def get_brand_data(filters):
     try:
-        colaborador_filter = f"AND empresa_pedido.cod_colaborador_atual = '{cod_colaborador}'" if cod_colaborador else ""
+        start_date, end_date = filters.start_date, filters.end_date
+        colaborador_filter = sql_equals('empresa_pedido.cod_colaborador_atual', filters.cod_colaborador)
+        channel_filter = sql_in('pedidos.canal_venda', filters.channels)
+        uf_filter = sql_in('empresa_pedido.uf_empresa_faturamento', filters.ufs)
+        nome_filter = sql_in('empresa_pedido.nome_colaborador_atual', filters.nomes_colaborador)
+        item_partition_filter = partition_filter(query_athena, 'vw_distribuicao_item_pedidos', 'item_pedidos', start_date, end_date)
 
-        channel_filter = ""
-        if selected_channels:
-            channels_str = "', '".join(selected_channels)
-            channel_filter = f"AND pedidos.canal_venda IN ('{channels_str}')"
-        
-        uf_filter = ""
-        if selected_ufs:
-            ufs_str = "', '".join(selected_ufs)
-            uf_filter = f"AND empresa_pedido.uf_empresa_faturamento IN ('{ufs_str}')"
-
-        nome_filter = ""
-        if selected_nome_colaborador:
-            nome_str = "', '".join(selected_nome_colaborador)
-            nome_filter = f"AND empresa_pedido.nome_colaborador_atual IN ('{nome_str}')"            
-        
         query = f"""
         SELECT
         item_pedidos.marca,
@@ -271,47 +379,10 @@ def get_brand_data(cod_colaborador, start_date, end_date, selected_channels, sel
             "databeautykami"."vw_distribuicao_pedidos" pedidos
         LEFT JOIN "databeautykami"."vw_distribuicao_item_pedidos" AS item_pedidos 
             ON pedidos."cod_pedido" = item_pedidos."cod_pedido"
+            {item_partition_filter}
         LEFT JOIN "databeautykami"."vw_distribuicao_empresa_pedido" AS empresa_pedido 
             ON pedidos."cod_pedido" = empresa_pedido."cod_pedido"
-        LEFT JOIN (
-            SELECT
-            cod_pedido,
-            cod_produto,
-            mes_ref,
-            marca, 
-            SUM(custo_medio) as custo_medio 
-            FROM (            
-            SELECT 
-                cod_pedido,
-                cod_produto,
-                upper(marca.desc_abrev) marca,
-                DATE_TRUNC('month', dt_faturamento) mes_ref,
-                CASE WHEN fator IS NULL Then ROUND(SUM(qtd * custo_unitario) / NULLIF(SUM(qtd), 0), 2)
-                Else ROUND(SUM(qtd * (custo_unitario/fator)) / NULLIF(SUM(qtd), 0), 2)  END custo_medio
-            FROM "databeautykami".tbl_varejo_cmv left join "databeautykami".tbl_distribuicao_bonificacao
-                ON tbl_varejo_cmv.cod_marca = tbl_distribuicao_bonificacao.cod_marca
-                and tbl_varejo_cmv.cod_empresa = cast(tbl_distribuicao_bonificacao.cod_empresa as varchar)
-                and DATE_TRUNC('month', dt_faturamento) = date(tbl_distribuicao_bonificacao.mes_ref)
-                LEFT JOIN "databeautykami".tbl_varejo_marca marca ON marca.cod_marca = tbl_varejo_cmv.cod_marca
-                GROUP BY 1, 2, 3, 4, fator 
-                UNION ALL 
-                SELECT
-                    cod_pedido,
-                    codprod,
-                    upper(categoria) marca,
-                    DATE_TRUNC('month', dtvenda) mes_ref,
-                    CASE WHEN fator IS NULL Then ROUND(SUM(quant * custo) / NULLIF(SUM(quant), 0), 2)
-                    Else ROUND(SUM(quant * (custo/fator)) / NULLIF(SUM(quant), 0), 2)  END custo_medio
-                FROM "databeautykami".tbl_salao_pedidos_salao left join "databeautykami".tbl_distribuicao_bonificacao
-                ON DATE_TRUNC('month', dtvenda) = date(tbl_distribuicao_bonificacao.mes_ref)
-                AND ( trim(upper(tbl_salao_pedidos_salao.categoria)) = trim(upper(tbl_distribuicao_bonificacao.marca))
-                    OR substring(replace(upper(tbl_salao_pedidos_salao.categoria),'-',''),1,4) = upper(tbl_distribuicao_bonificacao.marca)
-                    )
-                where fator is not null
-                GROUP BY 1, 2, 3, 4 , fator   
-            ) cmv_aux
-            group by 1,2,3,4
-        ) cmv ON pedidos.cod_pedido = cmv.cod_pedido 
+        LEFT JOIN {_cmv_source(start_date, end_date)} cmv ON pedidos.cod_pedido = cmv.cod_pedido 
             AND item_pedidos.sku = cmv.cod_produto 
             AND DATE_TRUNC('month', pedidos.dt_faturamento) = cmv.mes_ref
         WHERE
@@ -322,7 +393,7 @@ def get_brand_data(cod_colaborador, start_date, end_date, selected_channels, sel
                 'Venda de mercadoria sujeita ao regime de substituição tributária',
                 'VENDA MERCADORIA FORA ESTADO', 'VENDA MERC. SUJEITA AO REGIME DE ST'
             )
-            AND date(pedidos."dt_faturamento") BETWEEN date('{start_date}') AND date('{end_date}')
+            AND {date_range_filter('pedidos."dt_faturamento"', start_date, end_date)}
             AND pedidos.operacoes_internas = 'N'
             AND (pedidos."origem" IN ('egestor','uno'))
             {colaborador_filter}
@@ -332,191 +403,33 @@ def get_brand_data(cod_colaborador, start_date, end_date, selected_channels, sel
             GROUP BY item_pedidos.marca
         ORDER BY faturamento DESC
         """
-        logging.info(f"Executando query para dados de marca: {query}")
-        df = query_athena(query)
-        logging.info(f"Query para dados de marca executada com sucesso. Retornando DataFrame com {len(df)} linhas.")
-        logging.info(f"Colunas retornadas: {df.columns.tolist()}")
-        logging.info(f"Tipos de dados das colunas:\n{df.dtypes}")
-        logging.info(f"Primeiras linhas do DataFrame:\n{df.head().to_string()}")
-        return df
+        return query_athena(query, domain='vendas')
     except Exception as e:
         logging.error(f"Erro ao obter dados de marca: {str(e)}", exc_info=True)
         return pd.DataFrame()
     
-def get_rfm_summary(cod_colaborador, start_date, end_date, selected_channels, selected_ufs):
-    colaborador_filter = f"AND b.cod_colaborador_atual = '{cod_colaborador}'" if cod_colaborador else ""
-    
-    channel_filter = ""
-    if selected_channels:
-        channels_str = "', '".join(selected_channels)
-        channel_filter = f"AND a.Canal_Venda IN ('{channels_str}')"
-    
-    uf_filter = ""
-    if selected_ufs:
-        ufs_str = "', '".join(selected_ufs)
-        uf_filter = f"AND a.uf_empresa IN ('{ufs_str}')"
+@st.cache_resource(ttl=CACHE_TTLS['rfm'], max_entries=64, show_spinner=False)
+def get_rfm_engine(filters):
+    # A base de clientes é buscada uma vez por conjunto de filtros; resumo e listas por
+    # segmento são calculados em memória a partir dela
+    return load_rfm_engine(query_athena, filters)
 
-    query = f"""
-    WITH rfm_base AS (
-        SELECT
-            a.Cod_Cliente,
-            a.uf_empresa,
-            a.Canal_Venda,
-            a.Recencia,
-            a.Positivacao AS Frequencia,
-            a.Monetario,
-            b.cod_colaborador_atual
-        FROM
-            databeautykami.vw_analise_perfil_cliente a
-        LEFT JOIN
-            databeautykami.vw_distribuicao_cliente_vendedor b ON a.Cod_Cliente = b.cod_cliente
-        WHERE 1 = 1         
-        {colaborador_filter}
-        {channel_filter}
-        {uf_filter}
-    ),
-    rfm_scores AS (
-        SELECT
-            *,
-            CASE
-                WHEN Recencia BETWEEN 0 AND 1 THEN 5
-                WHEN Recencia BETWEEN 2 AND 2 THEN 4
-                WHEN Recencia BETWEEN 3 AND 3 THEN 3
-                WHEN Recencia BETWEEN 4 AND 6 THEN 2
-                ELSE 1
-            END AS R_Score,
-            CASE
-                WHEN Frequencia >= 10 THEN 5
-                WHEN Frequencia BETWEEN 7 AND 9 THEN 4
-                WHEN Frequencia BETWEEN 3 AND 6 THEN 3
-                WHEN Frequencia BETWEEN 2 AND 2 THEN 2
-                ELSE 1
-            END AS F_Score,
-            NTILE(5) OVER (ORDER BY Monetario DESC) AS M_Score
-        FROM
-            rfm_base
-    ),
-    rfm_segments AS (
-        SELECT
-            *,
-            CASE
-                WHEN R_Score = 5 AND F_Score = 5  THEN 'Campeões'
-                WHEN R_Score >= 4 AND F_Score >= 4  THEN 'Clientes fiéis'
-                WHEN R_Score = 5 AND F_Score <= 2 THEN 'Novos clientes'
-                WHEN R_Score <= 2 AND F_Score <= 3 THEN 'Em risco'
-                WHEN R_Score = 1 AND F_Score = 1 THEN 'Perdidos'
-                WHEN R_Score = 3 AND F_Score = 1  THEN 'Atenção'
-                ELSE 'Outros'
-            END AS Segmento
-        FROM
-            rfm_scores
-    )
-    SELECT
-        Segmento,
-        Canal_Venda,
-        uf_empresa as Regiao,
-        COUNT(*) AS Numero_Clientes,
-        SUM(Monetario) AS Valor_Total,
-        AVG(Monetario) AS Valor_Medio,
-        AVG(R_Score) AS R_Score_Medio,
-        AVG(F_Score) AS F_Score_Medio,
-        AVG(M_Score) AS M_Score_Medio
-    FROM
-        rfm_segments
-    GROUP BY
-        Segmento, Canal_Venda, uf_empresa
-    ORDER BY
-        Valor_Total DESC, Canal_Venda;
-    """
-    return query_athena(query)
+def _rfm_filters(filters):
+    # O período não entra na base RFM: datas diferentes compartilham o mesmo motor
+    return filters.only('cod_colaborador', 'channels', 'ufs')
 
-def get_rfm_segment_clients(cod_colaborador, start_date, end_date, segment, selected_channels, selected_ufs):
-    colaborador_filter = f"AND b.cod_colaborador_atual = '{cod_colaborador}'" if cod_colaborador else ""
-    channel_filter = f"AND a.Canal_Venda IN ('{','.join(selected_channels)}')" if selected_channels else ""
-    uf_filter = f"AND a.uf_empresa IN ('{','.join(selected_ufs)}')" if selected_ufs else ""
+@instrumented
+def get_rfm_summary(filters):
+    return get_rfm_engine(_rfm_filters(filters)).summary()
 
-    query = f"""
-    WITH rfm_base AS (
-        SELECT
-            a.Cod_Cliente,
-            a.Nome_Cliente,
-            a.uf_empresa,
-            a.Canal_Venda,
-            a.Recencia,
-            a.Positivacao AS Frequencia,
-            a.Monetario,
-            a.ticket_medio_posit,
-            b.cod_colaborador_atual,
-            a.Maior_Mes as Mes_Ultima_Compra,
-            a.Ciclo_Vida as Life_Time
-        FROM
-            databeautykami.vw_analise_perfil_cliente a
-        LEFT JOIN
-            databeautykami.vw_distribuicao_cliente_vendedor b ON a.Cod_Cliente = b.cod_cliente
-        WHERE 1 = 1 
-        {colaborador_filter}
-        {channel_filter}
-        {uf_filter}
-    ),
-    rfm_scores AS (
-        SELECT
-            *,
-            CASE
-                WHEN Recencia BETWEEN 0 AND 1 THEN 5
-                WHEN Recencia BETWEEN 2 AND 2 THEN 4
-                WHEN Recencia BETWEEN 3 AND 3 THEN 3
-                WHEN Recencia BETWEEN 4 AND 6 THEN 2
-                ELSE 1
-            END AS R_Score,
-            CASE
-                WHEN Frequencia >= 10 THEN 5
-                WHEN Frequencia BETWEEN 7 AND 9 THEN 4
-                WHEN Frequencia BETWEEN 3 AND 6 THEN 3
-                WHEN Frequencia BETWEEN 2 AND 2 THEN 2
-                ELSE 1
-            END AS F_Score,
-            NTILE(5) OVER (ORDER BY Monetario DESC) AS M_Score
-        FROM
-            rfm_base
-    ),
-    rfm_segments AS (
-        SELECT
-            *,
-            CASE
-                WHEN R_Score = 5 AND F_Score = 5  THEN 'Campeões'
-                WHEN R_Score >= 3 AND F_Score >= 3  THEN 'Clientes fiéis'
-                WHEN R_Score = 5 AND F_Score <= 2 THEN 'Novos clientes'
-                WHEN R_Score <= 2 AND F_Score <= 3 THEN 'Em risco'
-                WHEN R_Score = 1 AND F_Score = 1 THEN 'Perdidos'
-                WHEN R_Score = 3 AND F_Score = 1  THEN 'Atenção'
-                ELSE 'Outros'
-            END AS Segmento
-        FROM
-            rfm_scores
-    )
-    SELECT
-        Cod_Cliente,
-        Nome_Cliente,
-        uf_empresa,
-        Canal_Venda,
-        Recencia,
-        Frequencia,
-        Monetario,
-        ticket_medio_posit,
-        R_Score,
-        F_Score,
-        M_Score,
-        Mes_Ultima_Compra,
-        Life_time,
-        Segmento
-    FROM
-        rfm_segments
-    WHERE
-        Segmento = '{segment}'
-    ORDER BY
-        Monetario DESC, Canal_Venda;
-    """
-    return query_athena(query)
+@instrumented
+def get_rfm_segment_clients(filters, segment):
+    return get_rfm_engine(_rfm_filters(filters)).segment_clients(segment)
+
+@instrumented
+def get_rfm_segment_page(filters, segment, after=None, limit=RFM_PAGE_SIZE):
+    # Uma página da lista do segmento; after = (Monetario, Cod_Cliente) do último cliente exibido
+    return get_rfm_engine(_rfm_filters(filters)).segment_page(segment, after, limit)
 
 def create_rfm_heatmap(rfm_summary):
     #st.write("Dados do RFM Summary:")
@@ -529,45 +442,36 @@ def create_rfm_heatmap(rfm_summary):
         st.error(f"Colunas ausentes no DataFrame: {', '.join(missing_columns)}")
         return None
 
-    # Criando a matriz de contagem
-    heatmap_data = pd.DataFrame(index=range(1, 6), columns=range(1, 6))
-    heatmap_data = heatmap_data.fillna(0)
-
     try:
-        for _, row in rfm_summary.iterrows():
-            r_score = int(round(row['R_Score_Medio']))
-            f_score = int(round(row['F_Score_Medio']))
-            num_clients = row['Numero_Clientes']
-            
-            # Garantir que os scores estão dentro do intervalo 1-5
-            r_score = max(1, min(5, r_score))
-            f_score = max(1, min(5, f_score))
-            
-            heatmap_data.at[r_score, f_score] += num_clients
-
-        #st.write("Mapa de calor gerado:")
-        #st.write(heatmap_data)
+        # Matriz 5x5 de contagem: scores arredondados e limitados a 1-5, somados com np.add.at
+        r_scores = np.clip(np.rint(rfm_summary['R_Score_Medio'].to_numpy(dtype=float)), 1, 5).astype(int)
+        f_scores = np.clip(np.rint(rfm_summary['F_Score_Medio'].to_numpy(dtype=float)), 1, 5).astype(int)
+        heatmap_data = np.zeros((5, 5))
+        np.add.at(heatmap_data, (r_scores - 1, f_scores - 1), rfm_summary['Numero_Clientes'].to_numpy(dtype=float))
+        scores = np.arange(1, 6)
 
         # Criando o mapa de calor
         fig = go.Figure(data=go.Heatmap(
-            z=heatmap_data.values,
-            x=heatmap_data.columns,
-            y=heatmap_data.index,
+            z=heatmap_data,
+            x=scores,
+            y=scores,
             colorscale='YlOrRd',
             hovertemplate='Recência: %{y}<br>Frequência: %{x}<br>Número de Clientes: %{z:.0f}<extra></extra>'
         ))
 
-        # Adicionando o texto com o número de clientes em cada célula
-        for i, row in heatmap_data.iterrows():
-            for j, value in row.items():
-                if value > 0:
-                    fig.add_annotation(
-                        x=j,
-                        y=i,
-                        text=str(int(value)),
-                        showarrow=False,
-                        font=dict(color="black" if value < heatmap_data.values.max()/2 else "white")
-                    )
+        # Número de clientes nas células preenchidas: um único trace de texto, com a cor
+        # da fonte escolhida por célula conforme a intensidade
+        rows, cols = np.nonzero(heatmap_data > 0)
+        values = heatmap_data[rows, cols]
+        fig.add_trace(go.Scatter(
+            x=scores[cols],
+            y=scores[rows],
+            mode='text',
+            text=values.astype(int).astype(str),
+            textfont=dict(color=np.where(values < heatmap_data.max() / 2, 'black', 'white')),
+            hoverinfo='skip',
+            showlegend=False,
+        ))
 
         fig.update_layout(
             title='Matriz RFM',
@@ -582,8 +486,30 @@ def create_rfm_heatmap(rfm_summary):
         st.error(f"Erro ao criar o mapa de calor: {str(e)}")
         return None   
 
-def get_channels_and_ufs(cod_colaborador, start_date, end_date):
+@st.cache_resource(ttl=timedelta(days=1), show_spinner=False)
+@instrumented
+def get_dimension_index(dia):
+    # Um índice por dia, compartilhado por todas as sessões do processo
+    return load_dimension_index(query_athena, DIMENSION_START_DATE, dia)
 
+def _dimension_index(filters):
+    # None quando o índice está desligado ou não cobre o período pedido (cai na query)
+    if not DIMENSION_INDEX_ENABLED:
+        return None
+    try:
+        index = get_dimension_index(date.today())
+    except Exception as e:
+        # Falha ao carregar o índice não fica em cache: esta chamada usa a query e a
+        # próxima tenta carregar o índice de novo
+        logging.warning(f"Índice de dimensões indisponível, usando a query: {str(e)}")
+        return None
+    return index if index.covers(filters.start_date, filters.end_date) else None
+
+@instrumented
+def get_channels_and_ufs(filters):
+    index = _dimension_index(filters)
+    if index is not None:
+        return index.channels_and_ufs(filters.start_date, filters.end_date, filters.cod_colaborador)
 
     query = f"""
     SELECT DISTINCT 
@@ -594,22 +520,20 @@ def get_channels_and_ufs(cod_colaborador, start_date, end_date):
     LEFT JOIN "databeautykami"."vw_distribuicao_empresa_pedido" AS empresa_pedido 
         ON pedidos."cod_pedido" = empresa_pedido."cod_pedido"
     WHERE
-        date(pedidos."dt_faturamento") BETWEEN date('{start_date}') AND date('{end_date}')
-        {'AND empresa_pedido.cod_colaborador_atual = ' + f"'{cod_colaborador}'" if cod_colaborador else ''}
+        {date_range_filter('pedidos."dt_faturamento"', filters.start_date, filters.end_date)}
+        {sql_equals('empresa_pedido.cod_colaborador_atual', filters.cod_colaborador)}
     """
-    df = query_athena(query)
+    df = query_athena(query, domain='dimensoes')
     return df['canal_venda'].unique().tolist(), df['uf_empresa_faturamento'].unique().tolist()
 
-def get_colaboradores(start_date, end_date, selected_channels=None, selected_ufs=None):
-    channel_filter = ""
-    if selected_channels:
-        channels_str = "', '".join(selected_channels)
-        channel_filter = f"AND pedidos.canal_venda IN ('{channels_str}')"
+@instrumented
+def get_colaboradores(filters):
+    index = _dimension_index(filters)
+    if index is not None:
+        return index.colaboradores(filters.start_date, filters.end_date, filters.channels, filters.ufs)
 
-    uf_filter = ""
-    if selected_ufs:
-        ufs_str = "', '".join(selected_ufs)
-        uf_filter = f"AND empresa_pedido.uf_empresa_faturamento IN ('{ufs_str}')"
+    channel_filter = sql_in('pedidos.canal_venda', filters.channels)
+    uf_filter = sql_in('empresa_pedido.uf_empresa_faturamento', filters.ufs)
 
     query = f"""
     SELECT DISTINCT
@@ -620,287 +544,33 @@ def get_colaboradores(start_date, end_date, selected_channels=None, selected_ufs
     LEFT JOIN "databeautykami"."vw_distribuicao_empresa_pedido" AS empresa_pedido 
         ON pedidos."cod_pedido" = empresa_pedido."cod_pedido"
     WHERE
-        date(pedidos."dt_faturamento") BETWEEN date('{start_date}') AND date('{end_date}')
+        {date_range_filter('pedidos."dt_faturamento"', filters.start_date, filters.end_date)}
         {channel_filter}
         {uf_filter}
     ORDER BY
         empresa_pedido.nome_colaborador_atual
     """
     
-    return query_athena(query)
+    return query_athena(query, domain='dimensoes')
 
-@st.cache_data
-def get_client_status(start_date, end_date, cod_colaborador, selected_channels, selected_ufs, selected_colaboradores):
-    colaborador_filter = ""
-    if cod_colaborador:
-        colaborador_filter = "AND vw_distribuicao_empresa_pedido.cod_colaborador_atual = '{}'".format(cod_colaborador)
-    elif selected_colaboradores:
-        colaboradores_str = "', '".join(selected_colaboradores)
-        colaborador_filter = "AND vw_distribuicao_empresa_pedido.nome_colaborador_atual IN ('{}')".format(colaboradores_str)
-    
-    channel_filter = ""
-    if selected_channels:
-        channels_str = "', '".join(selected_channels)
-        channel_filter = "AND vw_distribuicao_pedidos.canal_venda IN ('{}')".format(channels_str)
-    
-    uf_filter = ""
-    if selected_ufs:
-        ufs_str = "', '".join(selected_ufs)
-        uf_filter = "AND vw_distribuicao_empresa_pedido.uf_empresa_faturamento IN ('{}')".format(ufs_str)
-
-    query = """
-    WITH Meses AS (
-            SELECT 
-                DATE_TRUNC('month', date_add('month', -seq, DATE('2024-12-01'))) AS mes
-            FROM 
-                UNNEST(SEQUENCE(0, 15)) AS t(seq)
-    ),
-    PedidosComItens AS (
-        SELECT
-            vw_distribuicao_pedidos.cod_pedido,
-            vw_distribuicao_pedidos.cpfcnpj as cod_cliente,
-            vw_distribuicao_pedidos.dt_faturamento,
-            vw_distribuicao_empresa_pedido.nome_empresa_faturamento AS empresa,
-            vw_distribuicao_empresa_pedido.equipes,
-            vw_distribuicao_pedidos.origem,
-            vw_distribuicao_item_pedidos.marca,
-            vw_distribuicao_pedidos.canal_venda,
-            vw_distribuicao_pedidos.Operacoes_Internas,
-            vw_distribuicao_empresa_pedido.nome_colaborador_atual,
-            vw_distribuicao_empresa_pedido.nome_colaborador_pedido
-        FROM
-            databeautykami.vw_distribuicao_pedidos 
-        LEFT JOIN
-            databeautykami.vw_distribuicao_item_pedidos ON vw_distribuicao_pedidos.cod_pedido = vw_distribuicao_item_pedidos.cod_pedido
-        LEFT JOIN 
-            databeautykami.vw_distribuicao_empresa_pedido ON vw_distribuicao_empresa_pedido.cod_pedido = vw_distribuicao_pedidos.cod_pedido
-        WHERE vw_distribuicao_pedidos.desc_abrev_cfop IN (
-                'VENDA', 'VENDA DE MERC.SUJEITA ST', 'VENDA DE MERCADORIA P/ NÃO CONTRIBUINTE',
-                'VENDA DO CONSIGNADO', 'VENDA MERC. REC. TERCEIROS DESTINADA A ZONA FRANCA DE MANAUS',
-                'VENDA MERC.ADQ. BRASIL FORA ESTADO', 'VENDA MERCADORIA DENTRO DO ESTADO',
-                'VENDA MERCADORIA FORA ESTADO', 'Venda de mercadoria sujeita ao regime de substituição tributária',
-                'VENDA MERC. SUJEITA AO REGIME DE ST'
-            )
-            AND ("databeautykami"."vw_distribuicao_pedidos"."operacoes_internas" = 'N')
-            AND ("databeautykami"."vw_distribuicao_pedidos"."origem" IN ('egestor','uno'))
-            {channel_filter}
-            {uf_filter}
-            {colaborador_filter}
-    ),
-        PrimeirasCompras AS (
-            SELECT
-                cod_cliente,
-                MIN(DATE_TRUNC('month', dt_faturamento)) AS mes_primeira_compra
-            FROM 
-                PedidosComItens
-            GROUP BY
-                cod_cliente
-        ),
-        UltimaCompra AS (
-            SELECT
-                cod_cliente,
-                MAX(dt_faturamento) AS ultima_data_compra
-            FROM 
-                PedidosComItens
-            GROUP BY
-                cod_cliente
-        ),
-        ChurnClientes AS (
-            SELECT
-                mes,
-                cod_cliente
-            FROM (
-                SELECT
-                    m.mes,
-                    u.cod_cliente,
-                    ROW_NUMBER() OVER (PARTITION BY u.cod_cliente ORDER BY m.mes) as rn
-                FROM
-                    Meses m
-                JOIN
-                    UltimaCompra u ON u.ultima_data_compra < DATE_ADD('day', -180, m.mes) AND m.mes > date_parse('2023-07-01', '%Y-%m-%d')
-            ) sub
-            WHERE sub.rn = 1
-        ),
-        RecuperacaoClientes AS (
-            SELECT
-                cod_cliente,
-                DATE_TRUNC('month', dt_faturamento) AS mes_recuperacao,
-                CASE 
-                    WHEN (dt_faturamento > DATE_ADD('day', 90, penultima_data_compra) AND dt_faturamento <= DATE_ADD('day', 180, penultima_data_compra)) THEN 'Reativacao'
-                    WHEN (dt_faturamento > DATE_ADD('day', 180, penultima_data_compra)) THEN 'Recuperacao'
-                END AS Status_Cliente
-            FROM (
-                SELECT
-                    cod_cliente,
-                    dt_faturamento,
-                    LAG(dt_faturamento) OVER (PARTITION BY cod_cliente ORDER BY dt_faturamento) AS penultima_data_compra
-                FROM
-                    PedidosComItens
-            ) p
-            WHERE
-                dt_faturamento IS NOT NULL
-                AND penultima_data_compra IS NOT NULL
-                AND (dt_faturamento > DATE_ADD('day', 180, penultima_data_compra)
-                    OR (dt_faturamento > DATE_ADD('day', 90, penultima_data_compra) AND dt_faturamento <= DATE_ADD('day', 180, penultima_data_compra)))
-                AND DATE_TRUNC('month', dt_faturamento) >= DATE('2024-01-01')
-        ),
-        ClientesPositivados AS (
-            SELECT
-                cod_cliente,
-                DATE_TRUNC('month', dt_faturamento) AS mes_positivado
-            FROM
-                PedidosComItens
-            WHERE
-                DATE_TRUNC('month', dt_faturamento) >= DATE('2024-01-01')
-            GROUP BY
-                cod_cliente,
-                DATE_TRUNC('month', dt_faturamento)
-        ),
-        BaseClientes AS (
-            SELECT
-                m.mes,
-                COUNT(DISTINCT p.cod_cliente) AS total_clientes_base
-            FROM
-                Meses m
-            JOIN
-                PedidosComItens p ON p.dt_faturamento > DATE_ADD('day', -180, m.mes)
-                                AND p.dt_faturamento <= m.mes
-            WHERE
-                m.mes >= DATE('2024-01-01')
-            GROUP BY
-                m.mes
-        )
-
-    -- União final dos resultados
-        SELECT
-            m.mes,
-            'novas_aberturas' AS status,
-            COUNT(DISTINCT CASE WHEN p.mes_primeira_compra = m.mes THEN p.cod_cliente END) AS qtd
-        FROM
-            Meses m
-        LEFT JOIN
-            PrimeirasCompras p ON m.mes = p.mes_primeira_compra
-        WHERE
-            m.mes <= DATE_TRUNC('month', CURRENT_DATE)
-            AND m.mes BETWEEN date_trunc('month',date('{start_date}')) AND date_trunc('month',date('{end_date}')) 
-        GROUP BY
-            m.mes
-        HAVING 
-            COUNT(DISTINCT CASE WHEN p.mes_primeira_compra = m.mes THEN p.cod_cliente END) > 0
+def _query_client_status(query):
+    # O snapshot já é persistido pelo ClientStatusStore: não passa pelo cache de resultados
+    return query_athena(query, domain='status_clientes', use_cache=False, raise_errors=True)
 
-        UNION ALL
-
-        SELECT
-            m.mes,
-            'churn' AS status,
-            COUNT(DISTINCT CASE WHEN c.cod_cliente IS NOT NULL THEN c.cod_cliente END) AS qtd
-        FROM
-            Meses m
-        LEFT JOIN
-            ChurnClientes c ON m.mes = c.mes
-        WHERE
-            m.mes <= DATE_TRUNC('month', CURRENT_DATE)
-            AND m.mes BETWEEN date_trunc('month',date('{start_date}')) AND date_trunc('month',date('{end_date}'))
-        GROUP BY
-            m.mes
-        HAVING 
-            COUNT(DISTINCT CASE WHEN c.cod_cliente IS NOT NULL THEN c.cod_cliente END) > 0
+client_status_store = ClientStatusStore(_query_client_status)
 
-        UNION ALL
-
-        SELECT
-            m.mes,
-            'Recuperado' AS status,
-            COUNT(DISTINCT CASE WHEN r.mes_recuperacao = m.mes AND r.Status_Cliente = 'Recuperacao' THEN r.cod_cliente END) AS qtd
-        FROM
-            Meses m
-        LEFT JOIN
-            RecuperacaoClientes r ON m.mes = r.mes_recuperacao
-        WHERE
-            m.mes <= DATE_TRUNC('month', CURRENT_DATE)
-            AND m.mes BETWEEN date_trunc('month',date('{start_date}')) AND date_trunc('month',date('{end_date}'))
-        GROUP BY
-            m.mes
-        HAVING   
-            COUNT(DISTINCT CASE WHEN r.mes_recuperacao = m.mes AND r.Status_Cliente = 'Recuperacao' THEN r.cod_cliente END) > 0
-
-        UNION ALL
-
-        SELECT
-            m.mes,
-            'Reativado' AS status,
-            COUNT(DISTINCT CASE WHEN r.mes_recuperacao = m.mes AND r.Status_Cliente = 'Reativacao' THEN r.cod_cliente END) AS qtd
-        FROM
-            Meses m
-        LEFT JOIN
-            RecuperacaoClientes r ON m.mes = r.mes_recuperacao
-        WHERE
-            m.mes <= DATE_TRUNC('month', CURRENT_DATE)
-            AND m.mes BETWEEN date_trunc('month',date('{start_date}')) AND date_trunc('month',date('{end_date}'))
-        GROUP BY
-            m.mes
-        HAVING 
-            COUNT(DISTINCT CASE WHEN r.mes_recuperacao = m.mes AND r.Status_Cliente = 'Reativacao' THEN r.cod_cliente END) > 0
-
-        UNION ALL
-
-        SELECT
-            m.mes,
-            'Positivado' AS status,
-            COUNT(DISTINCT cp.cod_cliente) AS qtd
-        FROM
-            Meses m
-        JOIN
-            ClientesPositivados cp ON m.mes = cp.mes_positivado
-        LEFT JOIN
-            PrimeirasCompras pc ON cp.cod_cliente = pc.cod_cliente AND cp.mes_positivado = pc.mes_primeira_compra
-        LEFT JOIN
-            ChurnClientes cc ON cp.cod_cliente = cc.cod_cliente AND cp.mes_positivado = cc.mes
-        LEFT JOIN
-            RecuperacaoClientes rc ON cp.cod_cliente = rc.cod_cliente AND cp.mes_positivado = rc.mes_recuperacao
-        WHERE
-            m.mes <= DATE_TRUNC('month', CURRENT_DATE)
-            AND m.mes BETWEEN date_trunc('month',date('{start_date}')) AND date_trunc('month',date('{end_date}'))
-            AND pc.cod_cliente IS NULL
-            AND cc.cod_cliente IS NULL
-            AND rc.cod_cliente IS NULL
-        GROUP BY
-            m.mes
-        HAVING 
-            COUNT(DISTINCT cp.cod_cliente) > 0
-
-        UNION ALL
-
-        SELECT
-            mes,
-            'Base' AS status,
-            total_clientes_base AS qtd
-        FROM
-            BaseClientes
-        WHERE
-            mes <= DATE_TRUNC('month', CURRENT_DATE)
-            AND mes BETWEEN date_trunc('month',date('{start_date}')) AND date_trunc('month',date('{end_date}'))
-
-        ORDER BY
-            mes, status
-   """.format(
-        start_date=start_date,
-        end_date=end_date,
-        channel_filter=channel_filter,
-        uf_filter=uf_filter,
-        colaborador_filter=colaborador_filter
-    )
+@st.cache_data(ttl=STATUS_OPEN_MONTH_TTL)
+@instrumented
+def get_client_status(filters):
+    try:
+        df = client_status_store.load(filters)
+    except Exception as e:
+        logging.error(f"Erro ao obter status de clientes: {str(e)}", exc_info=True)
+        st.error(f"Erro ao obter status de clientes: {str(e)}")
+        return pd.DataFrame()
 
-    logging.info(f"Executing query for client status: {query}")
-    df = query_athena(query)
-    
     if df.empty:
         logging.warning("No data returned from client status query")
-    else:
-        logging.info(f"Client status data retrieved. Shape: {df.shape}")
-        logging.info(f"Columns: {df.columns}")
-        logging.info(f"First few rows:\n{df.head()}")
-    
     return df
 
 def create_client_status_chart(df):
@@ -932,7 +602,7 @@ def create_client_status_chart(df):
                 y=df_percentages[col], 
                 name=col,
                 marker_color=colors[i % len(colors)],
-                text=df_percentages[col].apply(lambda x: f'{x:.1f}%'),
+                texttemplate='%{y:.1f}%',
                 textposition='inside',
             ),
             secondary_y=False,
@@ -945,7 +615,7 @@ def create_client_status_chart(df):
             y=df_pivot['Base'], 
             name='Base Total',
             marker_color='rgba(0,0,0,0.2)',
-            text=df_pivot['Base'].apply(lambda x: f'{x:,.0f}'),
+            texttemplate='%{y:,.0f}',
             textposition='outside',
         ),
         secondary_y=True,